@@ -0,0 +1,179 @@
+import math
+import os
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Optional
+
+@dataclass
+class TokenBucket:
+    rate: float
+    capacity: float
+    tokens: float
+    updated: float
+
+    def try_acquire(self, now: float, cost: float = 1.0) -> float:
+        """Take ``cost`` tokens; return 0 on success or the seconds until they would be available
+
+        A cost above ``capacity`` is taken from a full bucket, leaving it in
+        debt until the refill has paid for it.
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= min(cost, self.capacity):
+            self.tokens -= cost
+            return 0.0
+        return (min(cost, self.capacity) - self.tokens) / self.rate
+
+    def refund(self, cost: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + cost)
+
+    def is_full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+@dataclass
+class AdmissionDecision:
+    allowed: bool
+    retry_after: float = 0.0
+    reason: Optional[str] = None
+
+    @property
+    def retry_after_header(self) -> str:
+        """Retry-After value in whole seconds (at least 1)"""
+        return str(max(1, math.ceil(self.retry_after)))
+
+class AdmissionRejected(Exception):
+    """Raised by ingest paths that cannot return an HTTP 429 directly"""
+    def __init__(self, decision: AdmissionDecision):
+        super().__init__(decision.reason)
+        self.decision = decision
+        self.retry_after = decision.retry_after
+
+@dataclass
+class QueueProbe:
+    depth: Callable[[], int]
+    high_water: int
+    # Rough seconds for the queue to drain back under its high-water mark
+    drain_seconds: float = 1.0
+
+@dataclass
+class AdmissionController:
+    """Per-device token buckets plus a global in-flight budget and queue high-water marks
+
+    Each reading costs one token from its device's bucket. Bulk uploads of
+    buffered readings are charged in full to a separate per-device bucket
+    that fills at the same rate up to ``device_bulk_burst``, so a device
+    coming back online can upload its backlog without starving its live
+    readings, but cannot exceed its rate by sending large arrays. Independently of the
+    device, a request is refused while the number of readings currently being
+    processed would exceed ``max_in_flight`` or any registered internal queue
+    (batch, persistence, broadcast, ...) is above its high-water mark.
+    """
+    device_rate: float = 2.0
+    device_burst: float = 20.0
+    device_bulk_burst: float = 3600.0
+    max_in_flight: int = 500
+    max_tracked_devices: int = 10_000
+    buckets: Dict[str, TokenBucket] = field(default_factory=dict)
+    bulk_buckets: Dict[str, TokenBucket] = field(default_factory=dict)
+    queues: Dict[str, QueueProbe] = field(default_factory=dict)
+    in_flight: int = 0
+    admitted: int = 0
+    throttled_devices: Counter = field(default_factory=Counter)
+    rejections: Counter = field(default_factory=Counter)
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        return cls(
+            device_rate=float(os.getenv("INGEST_DEVICE_RATE", "2.0")),
+            device_burst=float(os.getenv("INGEST_DEVICE_BURST", "20")),
+            device_bulk_burst=float(os.getenv("INGEST_DEVICE_BULK_BURST", "3600")),
+            max_in_flight=int(os.getenv("INGEST_MAX_IN_FLIGHT", "500"))
+        )
+
+    def register_queue(self, name: str, depth: Callable[[], int], high_water: int, drain_seconds: float = 1.0) -> None:
+        """Watch an internal queue; ingest is refused while it is above ``high_water``"""
+        self.queues[name] = QueueProbe(depth=depth, high_water=high_water, drain_seconds=drain_seconds)
+
+    def _bucket(self, device_id: str, now: float, bulk: bool = False) -> TokenBucket:
+        buckets, capacity = (self.bulk_buckets, self.device_bulk_burst) if bulk else (self.buckets, self.device_burst)
+        bucket = buckets.get(device_id)
+        if bucket is None:
+            if len(buckets) >= self.max_tracked_devices:
+                # A full bucket behaves exactly like a missing one, so it can be dropped
+                for idle in [d for d, b in buckets.items() if b.is_full(now)]:
+                    del buckets[idle]
+            bucket = buckets[device_id] = TokenBucket(
+                rate=self.device_rate, capacity=capacity, tokens=capacity, updated=now
+            )
+        return bucket
+
+    def _count_throttled(self, device_id: str) -> None:
+        self.throttled_devices[device_id] += 1
+        if len(self.throttled_devices) > self.max_tracked_devices:
+            # Keep the most throttled half so the counter stays bounded
+            self.throttled_devices = Counter(dict(self.throttled_devices.most_common(self.max_tracked_devices // 2)))
+
+    def _reject(self, reason: str, retry_after: float, device_id: Optional[str] = None) -> AdmissionDecision:
+        self.rejections[reason] += 1
+        if device_id is not None:
+            self._count_throttled(device_id)
+        return AdmissionDecision(allowed=False, retry_after=retry_after, reason=reason)
+
+    def admit(self, device_ids: Iterable[str], bulk: bool = False) -> AdmissionDecision:
+        """Decide whether a request carrying one reading per entry of ``device_ids`` may proceed
+
+        ``bulk`` charges the devices' bulk-upload buckets instead of their
+        live ones. On success the readings count against the in-flight
+        budget until ``release`` is called with the same count.
+        """
+        costs = Counter(device_ids)
+        count = sum(costs.values())
+
+        if self.in_flight + count > self.max_in_flight and self.in_flight > 0:
+            return self._reject("in_flight_budget", 1.0)
+
+        for name, probe in self.queues.items():
+            if probe.depth() > probe.high_water:
+                return self._reject(f"queue_{name}", probe.drain_seconds)
+
+        now = time.monotonic()
+        buckets = {device_id: self._bucket(device_id, now, bulk) for device_id in costs}
+        waits = {device_id: buckets[device_id].try_acquire(now, cost) for device_id, cost in costs.items()}
+        throttled = {device_id: wait for device_id, wait in waits.items() if wait > 0}
+        if throttled:
+            # Refund devices that were admitted so a mixed bulk request is all-or-nothing
+            for device_id, cost in costs.items():
+                if device_id not in throttled:
+                    buckets[device_id].refund(cost)
+            device_id = max(throttled, key=throttled.get)
+            for other in throttled:
+                if other != device_id:
+                    self._count_throttled(other)
+            return self._reject("device_rate_limit", throttled[device_id], device_id)
+
+        self.in_flight += count
+        self.admitted += count
+        return AdmissionDecision(allowed=True)
+
+    def release(self, count: int) -> None:
+        """Return ``count`` readings to the in-flight budget"""
+        self.in_flight = max(0, self.in_flight - count)
+
+    def stats(self, top: int = 20) -> Dict[str, object]:
+        return {
+            "admitted_readings": self.admitted,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "device_rate_per_second": self.device_rate,
+            "device_burst": self.device_burst,
+            "device_bulk_burst": self.device_bulk_burst,
+            "tracked_devices": len(self.buckets),
+            "tracked_bulk_devices": len(self.bulk_buckets),
+            "rejections": dict(self.rejections),
+            "queues": {
+                name: {"depth": probe.depth(), "high_water": probe.high_water}
+                for name, probe in self.queues.items()
+            },
+            "throttled_devices": dict(self.throttled_devices.most_common(top))
+        }
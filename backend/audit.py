@@ -0,0 +1,372 @@
+"""Bulk audit of anchored batches
+
+Streams every ``proof_anchors`` row, reloads its ``batch_contents`` in batch
+order, recomputes the batch hash in a process pool and compares it with the
+stored ``data_hash`` and, when a topic message lookup is available (the
+local topic index), with the message published on HCS. Mismatches are
+reported per batch.
+
+Usage::
+
+    python audit.py --report audit_report.json
+
+Runs are resumable through a checkpoint file (the batch_id cursor plus the
+results so far). The final report is signed with HMAC-SHA256 using
+``AUDIT_SIGNING_KEY`` so it can be checked with ``verify_report_signature``.
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, asdict
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from database import get_supabase
+from batch_codecs import gzip_member
+from batch_encoding import BatchEncodingError, encode_records
+from hedera_service import (
+    HASH_SCHEME_COLUMNAR,
+    HASH_SCHEME_JSON_GZIP,
+    HASH_SCHEME_JSON_SHA256,
+    HASH_SCHEME_LEGACY,
+    serialize_batch_records,
+)
+from topic_index import TopicIndex
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 500
+# Legacy batches carry the seal time in the gzip header; it is searched from
+# just before the newest reading up to this many seconds after it
+LEGACY_MTIME_WINDOW = (-5, 900)
+
+MessageLookup = Callable[[str], Optional[Dict[str, Any]]]
+
+def _legacy_mtime_hint(records: List[Dict[str, Any]]) -> Optional[int]:
+    timestamps = [r.get("timestamp") for r in records if r.get("timestamp")]
+    if not timestamps:
+        return None
+    return int(datetime.fromisoformat(max(timestamps)).timestamp())
+
+def recompute_batch_hash(records: List[Dict[str, Any]], hash_scheme: Optional[str],
+                         expected_hash: str) -> Tuple[Optional[str], Dict[str, Any]]:
+    """Recompute a batch hash from its stored readings; return (hash, details)
+
+    For legacy batches the gzip mtime is unknown, so the search window around
+    the newest reading is tried and the matching hash (if any) is returned.
+    Only the 4 mtime header bytes change between candidates, so the deflate
+    stream is computed once.
+    """
+    if hash_scheme == HASH_SCHEME_COLUMNAR:
+        try:
+            return hashlib.sha256(encode_records(records)).hexdigest(), {}
+        except BatchEncodingError as e:
+            return None, {"reason": str(e)}
+
+    json_data = serialize_batch_records(records)
+    if hash_scheme in (None, HASH_SCHEME_LEGACY):
+        hint = _legacy_mtime_hint(records)
+        if hint is None:
+            return None, {"reason": "no timestamps to derive gzip mtime"}
+        member = bytearray(gzip_member(json_data, hint))
+        for offset in range(LEGACY_MTIME_WINDOW[0], LEGACY_MTIME_WINDOW[1] + 1):
+            member[4:8] = (hint + offset).to_bytes(4, "little")
+            candidate = hashlib.sha256(member).hexdigest()
+            if candidate == expected_hash:
+                return candidate, {"gzip_mtime": hint + offset}
+        return hashlib.sha256(gzip_member(json_data, hint)).hexdigest(), {"reason": "no gzip mtime in window matched"}
+
+    if hash_scheme == HASH_SCHEME_JSON_GZIP:
+        return hashlib.sha256(gzip_member(json_data)).hexdigest(), {}
+
+    if hash_scheme == HASH_SCHEME_JSON_SHA256:
+        return hashlib.sha256(json_data).hexdigest(), {}
+
+    return None, {"reason": f"unknown hash scheme {hash_scheme}"}
+
+def sign_report(report: Dict[str, Any], key: bytes) -> str:
+    payload = json.dumps(report, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hmac.new(key, payload, hashlib.sha256).hexdigest()
+
+def verify_report_signature(signed_report: Dict[str, Any], key: bytes) -> bool:
+    """Check the HMAC-SHA256 signature of a report produced by AuditRunner"""
+    report = dict(signed_report)
+    signature = report.pop("signature", None)
+    report.pop("signature_algorithm", None)
+    return signature is not None and hmac.compare_digest(signature, sign_report(report, key))
+
+def iter_proof_anchors(client, after_batch_id: Optional[str] = None, page_size: int = PAGE_SIZE) -> Iterator[Dict]:
+    """Yield proof_anchors rows ordered by batch_id, starting after the given cursor"""
+    cursor = after_batch_id
+    while True:
+        query = client.table("proof_anchors").select("*")
+        if cursor is not None:
+            query = query.gt("batch_id", cursor)
+        rows = query.order("batch_id").limit(page_size).execute().data
+        yield from rows
+        if len(rows) < page_size:
+            return
+        cursor = rows[-1]["batch_id"]
+
+def load_batch_records(client, batch_id: str) -> List[Dict[str, Any]]:
+    """Stored readings of a batch in their original batch order"""
+    records = []
+    offset = 0
+    while True:
+        rows = (
+            client.table("batch_contents").select("reading_data,batch_position").eq("batch_id", batch_id)
+            .order("batch_position").range(offset, offset + 999).execute().data
+        )
+        records.extend(row["reading_data"] for row in rows)
+        if len(rows) < 1000:
+            return records
+        offset += 1000
+
+@dataclass
+class BatchAuditResult:
+    batch_id: str
+    status: str
+    stored_hash: str
+    recomputed_hash: Optional[str] = None
+    hcs_status: str = "unchecked"
+    issues: List[str] = field(default_factory=list)
+    details: Dict[str, Any] = field(default_factory=dict)
+
+def compare_batch(proof: Dict[str, Any], recomputed_hash: Optional[str], details: Dict[str, Any],
+                  reading_count: int, hcs_message: Optional[Dict[str, Any]], hcs_checked: bool) -> BatchAuditResult:
+    """Turn a recomputed hash and HCS message into an audit verdict for one batch"""
+    result = BatchAuditResult(
+        batch_id=proof["batch_id"],
+        status="ok",
+        stored_hash=proof["data_hash"],
+        recomputed_hash=recomputed_hash,
+        details=details
+    )
+    metadata = proof.get("batch_metadata") or {}
+    if reading_count == 0:
+        result.issues.append("missing_contents")
+    elif metadata.get("reading_count") not in (None, reading_count):
+        result.issues.append("reading_count_mismatch")
+    if recomputed_hash != proof["data_hash"]:
+        result.issues.append("hash_mismatch")
+
+    if hcs_checked:
+        if hcs_message is None:
+            result.hcs_status = "missing"
+            result.issues.append("hcs_message_missing")
+        elif hcs_message.get("data_hash") != proof["data_hash"]:
+            result.hcs_status = "mismatch"
+            result.issues.append("hcs_hash_mismatch")
+        else:
+            result.hcs_status = "match"
+
+    if result.issues:
+        result.status = "mismatch"
+    return result
+
+@dataclass
+class AuditCheckpoint:
+    path: Optional[str]
+    last_batch_id: Optional[str] = None
+    batches_checked: int = 0
+    batches_ok: int = 0
+    mismatches: List[Dict[str, Any]] = field(default_factory=list)
+    elapsed_seconds: float = 0.0
+    started_at: str = field(default_factory=lambda: datetime.now().isoformat())
+
+    @classmethod
+    def load(cls, path: Optional[str]) -> "AuditCheckpoint":
+        if path and os.path.exists(path):
+            with open(path) as f:
+                return cls(path=path, **json.load(f))
+        return cls(path=path)
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        data = asdict(self)
+        data.pop("path")
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+class AuditRunner:
+    def __init__(self, client, checkpoint: AuditCheckpoint, message_lookup: Optional[MessageLookup] = None,
+                 workers: Optional[int] = None, signing_key: Optional[bytes] = None, window: int = 64):
+        self.client = client
+        self.checkpoint = checkpoint
+        self.message_lookup = message_lookup
+        self.workers = workers
+        self.signing_key = signing_key
+        # Batches loaded and hashing at once
+        self.window = window
+        self.running = False
+
+    async def _audit_proof(self, pool: ProcessPoolExecutor, proof: Dict[str, Any]) -> BatchAuditResult:
+        records = await asyncio.to_thread(load_batch_records, self.client, proof["batch_id"])
+        scheme = (proof.get("batch_metadata") or {}).get("hash_scheme")
+        loop = asyncio.get_running_loop()
+        recomputed_hash, details = await loop.run_in_executor(
+            pool, recompute_batch_hash, records, scheme, proof["data_hash"]
+        )
+        hcs_message = self.message_lookup(proof["batch_id"]) if self.message_lookup else None
+        return compare_batch(proof, recomputed_hash, details, len(records), hcs_message, self.message_lookup is not None)
+
+    def _record(self, result: BatchAuditResult) -> None:
+        self.checkpoint.batches_checked += 1
+        if result.status == "ok":
+            self.checkpoint.batches_ok += 1
+        else:
+            self.checkpoint.mismatches.append(asdict(result))
+            logger.warning(f"❌ Batch {result.batch_id} failed audit: {result.issues}")
+
+    async def run(self) -> Dict[str, Any]:
+        """Audit every batch after the checkpoint cursor and return the signed report"""
+        self.running = True
+        started = time.perf_counter()
+        elapsed_before = self.checkpoint.elapsed_seconds
+        pool = ProcessPoolExecutor(max_workers=self.workers)
+        try:
+            proofs = iter_proof_anchors(self.client, self.checkpoint.last_batch_id)
+            while True:
+                window = await asyncio.to_thread(lambda: [p for _, p in zip(range(self.window), proofs)])
+                if not window:
+                    break
+                results = await asyncio.gather(*(self._audit_proof(pool, proof) for proof in window))
+                for result in results:
+                    self._record(result)
+                # Proofs stream in batch_id order, so the last one of a window is a safe cursor
+                self.checkpoint.last_batch_id = window[-1]["batch_id"]
+                self.checkpoint.elapsed_seconds = elapsed_before + time.perf_counter() - started
+                self.checkpoint.save()
+        finally:
+            pool.shutdown()
+            self.running = False
+        return self.report()
+
+    def report(self) -> Dict[str, Any]:
+        elapsed = self.checkpoint.elapsed_seconds
+        report = {
+            "report_type": "batch_hash_audit",
+            "started_at": self.checkpoint.started_at,
+            "generated_at": datetime.now().isoformat(),
+            "batches_checked": self.checkpoint.batches_checked,
+            "batches_ok": self.checkpoint.batches_ok,
+            "batches_mismatched": len(self.checkpoint.mismatches),
+            "hcs_checked": self.message_lookup is not None,
+            "elapsed_seconds": round(elapsed, 3),
+            "batches_per_second": round(self.checkpoint.batches_checked / elapsed, 2) if elapsed > 0 else None,
+            "last_batch_id": self.checkpoint.last_batch_id,
+            "mismatches": self.checkpoint.mismatches
+        }
+        if self.signing_key:
+            report["signature"] = sign_report(report, self.signing_key)
+            report["signature_algorithm"] = "HMAC-SHA256"
+        return report
+
+class AuditJob:
+    """Background audit run owned by the API process"""
+
+    def __init__(self, checkpoint_path: Optional[str] = None, report_path: Optional[str] = None):
+        self.checkpoint_path = checkpoint_path
+        self.report_path = report_path
+        self.runner: Optional[AuditRunner] = None
+        self.task: Optional[asyncio.Task] = None
+        self.last_report: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def start(self, client, message_lookup: Optional[MessageLookup] = None, resume: bool = True) -> bool:
+        """Start an audit unless one is already running; return whether it started"""
+        if self.running:
+            return False
+        if not resume and self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        signing_key = os.getenv("AUDIT_SIGNING_KEY")
+        self.runner = AuditRunner(
+            client,
+            AuditCheckpoint.load(self.checkpoint_path),
+            message_lookup=message_lookup,
+            signing_key=signing_key.encode() if signing_key else None
+        )
+        self.error = None
+        self.task = asyncio.create_task(self._run())
+        return True
+
+    async def _run(self) -> None:
+        try:
+            self.last_report = await self.runner.run()
+            if self.report_path:
+                with open(self.report_path, "w") as f:
+                    json.dump(self.last_report, f, indent=2)
+            if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+                # A finished audit starts from the beginning next time
+                os.remove(self.checkpoint_path)
+        except Exception as e:
+            self.error = str(e)
+            logger.error(f"Audit job failed: {e}")
+
+    def status(self) -> Dict[str, Any]:
+        progress = self.runner.report() if self.runner else None
+        return {
+            "running": self.running,
+            "error": self.error,
+            "progress": {k: v for k, v in progress.items() if k != "mismatches"} if progress else None,
+            "last_report": self.last_report
+        }
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Recompute and cross-check every anchored batch hash")
+    parser.add_argument("--report", default="audit_report.json", help="Where to write the signed report")
+    parser.add_argument("--checkpoint", default=".audit_checkpoint.json", help="Checkpoint file for resuming")
+    parser.add_argument("--restart", action="store_true", help="Ignore any existing checkpoint")
+    parser.add_argument("--workers", type=int, default=None, help="Hashing processes (default: CPU count)")
+    parser.add_argument("--topic-index", help="SQLite topic index (see topic_index.py) to cross-check HCS messages")
+    return parser.parse_args(argv)
+
+async def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    client = get_supabase()
+    if client is None:
+        logger.error("Supabase not configured")
+        return 1
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+
+    signing_key = os.getenv("AUDIT_SIGNING_KEY")
+    if not signing_key:
+        logger.warning("AUDIT_SIGNING_KEY not set - report will be unsigned")
+    index = TopicIndex(args.topic_index) if args.topic_index else None
+    runner = AuditRunner(
+        client,
+        AuditCheckpoint.load(args.checkpoint),
+        message_lookup=index.lookup_batch if index else None,
+        workers=args.workers,
+        signing_key=signing_key.encode() if signing_key else None
+    )
+    report = await runner.run()
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    if os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+
+    logger.info(
+        f"Audited {report['batches_checked']} batches ({report['batches_per_second']} batches/s): "
+        f"{report['batches_mismatched']} mismatched. Report: {args.report}"
+    )
+    return 1 if report["batches_mismatched"] else 0
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(main()))
@@ -0,0 +1,316 @@
+"""Re-anchor historical readings that never received a Hedera proof
+
+Usage::
+
+    python backfill.py --start 2025-10-01T00:00:00 --end 2025-10-08T00:00:00
+
+The time range is split into fixed windows. For each window the readings in
+``energy_readings`` are paged with a keyset cursor on (timestamp, id), readings
+that already appear in ``batch_contents`` are dropped, and the rest are cut
+into batches hashed with ``compute_batch_hash`` (the same canonical hashing
+as live ingest) in a process pool. Batches are submitted to HCS through a
+rate-limited pipeline and stored like live proofs.
+
+Progress is written to a checkpoint file after every window, so an
+interrupted run resumes where it stopped. Windows that are already fully
+anchored are skipped without any HCS traffic.
+
+Readings newer than the live horizon may still sit in a running server's
+open batch and are not in ``batch_contents`` yet, so windows ending after
+``now - live horizon`` are left for a later run instead of being anchored
+twice. The horizon defaults to the longest a live batch stays open
+(``BATCH_MAX_PROOF_DELAY_SECONDS``, or the fixed 60 minute batch age) plus
+a submission margin; pass ``--live-horizon-minutes 0`` when no server is
+ingesting.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from admission import TokenBucket
+from batch_control import BatchTargets
+from database import get_supabase
+from energy_reading import EnergyReading, ReadingValidationError
+from batch_codecs import get_codec
+from hedera_service import EnergyBatch, HederaService, compute_batch_hash
+import proof_store
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 1000
+# Time for a sealed live batch to be submitted and stored after it is due
+SUBMISSION_MARGIN = timedelta(minutes=5)
+
+@dataclass
+class BackfillCheckpoint:
+    path: str
+    start: str
+    end: str
+    completed_windows: Set[str] = field(default_factory=set)
+    batches_submitted: int = 0
+    readings_anchored: int = 0
+
+    @classmethod
+    def load(cls, path: str, start: datetime, end: datetime) -> "BackfillCheckpoint":
+        checkpoint = cls(path=path, start=start.isoformat(), end=end.isoformat())
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            if data.get("start") == checkpoint.start and data.get("end") == checkpoint.end:
+                checkpoint.completed_windows = set(data.get("completed_windows", []))
+                checkpoint.batches_submitted = data.get("batches_submitted", 0)
+                checkpoint.readings_anchored = data.get("readings_anchored", 0)
+            else:
+                logger.warning(f"Checkpoint {path} is for a different range, starting fresh")
+        return checkpoint
+
+    def save(self) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "start": self.start,
+                "end": self.end,
+                "completed_windows": sorted(self.completed_windows),
+                "batches_submitted": self.batches_submitted,
+                "readings_anchored": self.readings_anchored,
+                "updated_at": datetime.now().isoformat()
+            }, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+def iter_windows(start: datetime, end: datetime, window: timedelta) -> Iterator[Tuple[datetime, datetime]]:
+    window_start = start
+    while window_start < end:
+        window_end = min(window_start + window, end)
+        yield window_start, window_end
+        window_start = window_end
+
+def scan_readings(client, start: datetime, end: datetime, device_id: Optional[str] = None,
+                  page_size: int = PAGE_SIZE) -> Iterator[Dict]:
+    """Yield energy_readings rows in [start, end) ordered by (timestamp, id) using a keyset cursor"""
+    cursor: Optional[Tuple[str, object]] = None
+    while True:
+        query = client.table("energy_readings").select("*").lt("timestamp", end.isoformat())
+        if device_id:
+            query = query.eq("device_id", device_id)
+        if cursor is None:
+            query = query.gte("timestamp", start.isoformat())
+        else:
+            ts, row_id = cursor
+            query = query.or_(f"timestamp.gt.{ts},and(timestamp.eq.{ts},id.gt.{row_id})")
+        rows = query.order("timestamp").order("id").limit(page_size).execute().data
+        yield from rows
+        if len(rows) < page_size:
+            return
+        cursor = (rows[-1]["timestamp"], rows[-1]["id"])
+
+def anchored_keys(client, start: datetime, end: datetime) -> Set[Tuple[str, str]]:
+    """(device_id, timestamp) pairs in [start, end) that already belong to an anchored batch"""
+    keys = set()
+    offset = 0
+    while True:
+        rows = (
+            client.table("batch_contents").select("device_id,original_timestamp")
+            .gte("original_timestamp", start.isoformat()).lt("original_timestamp", end.isoformat())
+            .order("original_timestamp").range(offset, offset + PAGE_SIZE - 1).execute().data
+        )
+        keys.update((row["device_id"], _normalize_ts(row["original_timestamp"])) for row in rows)
+        if len(rows) < PAGE_SIZE:
+            return keys
+        offset += PAGE_SIZE
+
+def default_live_horizon() -> timedelta:
+    """Longest a live reading can wait in an open batch before its proof is stored"""
+    max_open_seconds = max(BatchTargets.from_env().max_proof_delay_seconds, 60 * 60)
+    return timedelta(seconds=max_open_seconds) + SUBMISSION_MARGIN
+
+def _normalize_ts(value: str) -> str:
+    return datetime.fromisoformat(value).isoformat()
+
+class Backfiller:
+    def __init__(self, client, hedera_service: HederaService, checkpoint: BackfillCheckpoint,
+                 batch_size: int = 1000, workers: Optional[int] = None, submissions_per_second: float = 2.0,
+                 max_concurrent_submissions: int = 4, device_id: Optional[str] = None, dry_run: bool = False,
+                 live_horizon: Optional[timedelta] = None):
+        self.client = client
+        self.hedera_service = hedera_service
+        self.checkpoint = checkpoint
+        self.batch_size = batch_size
+        self.device_id = device_id
+        self.dry_run = dry_run
+        self.live_horizon = default_live_horizon() if live_horizon is None else live_horizon
+        self.deferred_windows = 0
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        self.rate_limiter = TokenBucket(
+            rate=submissions_per_second, capacity=max(1.0, submissions_per_second),
+            tokens=max(1.0, submissions_per_second), updated=time.monotonic()
+        )
+        self.submission_slots = asyncio.Semaphore(max_concurrent_submissions)
+        self.failures = 0
+
+    async def _rate_limit(self) -> None:
+        while True:
+            wait = self.rate_limiter.try_acquire(time.monotonic())
+            if wait == 0:
+                return
+            await asyncio.sleep(wait)
+
+    def _load_window(self, start: datetime, end: datetime) -> List[EnergyReading]:
+        already_anchored = anchored_keys(self.client, start, end)
+        readings = []
+        for row in scan_readings(self.client, start, end, self.device_id):
+            if row.get("quarantined"):
+                # Screened out at ingest; never anchored
+                continue
+            try:
+                reading = EnergyReading.from_record(row)
+            except ReadingValidationError as e:
+                logger.warning(f"Skipping invalid stored reading {row.get('id')}: {e}")
+                continue
+            if (reading.device_id, reading.timestamp) not in already_anchored:
+                readings.append(reading)
+        return readings
+
+    async def _submit(self, batch: EnergyBatch) -> bool:
+        async with self.submission_slots:
+            await self._rate_limit()
+            result = await self.hedera_service.submit_proof_to_hedera(batch)
+        if not result.success:
+            logger.error(f"❌ Backfill batch {batch.batch_id} failed: {result.error}")
+            return False
+        result.batch = batch
+        await asyncio.to_thread(proof_store.store_batch_proof, self.client, result)
+        logger.info(f"✅ Backfill batch {batch.batch_id} anchored: {result.transaction_id}")
+        return True
+
+    async def process_window(self, start: datetime, end: datetime) -> None:
+        window_key = start.isoformat()
+        if window_key in self.checkpoint.completed_windows:
+            return
+
+        readings = await asyncio.to_thread(self._load_window, start, end)
+        if not readings:
+            logger.info(f"⏭️ Window {window_key} already anchored or empty")
+            self.checkpoint.completed_windows.add(window_key)
+            self.checkpoint.save()
+            return
+
+        chunks = [readings[i:i + self.batch_size] for i in range(0, len(readings), self.batch_size)]
+        codec_id = get_codec().codec_id
+        loop = asyncio.get_running_loop()
+        hashes = await asyncio.gather(*(
+            loop.run_in_executor(self.pool, compute_batch_hash, chunk, codec_id)
+            for chunk in chunks
+        ))
+
+        batches = [
+            EnergyBatch(
+                batch_id=f"backfill_{start.strftime('%Y%m%d_%H%M%S')}_{index}_{data_hash[:12]}",
+                readings=chunk,
+                created_at=datetime.now(),
+                compressed_data=compressed_data,
+                data_hash=data_hash,
+                partition_key="backfill",
+                codec_id=codec_id
+            )
+            for index, (chunk, (compressed_data, data_hash)) in enumerate(zip(chunks, hashes))
+        ]
+
+        if self.dry_run:
+            for batch in batches:
+                logger.info(f"🧪 Would anchor {batch.batch_id} ({len(batch.readings)} readings) {batch.data_hash}")
+            return
+
+        results = await asyncio.gather(*(self._submit(batch) for batch in batches))
+        self.checkpoint.batches_submitted += sum(results)
+        self.checkpoint.readings_anchored += sum(len(b.readings) for b, ok in zip(batches, results) if ok)
+        if all(results):
+            self.checkpoint.completed_windows.add(window_key)
+        else:
+            # Leave the window open; anchored readings are skipped on the next run
+            self.failures += 1
+        self.checkpoint.save()
+
+    async def run(self, start: datetime, end: datetime, window: timedelta, max_windows_in_flight: int = 2) -> None:
+        window_slots = asyncio.Semaphore(max_windows_in_flight)
+
+        async def bounded(window_start: datetime, window_end: datetime) -> None:
+            async with window_slots:
+                await self.process_window(window_start, window_end)
+
+        # Windows that may overlap open live batches are deferred whole, so a
+        # checkpointed window is never only partly scanned
+        cutoff = datetime.now() - self.live_horizon
+        windows = []
+        for window_start, window_end in iter_windows(start, end, window):
+            if window_end > cutoff:
+                self.deferred_windows += 1
+            else:
+                windows.append((window_start, window_end))
+        if self.deferred_windows:
+            logger.warning(
+                f"⏳ Deferring {self.deferred_windows} window(s) ending after {cutoff.isoformat()}: "
+                f"their readings may still be in a live batch (see --live-horizon-minutes)"
+            )
+        try:
+            await asyncio.gather(*(bounded(ws, we) for ws, we in windows))
+        finally:
+            self.pool.shutdown()
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Anchor historical energy readings that have no Hedera proof")
+    parser.add_argument("--start", required=True, type=datetime.fromisoformat, help="Range start (ISO 8601, inclusive)")
+    parser.add_argument("--end", required=True, type=datetime.fromisoformat, help="Range end (ISO 8601, exclusive)")
+    parser.add_argument("--device-id", help="Only backfill this device")
+    parser.add_argument("--window-minutes", type=int, default=60, help="Scan window size")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Maximum readings per anchored batch")
+    parser.add_argument("--workers", type=int, default=None, help="Hashing processes (default: CPU count)")
+    parser.add_argument("--rate", type=float, default=2.0, help="Maximum HCS submissions per second")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum concurrent HCS submissions")
+    parser.add_argument("--checkpoint", default=".backfill_checkpoint.json", help="Checkpoint file for resuming")
+    parser.add_argument("--dry-run", action="store_true", help="Hash batches but do not submit or store them")
+    parser.add_argument("--live-horizon-minutes", type=float, default=None,
+                        help="Skip windows newer than this (default: longest live batch delay plus a margin; 0 with no server running)")
+    return parser.parse_args(argv)
+
+async def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    client = get_supabase()
+    if client is None:
+        logger.error("Supabase not configured")
+        return 1
+
+    checkpoint = BackfillCheckpoint.load(args.checkpoint, args.start, args.end)
+    hedera_service = HederaService(os.getenv("HEDERA_SERVICE_URL", "http://localhost:3001"))
+    backfiller = Backfiller(
+        client, hedera_service, checkpoint,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        submissions_per_second=args.rate,
+        max_concurrent_submissions=args.concurrency,
+        device_id=args.device_id,
+        dry_run=args.dry_run,
+        live_horizon=timedelta(minutes=args.live_horizon_minutes) if args.live_horizon_minutes is not None else None
+    )
+    try:
+        await backfiller.run(args.start, args.end, timedelta(minutes=args.window_minutes))
+    finally:
+        await hedera_service.close()
+
+    logger.info(
+        f"Backfill finished: {checkpoint.batches_submitted} batches, "
+        f"{checkpoint.readings_anchored} readings anchored, {backfiller.failures} window(s) with failures, "
+        f"{backfiller.deferred_windows} deferred"
+    )
+    return 1 if backfiller.failures else 0
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(main()))
@@ -0,0 +1,125 @@
+"""Compression codecs for serialized batches
+
+Codecs are looked up by ID (recorded as ``codec`` in ``batch_metadata``), so
+the default can change without affecting stored batches. Built-in codecs:
+
+* ``gzip-<level>``: gzip member with a fixed header (mtime 0)
+* ``zlib-<level>``: zlib stream
+* ``lzma-<preset>``: xz container
+* ``zstd-<level>``: Zstandard (requires the optional ``zstandard`` package)
+* ``zstd-dict-<dict_id>``: Zstandard with a dictionary trained on serialized
+  readings (see ``train_zstd_dictionary``), loaded from ``ZSTD_DICT_PATH``
+
+Run ``python codec_benchmark.py`` for ratio and throughput per codec.
+"""
+import gzip
+import logging
+import lzma
+import os
+import struct
+import threading
+import zlib
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Better ratio than gzip-9 on encoded reading batches at ~5x the encode speed (see codec_benchmark.py)
+DEFAULT_CODEC_ID = "lzma-0"
+
+@dataclass(frozen=True)
+class BatchCodec:
+    codec_id: str
+    compress: Callable[[bytes], bytes]
+    decompress: Callable[[bytes], bytes]
+
+CODECS: Dict[str, BatchCodec] = {}
+
+def register_codec(codec: BatchCodec) -> None:
+    CODECS[codec.codec_id] = codec
+
+def get_codec(codec_id: Optional[str] = None) -> BatchCodec:
+    """Codec by ID; the configured default (``BATCH_CODEC``) when None"""
+    codec_id = codec_id or os.getenv("BATCH_CODEC", DEFAULT_CODEC_ID)
+    try:
+        return CODECS[codec_id]
+    except KeyError:
+        raise ValueError(f"Unknown batch codec: {codec_id} (available: {', '.join(sorted(CODECS))})")
+
+def gzip_member(data: bytes, mtime: int = 0, level: int = 9) -> bytes:
+    """Gzip member with a fixed header, byte-identical to gzip.compress(data, level, mtime=mtime) for mtime > 0"""
+    header = struct.pack("<BBBBLBB", 0x1f, 0x8b, 8, 0, mtime, 2 if level == 9 else 4 if level == 1 else 0, 255)
+    trailer = struct.pack("<LL", zlib.crc32(data), len(data) & 0xffffffff)
+    return header + zlib.compress(data, level=level, wbits=-15) + trailer
+
+for _level in (1, 6, 9):
+    register_codec(BatchCodec(f"gzip-{_level}", lambda data, level=_level: gzip_member(data, level=level), gzip.decompress))
+    register_codec(BatchCodec(
+        f"zlib-{_level}", lambda data, level=_level: zlib.compress(data, level), zlib.decompress
+    ))
+
+for _preset in (0, 6):
+    register_codec(BatchCodec(
+        f"lzma-{_preset}",
+        lambda data, preset=_preset: lzma.compress(data, format=lzma.FORMAT_XZ, check=lzma.CHECK_CRC64, preset=preset),
+        lzma.decompress
+    ))
+
+def _zstd_codec(codec_id: str, level: int, dictionary=None) -> BatchCodec:
+    # (De)compressor objects are not thread-safe but are expensive to set up
+    # with a dictionary, so each thread keeps its own
+    local = threading.local()
+
+    def compress(data: bytes) -> bytes:
+        compressor = getattr(local, "compressor", None)
+        if compressor is None:
+            compressor = local.compressor = zstandard.ZstdCompressor(
+                level=level, dict_data=dictionary, write_content_size=True
+            )
+        return compressor.compress(data)
+
+    def decompress(data: bytes) -> bytes:
+        decompressor = getattr(local, "decompressor", None)
+        if decompressor is None:
+            decompressor = local.decompressor = zstandard.ZstdDecompressor(dict_data=dictionary)
+        return decompressor.decompress(data)
+
+    return BatchCodec(codec_id, compress, decompress)
+
+if zstandard is not None:
+    for _level in (3, 19):
+        register_codec(_zstd_codec(f"zstd-{_level}", _level))
+
+def train_zstd_dictionary(samples: List[bytes], dict_size: int = 16 * 1024) -> bytes:
+    """Train a Zstandard dictionary on serialized reading samples; return its raw bytes"""
+    if zstandard is None:
+        raise RuntimeError("Dictionary training requires the 'zstandard' package")
+    return zstandard.train_dictionary(dict_size, samples).as_bytes()
+
+def register_zstd_dictionary(dictionary_bytes: bytes, level: int = 3) -> BatchCodec:
+    """Register the ``zstd-dict-<dict_id>`` codec for a trained dictionary"""
+    if zstandard is None:
+        raise RuntimeError("Dictionary codecs require the 'zstandard' package")
+    dictionary = zstandard.ZstdCompressionDict(dictionary_bytes)
+    codec = _zstd_codec(f"zstd-dict-{dictionary.dict_id()}", level, dictionary)
+    register_codec(codec)
+    return codec
+
+def load_zstd_dictionary(path: Optional[str] = None) -> Optional[BatchCodec]:
+    """Register the dictionary codec from ``ZSTD_DICT_PATH`` if one is configured"""
+    path = path or os.getenv("ZSTD_DICT_PATH")
+    if not path or zstandard is None:
+        return None
+    try:
+        with open(path, "rb") as f:
+            return register_zstd_dictionary(f.read())
+    except OSError as e:
+        logger.warning(f"Could not load zstd dictionary {path}: {e}")
+        return None
+
+load_zstd_dictionary()
@@ -0,0 +1,219 @@
+"""Adaptive batch sizing from the ingest rate and HCS behaviour
+
+With fixed limits (1000 readings / 60 minutes) a quiet site waits an hour
+for a proof while a large fleet seals a batch every few seconds. The
+controller instead retunes every partition on a short tick against two
+operator targets:
+
+- ``max_proof_delay_seconds``: no reading waits longer than this to be sealed
+- ``max_messages_per_hour``: HCS message budget, shared by the active partitions
+  (those with a measurable rate or with readings waiting to be sealed)
+
+Each tick it measures every partition's reading rate (EWMA over
+``window_seconds``) and the HCS submission latency and error rate, then sets
+
+    interval = clamp(3600 / (budget / active partitions) * error backoff,
+                     2 * p95 latency, min_batch_age .. max_proof_delay)
+    max_batch_age  = interval
+    max_batch_size = clamp(rate * interval * headroom, min .. max batch size)
+
+so batches seal about once per interval whatever the rate: quiet partitions
+seal by age (bounded proof delay), busy ones by size, and bursts above
+``headroom`` times the usual rate seal early instead of growing without
+bound. Failed submissions stretch the interval so a struggling HCS is not
+flooded. Partitions with limits set through ``configure_partition`` are
+left alone. The controller also seals due partitions on every tick, so an
+aged batch is anchored even when no further readings arrive.
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import deque
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from hedera_service import BatchProcessor, HederaSubmissionResult
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class BatchTargets:
+    max_proof_delay_seconds: float = 3600.0
+    max_messages_per_hour: float = 60.0
+    min_batch_age_seconds: float = 30.0
+    min_batch_size: int = 10
+    max_batch_size: int = 10_000
+    # Burst allowance over the usual rate before a batch seals early by size
+    headroom: float = 1.5
+
+    @classmethod
+    def from_env(cls) -> "BatchTargets":
+        return cls(
+            max_proof_delay_seconds=float(os.getenv("BATCH_MAX_PROOF_DELAY_SECONDS", "3600")),
+            max_messages_per_hour=float(os.getenv("BATCH_MAX_MESSAGES_PER_HOUR", "60")),
+            min_batch_age_seconds=float(os.getenv("BATCH_MIN_AGE_SECONDS", "30")),
+            min_batch_size=int(os.getenv("BATCH_MIN_SIZE", "10")),
+            max_batch_size=int(os.getenv("BATCH_MAX_SIZE", "10000"))
+        )
+
+@dataclass
+class PartitionDecision:
+    partition_key: str
+    rate_per_second: float
+    interval_seconds: float
+    max_batch_size: int
+    max_batch_age_minutes: float
+    # Which bound set the interval: budget, hcs_latency, min_age or max_proof_delay
+    limited_by: str
+
+@dataclass
+class HcsObservation:
+    submissions: int
+    error_rate: float
+    p50_latency_seconds: Optional[float]
+    p95_latency_seconds: Optional[float]
+
+def _percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class AdaptiveBatchController:
+    def __init__(self, processor: BatchProcessor, targets: Optional[BatchTargets] = None,
+                 enabled: bool = True, interval_seconds: float = 10.0, window_seconds: float = 300.0):
+        self.processor = processor
+        self.targets = targets or BatchTargets()
+        self.enabled = enabled
+        self.interval_seconds = interval_seconds
+        self.window_seconds = window_seconds
+        self.rates: Dict[str, float] = {}
+        self._received: Dict[str, int] = {}
+        self._last_tick: Optional[float] = None
+        self.decisions: Dict[str, PartitionDecision] = {}
+        # Partitions sharing the message budget at the last tick
+        self.active: Set[str] = set()
+        self.hcs: Optional[HcsObservation] = None
+        # Recent limit changes, newest last
+        self.history: deque = deque(maxlen=100)
+        self.ticks = 0
+        self.sealed_by_tick = 0
+
+    @classmethod
+    def from_env(cls, processor: BatchProcessor) -> "AdaptiveBatchController":
+        return cls(
+            processor,
+            BatchTargets.from_env(),
+            enabled=os.getenv("ADAPTIVE_BATCHING", "true").lower() not in ("0", "false", "no"),
+            interval_seconds=float(os.getenv("BATCH_CONTROL_INTERVAL_SECONDS", "10")),
+            window_seconds=float(os.getenv("BATCH_CONTROL_WINDOW_SECONDS", "300"))
+        )
+
+    def observe_hcs(self, now: float) -> HcsObservation:
+        """Latency and error rate of the submissions finished within the window"""
+        samples = [s for s in self.processor.submission_samples if now - s[0] <= self.window_seconds]
+        failures = sum(1 for _, _, success in samples if not success)
+        latencies = [latency for _, latency, success in samples if success]
+        return HcsObservation(
+            submissions=len(samples),
+            error_rate=failures / len(samples) if samples else 0.0,
+            p50_latency_seconds=_percentile(latencies, 0.5),
+            p95_latency_seconds=_percentile(latencies, 0.95)
+        )
+
+    def _update_rates(self, now: float) -> None:
+        elapsed = now - self._last_tick if self._last_tick is not None else None
+        for key, partition in self.processor.partitions.items():
+            previous = self._received.get(key)
+            self._received[key] = partition.received
+            if previous is None or not elapsed:
+                # First sight: count what is already pending as one window's worth
+                self.rates.setdefault(key, len(partition.readings) / self.window_seconds)
+                continue
+            instant = (partition.received - previous) / elapsed
+            alpha = 1 - math.exp(-elapsed / self.window_seconds)
+            self.rates[key] = self.rates.get(key, instant) + alpha * (instant - self.rates.get(key, instant))
+        self._last_tick = now
+
+    def decide(self, partition_key: str, rate: float, active_partitions: int,
+               hcs: HcsObservation) -> PartitionDecision:
+        """Limits for one partition (pure; see module docstring)"""
+        targets = self.targets
+        per_partition_budget = targets.max_messages_per_hour / max(1, active_partitions)
+        interval, limited_by = 3600.0 / max(per_partition_budget, 1e-9), "budget"
+        # A failing HCS gets fewer, larger messages: 50% errors triples the interval
+        interval *= 1 + 4 * hcs.error_rate
+        if hcs.p95_latency_seconds is not None and interval < 2 * hcs.p95_latency_seconds:
+            interval, limited_by = 2 * hcs.p95_latency_seconds, "hcs_latency"
+        if interval < targets.min_batch_age_seconds:
+            interval, limited_by = targets.min_batch_age_seconds, "min_age"
+        if interval > targets.max_proof_delay_seconds:
+            interval, limited_by = targets.max_proof_delay_seconds, "max_proof_delay"
+        size = math.ceil(rate * interval * targets.headroom)
+        return PartitionDecision(
+            partition_key=partition_key,
+            rate_per_second=round(rate, 4),
+            interval_seconds=round(interval, 1),
+            max_batch_size=min(max(size, targets.min_batch_size), targets.max_batch_size),
+            max_batch_age_minutes=round(interval / 60, 3),
+            limited_by=limited_by
+        )
+
+    def tune(self) -> Dict[str, PartitionDecision]:
+        """Measure, decide and apply limits to every partition not pinned by configure_partition"""
+        now = time.monotonic()
+        self._update_rates(now)
+        self.hcs = self.observe_hcs(now)
+        adaptive = [key for key in self.processor.partitions if key not in self.processor.partition_limits]
+        # Any partition that will seal a batch takes a share of the message budget:
+        # only partitions idle for a whole window with nothing pending are left out
+        self.active = {
+            key for key in adaptive
+            if self.rates.get(key, 0.0) * self.window_seconds >= 1 or self.processor.partitions[key].readings
+        }
+        decisions = {}
+        for key in adaptive:
+            decision = self.decide(key, self.rates.get(key, 0.0), len(self.active), self.hcs)
+            partition = self.processor.partitions[key]
+            if (partition.max_batch_size, partition.max_batch_age_minutes) != (decision.max_batch_size, decision.max_batch_age_minutes):
+                partition.max_batch_size = decision.max_batch_size
+                partition.max_batch_age_minutes = decision.max_batch_age_minutes
+                self.history.append({"at": datetime.now().isoformat(), **asdict(decision)})
+            decisions[key] = decision
+        self.decisions = decisions
+        self.ticks += 1
+        return self.decisions
+
+    async def run(self, on_results: Callable[[List[HederaSubmissionResult]], Awaitable[None]]) -> None:
+        """Retune every interval and seal partitions that came due without new readings"""
+        while True:
+            try:
+                if self.enabled:
+                    self.tune()
+                if self.processor.should_process_batch():
+                    results = await self.processor.process_due_batches()
+                    self.sealed_by_tick += len(results)
+                    await on_results(results)
+            except Exception as e:
+                logger.error(f"Batch controller error: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        hour_ago = time.monotonic() - 3600
+        messages_last_hour = sum(1 for finished, _, _ in self.processor.submission_samples if finished >= hour_ago)
+        projected = sum(3600 / d.interval_seconds for key, d in self.decisions.items() if key in self.active)
+        return {
+            "enabled": self.enabled,
+            "targets": asdict(self.targets),
+            "ticks": self.ticks,
+            "sealed_by_tick": self.sealed_by_tick,
+            "hcs": asdict(self.hcs) if self.hcs else None,
+            "messages_last_hour": messages_last_hour,
+            "active_partitions": len(self.active),
+            "projected_messages_per_hour": round(projected, 1),
+            "partitions": {key: asdict(decision) for key, decision in self.decisions.items()},
+            "recent_changes": list(self.history)[-20:]
+        }
@@ -0,0 +1,220 @@
+"""Canonical columnar encoding of a batch of readings (hash scheme ``columnar-v1``)
+
+The anchored batch hash is SHA-256 over these bytes. Only the fields listed
+below are encoded, so extra keys in a stored reading never change the hash,
+and numbers are fixed-width binary, so no JSON float formatting has to be
+reproduced. All integers and floats are little-endian::
+
+    magic          4 bytes   b"EBC1"
+    count          uint32    N, number of readings
+    device_count   uint16    D, distinct device IDs
+    D times:
+      length       uint16    byte length of the UTF-8 device ID
+      device_id    bytes     UTF-8, in order of first appearance in the batch
+    device_index   N x uint16    index into the device list, per reading
+    timestamp      N x int64     server receive time, microseconds since
+                                 1970-01-01T00:00:00 (naive times as stored,
+                                 timezone-aware times converted to UTC)
+    quality_flags  N x uint32    screening bitmask (0 when clean)
+    then for each of current, voltage, power, total_energy_kwh, efficiency,
+    ambient_temp_c, irradiance_w_m2, power_factor:
+      presence     uint8     0: absent in every reading
+                             1: present in every reading
+                             2: a presence bitmap follows
+      bitmap       ceil(N/8) bytes, bit i (LSB first) set when reading i has
+                   a value (presence 2 only)
+      values       N x float64 IEEE 754, 0.0 for absent readings, -0.0
+                   written as 0.0 (omitted for presence 0)
+
+Readings keep their batch order. ``decode_batch`` is the reference decoder;
+``python batch_encoding.py`` checks a hash from stored records or decodes a
+binary batch.
+"""
+import argparse
+import hashlib
+import json
+import struct
+import sys
+from array import array
+from datetime import datetime, timedelta, timezone
+from operator import attrgetter
+from typing import Any, Dict, List, Mapping, Optional, Sequence
+
+from energy_reading import NUMERIC_FIELDS, EnergyReading
+
+MAGIC = b"EBC1"
+
+ABSENT = 0
+PRESENT = 1
+BITMAP = 2
+
+MAX_DEVICES = 0xFFFF
+
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_UTC = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+_SWAP = sys.byteorder == "big"
+_NUMERIC_GETTERS = tuple(attrgetter(name) for name in NUMERIC_FIELDS)
+
+class BatchEncodingError(ValueError):
+    """Raised for batches that cannot be encoded or bytes that are not a valid encoding"""
+
+def _micros(moment: datetime) -> int:
+    return (moment - (_EPOCH if moment.tzinfo is None else _EPOCH_UTC)) // _MICROSECOND
+
+def _little_endian(column: array) -> bytes:
+    if _SWAP:
+        column.byteswap()
+    return column.tobytes()
+
+def _encode_column(values: List[Optional[float]], count: int) -> List[bytes]:
+    if None not in values:
+        if 0.0 in values:
+            # Also matches -0.0, which has its own bit pattern
+            values = [value + 0.0 for value in values]
+        return [bytes((PRESENT,)), _little_endian(array("d", values))]
+    if values.count(None) == count:
+        return [bytes((ABSENT,))]
+    bitmap = bytearray((count + 7) // 8)
+    for i, value in enumerate(values):
+        if value is not None:
+            bitmap[i >> 3] |= 1 << (i & 7)
+    filled = [value + 0.0 if value is not None else 0.0 for value in values]
+    return [bytes((BITMAP,)), bytes(bitmap), _little_endian(array("d", filled))]
+
+def _encode(device_ids: Sequence[str], timestamps: Sequence[int], quality_flags: Sequence[int],
+            columns: Sequence[List[Optional[float]]]) -> bytes:
+    count = len(device_ids)
+    devices: Dict[str, int] = {}
+    device_index = array("H")
+    try:
+        device_index.extend([devices.setdefault(d, len(devices)) for d in device_ids])
+    except OverflowError:
+        raise BatchEncodingError(f"A batch may contain at most {MAX_DEVICES} devices")
+
+    parts = [MAGIC, struct.pack("<IH", count, len(devices))]
+    for device_id in devices:
+        encoded = device_id.encode("utf-8")
+        parts.append(struct.pack("<H", len(encoded)))
+        parts.append(encoded)
+    parts.append(_little_endian(device_index))
+    parts.append(_little_endian(array("q", timestamps)))
+    parts.append(_little_endian(array("I", quality_flags)))
+    for values in columns:
+        parts.extend(_encode_column(values, count))
+    return b"".join(parts)
+
+def encode_readings(readings: Sequence[EnergyReading]) -> bytes:
+    """Canonical bytes of a batch of readings"""
+    return _encode(
+        [r.device_id for r in readings],
+        [_micros(r.received_at) for r in readings],
+        [r.quality_flags for r in readings],
+        [list(map(getter, readings)) for getter in _NUMERIC_GETTERS]
+    )
+
+def encode_records(records: Sequence[Mapping[str, Any]]) -> bytes:
+    """Canonical bytes of a batch of stored reading dicts (``EnergyReading.to_dict`` shape)"""
+    try:
+        return _encode(
+            [r["device_id"] for r in records],
+            [_micros(datetime.fromisoformat(r["timestamp"])) for r in records],
+            [r.get("quality_flags") or 0 for r in records],
+            [[None if r.get(name) is None else float(r[name]) for r in records] for name in NUMERIC_FIELDS]
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        raise BatchEncodingError(f"Invalid reading record: {e}")
+
+def batch_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+class _Reader:
+    def __init__(self, data: bytes):
+        self.data = memoryview(data)
+        self.offset = 0
+
+    def take(self, size: int) -> memoryview:
+        if self.offset + size > len(self.data):
+            raise BatchEncodingError(f"Truncated batch encoding at byte {self.offset}")
+        chunk = self.data[self.offset:self.offset + size]
+        self.offset += size
+        return chunk
+
+    def unpack(self, fmt: str) -> tuple:
+        return struct.unpack(fmt, self.take(struct.calcsize(fmt)))
+
+    def column(self, typecode: str, count: int) -> array:
+        column = array(typecode)
+        column.frombytes(self.take(column.itemsize * count))
+        if _SWAP:
+            column.byteswap()
+        return column
+
+def decode_batch(data: bytes) -> List[Dict[str, Any]]:
+    """Reference decoder: the readings of an encoded batch as ``EnergyReading.to_dict`` records"""
+    reader = _Reader(data)
+    if bytes(reader.take(len(MAGIC))) != MAGIC:
+        raise BatchEncodingError("Not a columnar batch encoding (bad magic)")
+    count, device_count = reader.unpack("<IH")
+    device_ids = []
+    for _ in range(device_count):
+        (length,) = reader.unpack("<H")
+        device_ids.append(bytes(reader.take(length)).decode("utf-8"))
+
+    device_index = reader.column("H", count)
+    timestamps = reader.column("q", count)
+    quality_flags = reader.column("I", count)
+    columns = []
+    for name in NUMERIC_FIELDS:
+        (presence,) = reader.unpack("<B")
+        if presence == ABSENT:
+            columns.append((name, None, None))
+        elif presence == PRESENT:
+            columns.append((name, None, reader.column("d", count)))
+        elif presence == BITMAP:
+            bitmap = bytes(reader.take((count + 7) // 8))
+            columns.append((name, bitmap, reader.column("d", count)))
+        else:
+            raise BatchEncodingError(f"Invalid presence byte {presence} for {name}")
+    if reader.offset != len(reader.data):
+        raise BatchEncodingError(f"{len(reader.data) - reader.offset} trailing bytes after batch encoding")
+
+    records = []
+    for i in range(count):
+        try:
+            record = {"device_id": device_ids[device_index[i]]}
+        except IndexError:
+            raise BatchEncodingError(f"Reading {i} refers to unknown device {device_index[i]}")
+        for name, bitmap, values in columns:
+            if values is not None and (bitmap is None or bitmap[i >> 3] >> (i & 7) & 1):
+                record[name] = values[i]
+        timestamp = (_EPOCH + timedelta(microseconds=timestamps[i])).isoformat()
+        record["timestamp"] = timestamp
+        record["server_received_at"] = timestamp
+        if quality_flags[i]:
+            record["quality_flags"] = quality_flags[i]
+        records.append(record)
+    return records
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Canonical batch encoding: hash stored records or decode a batch")
+    parser.add_argument("path", help="JSON list of reading records (--records) or an encoded batch")
+    parser.add_argument("--records", action="store_true", help="Input is a JSON list of stored reading records")
+    parser.add_argument("--codec", help="Decompress the encoded batch with this codec first (see batch_codecs)")
+    args = parser.parse_args(argv)
+
+    if args.records:
+        with open(args.path) as f:
+            records = json.load(f)
+        print(batch_hash(encode_records(records)))
+        return
+
+    with open(args.path, "rb") as f:
+        data = f.read()
+    if args.codec:
+        from batch_codecs import get_codec
+        data = get_codec(args.codec).decompress(data)
+    print(json.dumps({"data_hash": batch_hash(data), "readings": decode_batch(data)}, indent=2))
+
+if __name__ == "__main__":
+    main()
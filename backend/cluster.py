@@ -0,0 +1,286 @@
+"""Cluster mode: devices sharded across backend nodes by consistent hashing
+
+Every node is configured with the same member list and its own ID::
+
+    CLUSTER_NODES=node1=http://10.0.0.1:5000,node2=http://10.0.0.2:5000
+    CLUSTER_NODE_ID=node1
+
+Each ``device_id`` is owned by one node, chosen on a hash ring with virtual
+nodes so adding or removing a node moves only ~1/N of the devices. The
+owner keeps the device's latest readings, batches and anchors them with
+its own ``BatchProcessor`` and submits them to HCS. Any node accepts
+ingest: readings of devices it does not own are forwarded to their owner
+in one bulk request per node (marked with ``X-Cluster-Forwarded-By`` so
+they are never forwarded twice), and are processed locally if the owner
+cannot be reached, so no reading is lost while a node is down. Dashboards
+can connect to any node: ``latest_readings`` is merged from all members.
+
+Without ``CLUSTER_NODES`` the node owns every device and nothing changes.
+
+Local test cluster (three processes on ports 5001-5003)::
+
+    python cluster.py --nodes 3 --base-port 5001
+"""
+import argparse
+import asyncio
+import bisect
+import hashlib
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from energy_reading import NUMERIC_FIELDS, EnergyReading
+
+logger = logging.getLogger(__name__)
+
+FORWARDED_HEADER = "X-Cluster-Forwarded-By"
+
+def _ring_hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+class HashRing:
+    """Consistent hash ring mapping device IDs to node IDs"""
+
+    def __init__(self, node_ids: List[str], vnodes: int = 128):
+        self.node_ids = sorted(node_ids)
+        points = sorted((_ring_hash(f"{node_id}#{i}"), node_id) for node_id in self.node_ids for i in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._owners = [node_id for _, node_id in points]
+
+    def owner(self, device_id: str) -> str:
+        index = bisect.bisect(self._hashes, _ring_hash(device_id)) % len(self._hashes)
+        return self._owners[index]
+
+def parse_nodes(value: str) -> Dict[str, str]:
+    """"id=url,id=url" -> {id: url}"""
+    nodes = {}
+    for entry in filter(None, (part.strip() for part in value.split(","))):
+        node_id, sep, url = entry.partition("=")
+        if not sep or not node_id or not url:
+            raise ValueError(f"Invalid CLUSTER_NODES entry {entry!r} (expected id=url)")
+        nodes[node_id.strip()] = url.strip().rstrip("/")
+    return nodes
+
+def forward_payload(reading: EnergyReading) -> Dict[str, Any]:
+    """Ingest payload reproducing a decoded reading (with its retry key) on another node"""
+    payload = {"device_id": reading.device_id}
+    for name in NUMERIC_FIELDS:
+        value = getattr(reading, name)
+        if value is not None:
+            payload[name] = value
+    if isinstance(reading.dedup_key, str):
+        payload["idempotency_key"] = reading.dedup_key
+    elif reading.dedup_key is not None:
+        payload["seq"] = reading.dedup_key
+    return payload
+
+class ForwardRejected(Exception):
+    """An owner node refused forwarded readings with a client error other than 429"""
+    def __init__(self, node_id: str, status_code: int, detail: Any):
+        super().__init__(f"node {node_id}: {detail}")
+        self.node_id = node_id
+        self.status_code = status_code
+        self.detail = detail
+
+class Cluster:
+    def __init__(self, node_id: Optional[str] = None, nodes: Optional[Dict[str, str]] = None,
+                 forward_timeout_seconds: float = 5.0, latest_ttl_seconds: float = 2.0):
+        self.nodes = nodes or {}
+        self.enabled = len(self.nodes) > 1
+        if self.enabled and node_id not in self.nodes:
+            raise ValueError(f"CLUSTER_NODE_ID {node_id!r} is not one of CLUSTER_NODES ({', '.join(self.nodes)})")
+        self.node_id = node_id
+        self.ring = HashRing(list(self.nodes)) if self.enabled else None
+        self.forward_timeout_seconds = forward_timeout_seconds
+        self.latest_ttl_seconds = latest_ttl_seconds
+        self._client: Optional[httpx.AsyncClient] = None
+        self._latest_cache: Tuple[float, Dict[str, Dict[str, Any]]] = (0.0, {})
+        self._latest_lock: Optional[asyncio.Lock] = None
+        self.counters: Counter = Counter()
+
+    @classmethod
+    def from_env(cls) -> "Cluster":
+        return cls(
+            node_id=os.getenv("CLUSTER_NODE_ID"),
+            nodes=parse_nodes(os.getenv("CLUSTER_NODES", "")),
+            forward_timeout_seconds=float(os.getenv("CLUSTER_FORWARD_TIMEOUT_SECONDS", "5"))
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.forward_timeout_seconds)
+        return self._client
+
+    def owner(self, device_id: str) -> str:
+        return self.ring.owner(device_id) if self.enabled else self.node_id
+
+    def is_local(self, device_id: str) -> bool:
+        return not self.enabled or self.ring.owner(device_id) == self.node_id
+
+    def split(self, readings: List[EnergyReading]) -> Tuple[List[EnergyReading], Dict[str, List[EnergyReading]]]:
+        """Readings this node owns, and the others grouped by owner"""
+        if not self.enabled:
+            return readings, {}
+        local, remote = [], defaultdict(list)
+        for reading in readings:
+            owner = self.ring.owner(reading.device_id)
+            if owner == self.node_id:
+                local.append(reading)
+            else:
+                remote[owner].append(reading)
+        return local, dict(remote)
+
+    async def forward(self, node_id: str, readings: List[EnergyReading]) -> Optional[Dict[str, Any]]:
+        """Send readings to their owner's bulk endpoint; None if the owner did not take them"""
+        try:
+            response = await self.client.post(
+                f"{self.nodes[node_id]}/api/energy-data/bulk",
+                json=[forward_payload(reading) for reading in readings],
+                headers={FORWARDED_HEADER: self.node_id}
+            )
+        except httpx.HTTPError as e:
+            logger.warning(f"Forwarding {len(readings)} reading(s) to {node_id} failed: {e}")
+            self.counters["forward_failures"] += 1
+            return None
+        if response.status_code >= 500:
+            logger.warning(f"Forwarding {len(readings)} reading(s) to {node_id} failed: HTTP {response.status_code}")
+            self.counters["forward_failures"] += 1
+            return None
+        if response.status_code != 200:
+            # Rejected by the owner (throttled or invalid): nothing is stored here
+            self.counters["forward_rejected"] += 1
+            try:
+                detail = response.json().get("detail")
+            except ValueError:
+                detail = response.text
+            return {
+                "status_code": response.status_code,
+                "detail": detail,
+                "retry_after": response.headers.get("retry-after")
+            }
+        self.counters["forwarded_requests"] += 1
+        self.counters["forwarded_readings"] += len(readings)
+        return {"status_code": 200, **response.json()}
+
+    async def notify_peers(self, path: str, payload: Dict[str, Any]) -> None:
+        """POST ``payload`` to ``path`` on every other node (best effort, e.g. cache invalidation)"""
+        if not self.enabled:
+            return
+
+        async def notify(node_id: str) -> None:
+            try:
+                response = await self.client.post(f"{self.nodes[node_id]}{path}", json=payload,
+                                                  headers={FORWARDED_HEADER: self.node_id})
+                response.raise_for_status()
+            except httpx.HTTPError as e:
+                logger.warning(f"Notifying {node_id} ({path}) failed: {e}")
+                self.counters["notify_failures"] += 1
+
+        await asyncio.gather(*(notify(node_id) for node_id in self.nodes if node_id != self.node_id))
+
+    async def _fetch_latest(self, node_id: str) -> Dict[str, Dict[str, Any]]:
+        try:
+            response = await self.client.get(f"{self.nodes[node_id]}/api/latest-readings", params={"scope": "local"})
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPError as e:
+            logger.warning(f"Latest readings from {node_id} unavailable: {e}")
+            self.counters["latest_fetch_failures"] += 1
+            return {}
+
+    async def merged_latest(self, local: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Latest reading per device across all nodes (peer views cached for a short TTL)"""
+        if not self.enabled:
+            return local
+        if self._latest_lock is None:
+            self._latest_lock = asyncio.Lock()
+        async with self._latest_lock:
+            fetched_at, peers = self._latest_cache
+            if time.monotonic() - fetched_at > self.latest_ttl_seconds:
+                views = await asyncio.gather(*(self._fetch_latest(node_id) for node_id in self.nodes if node_id != self.node_id))
+                peers = {}
+                for view in views:
+                    peers.update(view)
+                self._latest_cache = (time.monotonic(), peers)
+        merged = dict(peers)
+        for device_id, reading in local.items():
+            # A device can have readings on two nodes after a failed forward or a ring change
+            other = merged.get(device_id)
+            if other is None or reading["timestamp"] >= other["timestamp"]:
+                merged[device_id] = reading
+        return merged
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "node_id": self.node_id,
+            "nodes": self.nodes,
+            "counters": dict(self.counters)
+        }
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run a local test cluster of backend nodes")
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--base-port", type=int, default=5001)
+    parser.add_argument("--host", default="127.0.0.1")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    args = parse_args(argv)
+    ports = {f"node{i + 1}": args.base_port + i for i in range(args.nodes)}
+    members = ",".join(f"{node_id}=http://{args.host}:{port}" for node_id, port in ports.items())
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+
+    processes = []
+    for index, (node_id, port) in enumerate(ports.items()):
+        env = {
+            **os.environ,
+            "CLUSTER_NODES": members,
+            "CLUSTER_NODE_ID": node_id,
+            # One node migrates; per-node files for state that is not shared
+            "AUTO_MIGRATE": os.getenv("AUTO_MIGRATE", "true") if index == 0 else "false",
+            "TOPIC_INDEX_PATH": f"topic_index_{node_id}.sqlite3",
+            "AUDIT_CHECKPOINT_PATH": f".audit_checkpoint_{node_id}.json",
+            "HOST": args.host,
+            "PORT": str(port)
+        }
+        # main.py runs the graceful server, so terminated nodes drain (see shutdown.py)
+        processes.append(subprocess.Popen([sys.executable, "main.py"], cwd=backend_dir, env=env))
+        logger.info(f"🚀 {node_id} on http://{args.host}:{port}")
+
+    def stop(*_):
+        for process in processes:
+            process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    # Nodes can be killed individually to try failover; the launcher runs until all have exited
+    running = dict(zip(ports, processes))
+    try:
+        while running:
+            for node_id, process in list(running.items()):
+                if process.poll() is not None:
+                    logger.info(f"🛑 {node_id} exited with code {process.returncode}")
+                    del running[node_id]
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    stop()
+    for process in processes:
+        process.wait()
+    return max((process.returncode or 0) for process in processes)
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,136 @@
+"""Compression ratio and throughput of every registered batch codec
+
+Usage::
+
+    python codec_benchmark.py                       # synthetic batches shaped like ESP32 readings
+    python codec_benchmark.py --from-db 20          # the 20 most recent anchored batches
+    python codec_benchmark.py --train-dict zstd_dict.bin   # also train a zstd dictionary
+
+Batches are serialized exactly as for anchoring (``encode_records``, see
+batch_encoding.py).
+A dictionary written with ``--train-dict`` can be enabled for live batches
+with ``ZSTD_DICT_PATH`` and ``BATCH_CODEC=zstd-dict-<id>``.
+"""
+import argparse
+import math
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from batch_codecs import CODECS, register_zstd_dictionary, train_zstd_dictionary, zstandard
+from batch_encoding import encode_records
+from energy_reading import EnergyReading
+
+def synthetic_batch(size: int, devices: int, start: datetime, rng: random.Random) -> List[Dict]:
+    """Readings with the value ranges and rounding of the mock ESP32 generator"""
+    energy = {f"ESP32_{i:03d}": rng.uniform(0, 500) for i in range(devices)}
+    records = []
+    for i in range(size):
+        device_id = f"ESP32_{i % devices:03d}"
+        received_at = start + timedelta(seconds=i * 5 // devices)
+        hour = received_at.hour + received_at.minute / 60
+        irradiance = max(0.0, 800 * (1 - abs(hour - 12) / 6) + rng.uniform(-100, 100)) if 6 <= hour <= 18 else 0.0
+        efficiency = round(0.85 + rng.uniform(-0.05, 0.05), 3)
+        voltage = 220 + rng.uniform(-10, 10)
+        power_factor = round(0.95 + rng.uniform(-0.05, 0.05), 3)
+        power = max(0.0, irradiance * 0.6 * efficiency + rng.uniform(-50, 50))
+        energy[device_id] += power * 5 / 3_600_000
+        records.append(EnergyReading(
+            device_id=device_id,
+            current=round(power / (voltage * power_factor), 2),
+            voltage=round(voltage, 1),
+            power=round(power, 1),
+            received_at=received_at,
+            total_energy_kwh=round(energy[device_id], 3),
+            efficiency=efficiency,
+            ambient_temp_c=round(25 + rng.uniform(-5, 10), 1),
+            irradiance_w_m2=round(irradiance, 1),
+            power_factor=power_factor
+        ).to_dict())
+    return records
+
+def load_recent_batches(count: int) -> List[List[Dict]]:
+    from audit import load_batch_records
+    from database import get_supabase
+
+    client = get_supabase()
+    if client is None:
+        raise SystemExit("Supabase not configured")
+    proofs = client.table("proof_anchors").select("batch_id").order("created_at", desc=True).limit(count).execute().data
+    return [load_batch_records(client, proof["batch_id"]) for proof in proofs]
+
+def measure(codec_ids: List[str], payloads: List[bytes], repeat: int) -> List[Dict]:
+    raw_size = sum(len(p) for p in payloads)
+    results = []
+    for codec_id in codec_ids:
+        codec = CODECS[codec_id]
+        encode_seconds = decode_seconds = math.inf
+        for _ in range(repeat):
+            started = time.perf_counter()
+            compressed = [codec.compress(p) for p in payloads]
+            encode_seconds = min(encode_seconds, time.perf_counter() - started)
+            started = time.perf_counter()
+            for blob in compressed:
+                codec.decompress(blob)
+            decode_seconds = min(decode_seconds, time.perf_counter() - started)
+        compressed_size = sum(len(c) for c in compressed)
+        results.append({
+            "codec": codec_id,
+            "ratio": raw_size / compressed_size,
+            "compressed_size": compressed_size,
+            "encode_mb_s": raw_size / encode_seconds / 1e6,
+            "decode_mb_s": raw_size / decode_seconds / 1e6
+        })
+    return results
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark batch compression codecs")
+    parser.add_argument("--batches", type=int, default=20, help="Synthetic batches to generate")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Readings per synthetic batch")
+    parser.add_argument("--devices", type=int, default=10, help="Devices per synthetic batch")
+    parser.add_argument("--from-db", type=int, metavar="N", help="Use the N most recent anchored batches instead")
+    parser.add_argument("--codecs", nargs="*", help="Codec IDs to run (default: all registered)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per codec (best time is reported)")
+    parser.add_argument("--train-dict", metavar="PATH", help="Train a zstd dictionary on the batches and save it")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    if args.from_db:
+        batches = load_recent_batches(args.from_db)
+    else:
+        rng = random.Random(args.seed)
+        start = datetime(2025, 6, 1, 6, 0)
+        batches = [
+            synthetic_batch(args.batch_size, args.devices, start + timedelta(hours=i / 2), rng)
+            for i in range(args.batches)
+        ]
+    payloads = [encode_records(batch) for batch in batches]
+    readings = sum(len(batch) for batch in batches)
+
+    if args.train_dict:
+        # Train on single readings too: small partitions are where a dictionary pays off
+        samples = payloads + [encode_records([r]) for batch in batches for r in batch[:200]]
+        dictionary = train_zstd_dictionary(samples)
+        with open(args.train_dict, "wb") as f:
+            f.write(dictionary)
+        codec = register_zstd_dictionary(dictionary)
+        print(f"Trained {len(dictionary)} byte dictionary -> {args.train_dict} (codec {codec.codec_id})")
+
+    codec_ids = args.codecs or sorted(CODECS)
+    if zstandard is None and not args.codecs:
+        print("zstandard not installed - zstd codecs skipped")
+
+    raw_size = sum(len(p) for p in payloads)
+    print(f"{len(payloads)} batches, {readings} readings, {raw_size / 1e6:.2f} MB canonical encoding")
+    print(f"{'codec':<22}{'ratio':>8}{'B/reading':>11}{'encode MB/s':>13}{'decode MB/s':>13}")
+    for result in sorted(measure(codec_ids, payloads, args.repeat), key=lambda r: -r["ratio"]):
+        print(
+            f"{result['codec']:<22}{result['ratio']:>8.2f}{result['compressed_size'] / readings:>11.1f}"
+            f"{result['encode_mb_s']:>13.1f}{result['decode_mb_s']:>13.1f}"
+        )
+
+if __name__ == "__main__":
+    main()
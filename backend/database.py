@@ -0,0 +1,32 @@
+import os
+import logging
+
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+SUPABASE_URL = os.getenv("SUPABASE_URL", "your_supabase_url")
+SUPABASE_KEY = os.getenv("SUPABASE_ANON_KEY", "your_supabase_anon_key")
+
+_client = None
+_client_initialized = False
+
+def get_supabase():
+    """Return the shared Supabase client, creating it on first use
+
+    Returns None when the client cannot be created (missing credentials or
+    package), so callers keep working in memory-only mode.
+    """
+    global _client, _client_initialized
+    if not _client_initialized:
+        _client_initialized = True
+        try:
+            from supabase import create_client
+            _client = create_client(SUPABASE_URL, SUPABASE_KEY)
+            logger.info(f"✅ Connected to Supabase: {SUPABASE_URL}")
+        except Exception as e:
+            logger.error(f"❌ Supabase connection error: {e}")
+            _client = None
+    return _client
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Literal, Optional, List
 from datetime import datetime
 from enum import Enum
 
@@ -17,7 +17,7 @@ class SubmissionStatus(str, Enum):
 # Pydantic models for API requests/responses
 class ParticipantRegistrationRequest(BaseModel):
     participant_name: str = Field(..., min_length=1, max_length=255)
-    email: Optional[str] = Field(None, regex=r'^[^@]+@[^@]+\.[^@]+$')
+    email: Optional[str] = Field(None, pattern=r'^[^@]+@[^@]+\.[^@]+$')
 
 class ParticipantRegistrationResponse(BaseModel):
     success: bool
@@ -35,6 +35,34 @@ class ParticipantStatusResponse(BaseModel):
     guardian_email_sent: bool
     created_at: datetime
     updated_at: datetime
+    # Devices registered to the participant (from the in-memory device registry)
+    device_ids: List[str] = Field(default_factory=list)
+
+class DeviceRegistrationRequest(BaseModel):
+    device_ids: List[str] = Field(..., min_length=1)
+    label: Optional[str] = Field(None, max_length=255)
+
+class RegistryInvalidationRequest(BaseModel):
+    device_ids: List[str] = Field(default_factory=list)
+    participant_ids: List[str] = Field(default_factory=list)
+
+class BatchPartitionRequest(BaseModel):
+    partition_key: str = Field(..., min_length=1, max_length=255)
+    participant_did: Optional[str] = None
+    device_ids: List[str] = Field(default_factory=list)
+    max_batch_size: Optional[int] = Field(None, gt=0)
+    max_batch_age_minutes: Optional[float] = Field(None, gt=0)
+
+class DeviceLivenessRequest(BaseModel):
+    timeout_seconds: float = Field(..., gt=0, le=86400)
+
+class ProfilingRequest(BaseModel):
+    enabled: bool
+    reset: bool = False
+
+class ProfileCaptureRequest(BaseModel):
+    seconds: float = Field(10.0, gt=0, le=300)
+    mode: Literal["cprofile", "sampling"] = "cprofile"
 
 class ProofAnchorModel(BaseModel):
     id: str
@@ -54,6 +82,9 @@ class GuardianSubmissionModel(BaseModel):
     submission_status: SubmissionStatus
     guardian_response: Optional[Dict[str, Any]] = None
     submitted_at: datetime
+    attempts: int = 0
+    next_attempt_at: Optional[datetime] = None
+    last_error: Optional[str] = None
 
 class EnergyBatchSummary(BaseModel):
     batch_id: str
@@ -63,7 +94,7 @@ class EnergyBatchSummary(BaseModel):
     timestamp_range: Dict[str, str]
     hedera_proof: Optional[str] = None
 
-# Database initialization SQL
+# Database initialization SQL (migration 1, see migrations.py)
 DATABASE_SCHEMA = """
 -- Proof anchors table
 CREATE TABLE IF NOT EXISTS proof_anchors (
@@ -130,6 +161,7 @@ BEGIN
 END;
 $$ language 'plpgsql';
 
+DROP TRIGGER IF EXISTS update_guardian_participants_updated_at ON guardian_participants;
 CREATE TRIGGER update_guardian_participants_updated_at 
     BEFORE UPDATE ON guardian_participants 
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
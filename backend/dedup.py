@@ -0,0 +1,200 @@
+"""Drop retried device submissions before they reach storage and batching
+
+A reading is deduplicated when the device sends a ``seq`` number or an
+``idempotency_key`` with it (or an ``Idempotency-Key`` header for the whole
+request). Readings without either are always treated as new.
+
+Each device keeps an exact window of its most recent keys. Keys that have
+fallen out of the window (or belong to evicted devices) are still caught by
+a two-generation Bloom filter shared by all devices: its memory is fixed and
+the older generation is discarded when the current one fills up. A Bloom
+hit outside the exact window is a *probable* duplicate: it is counted, and
+only dropped when ``drop_probable`` is set, since a false positive would
+discard a legitimate reading.
+
+A seq above the device's high-water mark is new by definition. A seq that
+goes back to the start of the counter (``<= restart_floor``, i.e. 0 or 1)
+or more than ``restart_gap`` below the high-water mark (by default, older
+than the exact window) is taken as a device restart, e.g. an ESP32
+rebooting without a persisted counter: the device's window is reset and its
+keys start a new epoch, so neither the exact window nor pre-restart entries
+in the Bloom filter can match post-restart seqs.
+"""
+import hashlib
+import os
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple, Union
+
+from energy_reading import EnergyReading
+
+DedupKey = Union[int, str]
+
+NEW = "new"
+DUPLICATE = "duplicate"
+PROBABLE_DUPLICATE = "probable_duplicate"
+
+class BloomFilter:
+    def __init__(self, bits: int, hashes: int):
+        self.bits = bits
+        self.hashes = hashes
+        self.array = bytearray((bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: bytes):
+        digest = hashlib.blake2b(item, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, item: bytes) -> None:
+        for position in self._positions(item):
+            self.array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: bytes) -> bool:
+        array = self.array
+        return all(array[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+@dataclass
+class DeviceWindow:
+    keys: "OrderedDict[DedupKey, None]" = field(default_factory=OrderedDict)
+    high_water_seq: int = -1
+    # Bumped on every detected seq restart; part of the Bloom item
+    epoch: int = 0
+
+class DedupIndex:
+    def __init__(self, window: int = 256, max_devices: int = 10_000, bloom_bits: int = 1 << 23,
+                 bloom_hashes: int = 7, bloom_capacity: int = 500_000, drop_probable: bool = False,
+                 restart_gap: Optional[int] = None, restart_floor: int = 1):
+        self.window = window
+        self.max_devices = max_devices
+        self.bloom_bits = bloom_bits
+        self.bloom_hashes = bloom_hashes
+        # Keys per Bloom generation before rotating (keeps the false positive rate near 0.05%)
+        self.bloom_capacity = bloom_capacity
+        self.drop_probable = drop_probable
+        # How far below the high-water mark a seq must be to count as a counter restart
+        self.restart_gap = window if restart_gap is None else restart_gap
+        # Seqs a rebooted counter starts from
+        self.restart_floor = restart_floor
+        self.restarts = 0
+        self.devices: "OrderedDict[str, DeviceWindow]" = OrderedDict()
+        self.current = BloomFilter(bloom_bits, bloom_hashes)
+        self.previous: Optional[BloomFilter] = None
+        self.checked = 0
+        self.dropped: Counter = Counter()
+        self.dropped_by_device: Counter = Counter()
+
+    @classmethod
+    def from_env(cls) -> "DedupIndex":
+        return cls(
+            window=int(os.getenv("DEDUP_WINDOW", "256")),
+            bloom_bits=int(os.getenv("DEDUP_BLOOM_BITS", str(1 << 23))),
+            drop_probable=os.getenv("DEDUP_DROP_PROBABLE", "false").lower() in ("1", "true", "yes"),
+            restart_gap=int(os.getenv("DEDUP_RESTART_GAP")) if os.getenv("DEDUP_RESTART_GAP") else None,
+            restart_floor=int(os.getenv("DEDUP_RESTART_FLOOR", "1"))
+        )
+
+    def _device(self, device_id: str) -> DeviceWindow:
+        device = self.devices.get(device_id)
+        if device is None:
+            if len(self.devices) >= self.max_devices:
+                # The evicted device's keys stay in the Bloom filter
+                self.devices.popitem(last=False)
+            device = self.devices[device_id] = DeviceWindow()
+        else:
+            self.devices.move_to_end(device_id)
+        return device
+
+    @staticmethod
+    def _bloom_item(device_id: str, device: DeviceWindow, key: DedupKey) -> bytes:
+        if isinstance(key, int):
+            return f"{device_id}\0s{device.epoch}\0{key}".encode("utf-8")
+        return f"{device_id}\0k\0{key}".encode("utf-8")
+
+    def _in_bloom(self, item: bytes) -> bool:
+        return item in self.current or (self.previous is not None and item in self.previous)
+
+    def _remember(self, device: DeviceWindow, key: DedupKey, item: bytes) -> None:
+        device.keys[key] = None
+        if len(device.keys) > self.window:
+            device.keys.popitem(last=False)
+        if self.current.count >= self.bloom_capacity:
+            self.previous, self.current = self.current, BloomFilter(self.bloom_bits, self.bloom_hashes)
+        self.current.add(item)
+
+    def check(self, device_id: str, key: Optional[DedupKey]) -> str:
+        """Classify a reading key and remember it if it is new"""
+        if key is None:
+            return NEW
+        self.checked += 1
+        device = self._device(device_id)
+
+        if isinstance(key, int) and key > device.high_water_seq:
+            device.high_water_seq = key
+            self._remember(device, key, self._bloom_item(device_id, device, key))
+            return NEW
+        if isinstance(key, int) and key < device.high_water_seq and (
+            key <= self.restart_floor or key < device.high_water_seq - self.restart_gap
+        ):
+            # Checked before the exact window: a device rebooting early reuses seqs still in it
+            self._restart(device, key)
+            self._remember(device, key, self._bloom_item(device_id, device, key))
+            return NEW
+        if key in device.keys:
+            return self._drop(device_id, DUPLICATE)
+        item = self._bloom_item(device_id, device, key)
+        if self._in_bloom(item):
+            if self.drop_probable:
+                return self._drop(device_id, PROBABLE_DUPLICATE)
+            return PROBABLE_DUPLICATE
+        self._remember(device, key, item)
+        return NEW
+
+    def _restart(self, device: DeviceWindow, seq: int) -> None:
+        """Forget a device's seqs after its counter went back (string keys are kept)"""
+        self.restarts += 1
+        device.epoch += 1
+        device.high_water_seq = seq
+        for key in [key for key in device.keys if isinstance(key, int)]:
+            del device.keys[key]
+
+    def _drop(self, device_id: str, verdict: str) -> str:
+        self.dropped[verdict] += 1
+        self.dropped_by_device[device_id] += 1
+        return verdict
+
+    def filter(self, readings: List[EnergyReading]) -> Tuple[List[EnergyReading], int]:
+        """Return the readings that are not duplicates and how many were dropped"""
+        kept = []
+        for reading in readings:
+            verdict = self.check(reading.device_id, reading.dedup_key)
+            if verdict == NEW or (verdict == PROBABLE_DUPLICATE and not self.drop_probable):
+                kept.append(reading)
+        return kept, len(readings) - len(kept)
+
+    def stats(self, top: int = 20) -> Dict[str, object]:
+        return {
+            "checked_readings": self.checked,
+            "dropped": {DUPLICATE: self.dropped[DUPLICATE], PROBABLE_DUPLICATE: self.dropped[PROBABLE_DUPLICATE]},
+            "drop_probable": self.drop_probable,
+            "seq_restarts": self.restarts,
+            "tracked_devices": len(self.devices),
+            "window_per_device": self.window,
+            "bloom": {
+                "bits": self.bloom_bits,
+                "hashes": self.bloom_hashes,
+                "current_generation_keys": self.current.count,
+                "previous_generation_keys": self.previous.count if self.previous else 0
+            },
+            "top_devices": dict(self.dropped_by_device.most_common(top))
+        }
+
+def apply_idempotency_key(readings: List[EnergyReading], idempotency_key: Optional[str]) -> None:
+    """Derive per-reading keys from a request Idempotency-Key for readings without their own"""
+    if not idempotency_key:
+        return
+    for index, reading in enumerate(readings):
+        if reading.dedup_key is None:
+            reading.dedup_key = f"{idempotency_key}:{index}"
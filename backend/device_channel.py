@@ -0,0 +1,194 @@
+"""Persistent WebSocket ingest channel for ESP32 devices
+
+Protocol (one connection per device)::
+
+    device -> {"type": "hello", "device_id": "ESP32_001", "token": "..."}
+    server -> {"type": "welcome", "device_id": "ESP32_001", "last_seq": 41}
+    device -> {"type": "reading", "seq": 42, "data": {...reading fields...}}
+    server -> {"type": "ack", "seq": 42}
+
+Readings may also be sent as binary frames: a little-endian u32 sequence
+number followed by a struct-schema body (see reading_codec). Every frame is
+acknowledged only after it has gone through the ingest pipeline, and
+``last_seq`` in the welcome tells a reconnecting device where to resume
+(-1 before its first acknowledged frame, so sequences may start at 0).
+Frames with a sequence number at or below the last acknowledged one are
+acked again as duplicates without being reprocessed.
+
+Devices authenticate with ``DEVICE_API_KEY``. Without a key every hello is
+refused, unless ``DEVICE_AUTH_DISABLED=true`` is set for local development.
+"""
+import asyncio
+import hmac
+import json
+import logging
+import os
+import struct
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from energy_reading import EnergyReading, ReadingValidationError, intern_device_id
+from reading_codec import decode_struct_readings
+
+logger = logging.getLogger(__name__)
+
+HELLO_TIMEOUT_SECONDS = 10.0
+_SEQ_PREFIX = struct.Struct("<I")
+
+# WebSocket close codes
+CLOSE_POLICY_VIOLATION = 1008
+
+IngestCallback = Callable[[List[EnergyReading]], Awaitable[None]]
+
+@dataclass
+class DeviceSessionState:
+    device_id: str
+    # Sequences start at 0, so nothing has been acknowledged below -1
+    last_seq: int = -1
+    connected: bool = False
+    # Bumped by every handshake, so a replaced connection does not reset the new one
+    connection: int = 0
+    connected_at: Optional[datetime] = None
+    readings_received: int = 0
+    duplicates: int = 0
+
+@dataclass
+class DeviceSessionStore:
+    """Last acknowledged sequence number per device, kept across reconnects"""
+    sessions: Dict[str, DeviceSessionState] = field(default_factory=dict)
+
+    def get(self, device_id: str) -> DeviceSessionState:
+        session = self.sessions.get(device_id)
+        if session is None:
+            session = self.sessions[device_id] = DeviceSessionState(device_id=device_id)
+        return session
+
+    def stats(self) -> Dict[str, Dict[str, object]]:
+        return {
+            device_id: {
+                "connected": s.connected,
+                "last_seq": s.last_seq,
+                "readings_received": s.readings_received,
+                "duplicates": s.duplicates,
+            }
+            for device_id, s in self.sessions.items()
+        }
+
+class DeviceChannel:
+    def __init__(self, ingest: IngestCallback, api_key: Optional[str] = None, auth_disabled: Optional[bool] = None):
+        self.ingest = ingest
+        self.api_key = api_key if api_key is not None else os.getenv("DEVICE_API_KEY")
+        if auth_disabled is None:
+            auth_disabled = os.getenv("DEVICE_AUTH_DISABLED", "false").lower() in ("1", "true", "yes")
+        self.auth_disabled = auth_disabled
+        self.store = DeviceSessionStore()
+        if not self.api_key:
+            if self.auth_disabled:
+                logger.warning("DEVICE_AUTH_DISABLED set - device WebSocket accepts any token")
+            else:
+                logger.warning("DEVICE_API_KEY not set - device WebSocket refuses all devices")
+
+    def authenticate(self, token: Optional[str]) -> bool:
+        """Check a device token against the shared device API key"""
+        if not self.api_key:
+            # Fail closed unless authentication was explicitly disabled
+            return self.auth_disabled
+        return isinstance(token, str) and hmac.compare_digest(token.encode(), self.api_key.encode())
+
+    async def _handshake(self, websocket: WebSocket) -> Optional[DeviceSessionState]:
+        try:
+            hello = json.loads(await asyncio.wait_for(websocket.receive_text(), HELLO_TIMEOUT_SECONDS))
+            device_id = intern_device_id(hello.get("device_id"))
+        except WebSocketDisconnect:
+            return None
+        except (asyncio.TimeoutError, ValueError, AttributeError, KeyError) as e:
+            await websocket.close(code=CLOSE_POLICY_VIOLATION, reason=f"Invalid hello: {e}")
+            return None
+
+        if hello.get("type") != "hello" or not self.authenticate(hello.get("token")):
+            await websocket.close(code=CLOSE_POLICY_VIOLATION, reason="Authentication failed")
+            return None
+
+        session = self.store.get(device_id)
+        if session.connected:
+            logger.warning(f"Device {device_id} reconnected while a session was still open")
+        session.connection += 1
+        session.connected = True
+        session.connected_at = datetime.now()
+        await websocket.send_text(json.dumps({
+            "type": "welcome",
+            "device_id": device_id,
+            "last_seq": session.last_seq,
+            "server_time": session.connected_at.isoformat()
+        }))
+        return session
+
+    def _decode_frame(self, message: Dict) -> tuple:
+        """Return (seq, readings) for a text or binary frame"""
+        server_time = datetime.now()
+        if message.get("bytes") is not None:
+            frame = message["bytes"]
+            if len(frame) < _SEQ_PREFIX.size:
+                raise ReadingValidationError("Binary frame too short")
+            (seq,) = _SEQ_PREFIX.unpack_from(frame, 0)
+            return seq, decode_struct_readings(frame[_SEQ_PREFIX.size:], server_time)
+
+        frame = json.loads(message.get("text") or "")
+        if frame.get("type") != "reading":
+            raise ReadingValidationError(f"Unexpected frame type: {frame.get('type')}")
+        seq = frame.get("seq")
+        if seq.__class__ is not int or seq < 0:
+            raise ReadingValidationError("Frame 'seq' must be a non-negative integer")
+        data = frame.get("data")
+        items = data if isinstance(data, list) else [data]
+        return seq, [EnergyReading.from_payload(item, server_time) for item in items]
+
+    async def serve(self, websocket: WebSocket) -> None:
+        """Run the ingest protocol for one device connection"""
+        await websocket.accept()
+        session = await self._handshake(websocket)
+        if session is None:
+            return
+        connection = session.connection
+
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+
+                seq = None
+                try:
+                    seq, readings = self._decode_frame(message)
+                    if any(r.device_id != session.device_id for r in readings):
+                        raise ReadingValidationError("Reading device_id does not match the authenticated device")
+                except (ReadingValidationError, ValueError, AttributeError) as e:
+                    await websocket.send_text(json.dumps({"type": "nack", "seq": seq, "error": str(e)}))
+                    continue
+
+                if seq <= session.last_seq:
+                    session.duplicates += 1
+                    await websocket.send_text(json.dumps({"type": "ack", "seq": seq, "duplicate": True}))
+                    continue
+
+                try:
+                    await self.ingest(readings)
+                except Exception as e:
+                    logger.error(f"Device {session.device_id} ingest failed at seq {seq}: {e}")
+                    nack = {"type": "nack", "seq": seq, "error": str(e)}
+                    retry_after = getattr(e, "retry_after", None)
+                    if retry_after is not None:
+                        nack["retry_after"] = retry_after
+                    await websocket.send_text(json.dumps(nack))
+                    continue
+                session.last_seq = seq
+                session.readings_received += len(readings)
+                await websocket.send_text(json.dumps({"type": "ack", "seq": seq}))
+        except WebSocketDisconnect:
+            pass
+        finally:
+            if session.connection == connection:
+                session.connected = False
@@ -0,0 +1,169 @@
+"""Device registry: which participant (and DID) each ESP32 device belongs to
+
+The ``devices`` table links a ``device_id`` to a ``guardian_participants``
+row. ``DeviceRegistry`` keeps two in-memory indexes over it, device ->
+attribution and participant -> devices, loaded once at startup and kept
+current write-through: every change is written to Supabase first and then
+applied to the indexes, so ingest, batching and participant status resolve
+attribution with a dict lookup instead of a query per reading.
+
+Listeners registered with ``on_change`` see every attribution change; the
+app uses this to route a registered device's readings into its
+participant's batching partition. Other cluster nodes reload the changed
+rows when they are told to invalidate them (``refresh_device`` /
+``refresh_participant``).
+"""
+import logging
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 1000
+
+@dataclass(frozen=True)
+class DeviceAttribution:
+    device_id: str
+    participant_id: str
+    participant_did: Optional[str] = None
+    label: Optional[str] = None
+
+# Called with the device ID and its new attribution (None when unregistered)
+ChangeListener = Callable[[str, Optional[DeviceAttribution]], None]
+
+class UnknownParticipant(LookupError):
+    """Raised when registering devices to a participant that does not exist"""
+
+def participant_partition_key(participant_id: str) -> str:
+    """Batching partition holding a participant's registered devices"""
+    return f"participant-{participant_id}"
+
+def _pages(client, table: str, columns: str, order: str) -> Iterator[List[Dict[str, Any]]]:
+    offset = 0
+    while True:
+        rows = client.table(table).select(columns).order(order).range(offset, offset + PAGE_SIZE - 1).execute().data
+        if rows:
+            yield rows
+        if len(rows) < PAGE_SIZE:
+            return
+        offset += PAGE_SIZE
+
+class DeviceRegistry:
+    def __init__(self):
+        self.devices: Dict[str, DeviceAttribution] = {}
+        self.participant_devices: Dict[str, Set[str]] = defaultdict(set)
+        # participant_id -> DID (None until Guardian has issued one)
+        self.participants: Dict[str, Optional[str]] = {}
+        self.loaded_at: Optional[datetime] = None
+        self._listeners: List[ChangeListener] = []
+        self._lock = threading.Lock()
+
+    def on_change(self, listener: ChangeListener) -> None:
+        self._listeners.append(listener)
+
+    def _notify(self, device_id: str, attribution: Optional[DeviceAttribution]) -> None:
+        for listener in self._listeners:
+            try:
+                listener(device_id, attribution)
+            except Exception as e:
+                logger.error(f"Device registry listener failed for {device_id}: {e}")
+
+    def _set(self, device_id: str, attribution: Optional[DeviceAttribution]) -> Optional[DeviceAttribution]:
+        """Apply one change to both indexes and tell the listeners; return the previous attribution"""
+        with self._lock:
+            previous = self.devices.pop(device_id, None)
+            if previous is not None:
+                self.participant_devices[previous.participant_id].discard(device_id)
+            if attribution is not None:
+                self.devices[device_id] = attribution
+                self.participant_devices[attribution.participant_id].add(device_id)
+        if previous != attribution:
+            self._notify(device_id, attribution)
+        return previous
+
+    def load(self, client) -> int:
+        """Replace the indexes with the devices and participants stored in Supabase"""
+        participants = {}
+        for rows in _pages(client, "guardian_participants", "id,participant_did", "id"):
+            participants.update((row["id"], row.get("participant_did")) for row in rows)
+        stored = {}
+        for rows in _pages(client, "devices", "device_id,participant_id,label", "device_id"):
+            for row in rows:
+                stored[row["device_id"]] = DeviceAttribution(
+                    row["device_id"], row["participant_id"], participants.get(row["participant_id"]), row.get("label")
+                )
+        with self._lock:
+            self.participants = participants
+        for device_id in set(self.devices) - set(stored):
+            self._set(device_id, None)
+        for device_id, attribution in stored.items():
+            self._set(device_id, attribution)
+        self.loaded_at = datetime.now()
+        return len(stored)
+
+    def attribution(self, device_id: str) -> Optional[DeviceAttribution]:
+        return self.devices.get(device_id)
+
+    def devices_of(self, participant_id: str) -> List[str]:
+        return sorted(self.participant_devices.get(participant_id, ()))
+
+    def add_participant(self, participant_id: str, participant_did: Optional[str] = None) -> None:
+        """Index a participant stored by the registration endpoint (or give it its DID)"""
+        with self._lock:
+            self.participants[participant_id] = participant_did
+            device_ids = list(self.participant_devices.get(participant_id, ()))
+        for device_id in device_ids:
+            attribution = self.devices[device_id]
+            self._set(device_id, DeviceAttribution(device_id, participant_id, participant_did, attribution.label))
+
+    def register(self, client, device_id: str, participant_id: str, label: Optional[str] = None) -> Optional[DeviceAttribution]:
+        """Attribute a device to a participant (moving it if registered elsewhere); return the previous attribution"""
+        if participant_id not in self.participants:
+            # Created on another node whose invalidation has not arrived (or was lost)
+            self.refresh_participant(client, participant_id)
+        if participant_id not in self.participants:
+            raise UnknownParticipant(participant_id)
+        client.table("devices").upsert({
+            "device_id": device_id,
+            "participant_id": participant_id,
+            "label": label,
+            "updated_at": datetime.now().isoformat()
+        }, on_conflict="device_id").execute()
+        return self._set(device_id, DeviceAttribution(device_id, participant_id, self.participants[participant_id], label))
+
+    def unregister(self, client, device_id: str) -> Optional[DeviceAttribution]:
+        """Remove a device's attribution; return what it was (None if it was not registered)"""
+        if device_id not in self.devices:
+            return None
+        client.table("devices").delete().eq("device_id", device_id).execute()
+        return self._set(device_id, None)
+
+    def refresh_device(self, client, device_id: str) -> Optional[DeviceAttribution]:
+        """Reload one device after another node changed it"""
+        rows = client.table("devices").select("device_id,participant_id,label").eq("device_id", device_id).execute().data
+        if not rows:
+            self._set(device_id, None)
+            return None
+        row = rows[0]
+        if row["participant_id"] not in self.participants:
+            self.refresh_participant(client, row["participant_id"])
+        attribution = DeviceAttribution(device_id, row["participant_id"], self.participants.get(row["participant_id"]), row.get("label"))
+        self._set(device_id, attribution)
+        return attribution
+
+    def refresh_participant(self, client, participant_id: str) -> None:
+        """Reload one participant's DID after another node changed it"""
+        rows = client.table("guardian_participants").select("id,participant_did").eq("id", participant_id).execute().data
+        if rows:
+            self.add_participant(participant_id, rows[0].get("participant_did"))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "devices": len(self.devices),
+            "participants": len(self.participants),
+            "participants_with_devices": sum(1 for devices in self.participant_devices.values() if devices),
+            "loaded_at": self.loaded_at.isoformat() if self.loaded_at else None
+        }
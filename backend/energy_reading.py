@@ -0,0 +1,241 @@
+import math
+import sys
+from datetime import datetime
+from typing import Dict, Any, Mapping, Optional, Sequence
+
+class ReadingValidationError(ValueError):
+    """Raised when a device payload is not a valid energy reading"""
+
+# Field order is the wire/storage order for every reading
+REQUIRED_FIELDS = ("device_id", "current", "voltage", "power")
+OPTIONAL_FIELDS = ("total_energy_kwh", "efficiency", "ambient_temp_c", "irradiance_w_m2", "power_factor")
+NUMERIC_FIELDS = REQUIRED_FIELDS[1:] + OPTIONAL_FIELDS
+
+# Device-supplied timestamps are accepted but always replaced by server time
+SERVER_FIELDS = frozenset({"timestamp", "server_received_at"})
+# Retry identification (see dedup.py); not part of the stored or hashed reading
+DEDUP_FIELDS = frozenset({"seq", "idempotency_key"})
+ALLOWED_FIELDS = frozenset(REQUIRED_FIELDS + OPTIONAL_FIELDS) | SERVER_FIELDS | DEDUP_FIELDS
+
+MAX_DEVICE_ID_LENGTH = 64
+MAX_IDEMPOTENCY_KEY_LENGTH = 128
+
+# Physically plausible (inclusive) limits; anything outside is rejected at ingest
+FIELD_RANGES: Dict[str, tuple] = {
+    "current": (-1000.0, 1000.0),           # A
+    "voltage": (0.0, 1000.0),               # V
+    "power": (-1_000_000.0, 1_000_000.0),   # W
+    "total_energy_kwh": (0.0, 1e9),         # kWh
+    "efficiency": (0.0, 1.0),               # ratio
+    "ambient_temp_c": (-60.0, 100.0),       # °C
+    "irradiance_w_m2": (0.0, 2000.0),       # W/m²
+    "power_factor": (-1.0, 1.0),            # ratio
+}
+
+_CURRENT_RANGE = FIELD_RANGES["current"]
+_VOLTAGE_RANGE = FIELD_RANGES["voltage"]
+_POWER_RANGE = FIELD_RANGES["power"]
+_ENERGY_RANGE = FIELD_RANGES["total_energy_kwh"]
+_EFFICIENCY_RANGE = FIELD_RANGES["efficiency"]
+_TEMP_RANGE = FIELD_RANGES["ambient_temp_c"]
+_IRRADIANCE_RANGE = FIELD_RANGES["irradiance_w_m2"]
+_POWER_FACTOR_RANGE = FIELD_RANGES["power_factor"]
+
+_RANGE_TABLE = tuple(
+    (name, FIELD_RANGES[name][0], FIELD_RANGES[name][1], name in REQUIRED_FIELDS) for name in NUMERIC_FIELDS
+)
+
+def _check_number(name: str, value: Any, low: float, high: float) -> float:
+    # bool is an int subclass but never a valid measurement
+    if value.__class__ is not float:
+        if value.__class__ is not int:
+            raise ReadingValidationError(f"Field '{name}' must be a number, got {type(value).__name__}")
+        try:
+            value = float(value)
+        except OverflowError:
+            raise ReadingValidationError(f"Field '{name}' must be a finite number")
+    if not low <= value <= high:
+        if math.isnan(value):
+            raise ReadingValidationError(f"Field '{name}' must be a finite number")
+        raise ReadingValidationError(f"Field '{name}' out of range [{low}, {high}]: {value}")
+    return value
+
+def _check_range(name: str, value: Optional[float], low: float, high: float, required: bool) -> Optional[float]:
+    if value is None:
+        if required:
+            raise ReadingValidationError(f"Field '{name}' is required")
+        return None
+    if not low <= value <= high:
+        if math.isnan(value):
+            raise ReadingValidationError(f"Field '{name}' must be a finite number")
+        raise ReadingValidationError(f"Field '{name}' out of range [{low}, {high}]: {value}")
+    return value
+
+def _check_dedup_key(payload: Mapping[str, Any]) -> Optional[Any]:
+    """Idempotency key (str) or sequence number (int) of a payload, None if it has neither"""
+    key = payload.get("idempotency_key")
+    if key is not None:
+        if key.__class__ is not str or not 0 < len(key) <= MAX_IDEMPOTENCY_KEY_LENGTH:
+            raise ReadingValidationError(
+                f"Field 'idempotency_key' must be a string of 1-{MAX_IDEMPOTENCY_KEY_LENGTH} characters"
+            )
+        return key
+    seq = payload.get("seq")
+    if seq is not None and (seq.__class__ is not int or seq < 0):
+        raise ReadingValidationError("Field 'seq' must be a non-negative integer")
+    return seq
+
+def intern_device_id(device_id: Any) -> str:
+    """Validate a device ID and return the interned string"""
+    if device_id.__class__ is not str:
+        raise ReadingValidationError("Field 'device_id' must be a string")
+    if not 0 < len(device_id) <= MAX_DEVICE_ID_LENGTH:
+        raise ReadingValidationError(f"Field 'device_id' must be 1-{MAX_DEVICE_ID_LENGTH} characters")
+    return sys.intern(device_id)
+
+class EnergyReading:
+    """Compact, validated ESP32 energy reading
+
+    Readings are held in slots instead of a per-reading dict, numeric fields are
+    plain floats (optional ones are None when absent) and device IDs are interned
+    so every reading from a device shares one string. ``to_dict`` produces the
+    exact JSON shape the rest of the system (storage, hashing, broadcast) uses.
+    ``quality_flags`` is the screening bitmask (see screening.py), 0 when clean,
+    and ``dedup_key`` the device's seq number or idempotency key, if it sent one.
+    """
+
+    __slots__ = ("device_id",) + NUMERIC_FIELDS + ("received_at", "quality_flags", "dedup_key")
+
+    def __init__(
+        self,
+        device_id: str,
+        current: float,
+        voltage: float,
+        power: float,
+        received_at: datetime,
+        total_energy_kwh: Optional[float] = None,
+        efficiency: Optional[float] = None,
+        ambient_temp_c: Optional[float] = None,
+        irradiance_w_m2: Optional[float] = None,
+        power_factor: Optional[float] = None,
+        quality_flags: int = 0,
+        dedup_key: Optional[Any] = None,
+    ):
+        self.device_id = device_id
+        self.current = current
+        self.voltage = voltage
+        self.power = power
+        self.total_energy_kwh = total_energy_kwh
+        self.efficiency = efficiency
+        self.ambient_temp_c = ambient_temp_c
+        self.irradiance_w_m2 = irradiance_w_m2
+        self.power_factor = power_factor
+        self.received_at = received_at
+        self.quality_flags = quality_flags
+        self.dedup_key = dedup_key
+
+    @classmethod
+    def from_payload(cls, payload: Mapping[str, Any], received_at: datetime) -> "EnergyReading":
+        """Validate a decoded device payload and build a reading stamped with server time"""
+        if not isinstance(payload, Mapping):
+            raise ReadingValidationError("Reading must be a JSON object")
+
+        unknown = payload.keys() - ALLOWED_FIELDS
+        if unknown:
+            raise ReadingValidationError(f"Unknown fields: {sorted(unknown)}")
+
+        missing = [field for field in REQUIRED_FIELDS if field not in payload]
+        if missing:
+            raise ReadingValidationError(f"Missing required fields: {missing}")
+
+        reading = cls.__new__(cls)
+        reading.device_id = intern_device_id(payload["device_id"])
+        get = payload.get
+        for name, low, high, required in _RANGE_TABLE:
+            value = get(name)
+            if value is None and not required:
+                setattr(reading, name, None)
+            else:
+                setattr(reading, name, _check_number(name, value, low, high))
+        reading.received_at = received_at
+        reading.quality_flags = 0
+        reading.dedup_key = _check_dedup_key(payload)
+        return reading
+
+    @classmethod
+    def from_values(cls, device_id: str, values: Sequence[Optional[float]], received_at: datetime) -> "EnergyReading":
+        """Build a reading from already-decoded floats in NUMERIC_FIELDS order (range checks only)"""
+        try:
+            (current, voltage, power, total_energy_kwh, efficiency,
+             ambient_temp_c, irradiance_w_m2, power_factor) = values
+            in_range = (
+                _CURRENT_RANGE[0] <= current <= _CURRENT_RANGE[1]
+                and _VOLTAGE_RANGE[0] <= voltage <= _VOLTAGE_RANGE[1]
+                and _POWER_RANGE[0] <= power <= _POWER_RANGE[1]
+                and (total_energy_kwh is None or _ENERGY_RANGE[0] <= total_energy_kwh <= _ENERGY_RANGE[1])
+                and (efficiency is None or _EFFICIENCY_RANGE[0] <= efficiency <= _EFFICIENCY_RANGE[1])
+                and (ambient_temp_c is None or _TEMP_RANGE[0] <= ambient_temp_c <= _TEMP_RANGE[1])
+                and (irradiance_w_m2 is None or _IRRADIANCE_RANGE[0] <= irradiance_w_m2 <= _IRRADIANCE_RANGE[1])
+                and (power_factor is None or _POWER_FACTOR_RANGE[0] <= power_factor <= _POWER_FACTOR_RANGE[1])
+            )
+        except (TypeError, ValueError):
+            in_range = False
+        if not in_range:
+            # Slow path only to produce a precise error message
+            if len(values) != len(NUMERIC_FIELDS):
+                raise ReadingValidationError(f"Expected {len(NUMERIC_FIELDS)} values, got {len(values)}")
+            for (name, low, high, required), value in zip(_RANGE_TABLE, values):
+                _check_range(name, value, low, high, required)
+
+        reading = cls.__new__(cls)
+        reading.device_id = intern_device_id(device_id)
+        reading.current = current
+        reading.voltage = voltage
+        reading.power = power
+        reading.total_energy_kwh = total_energy_kwh
+        reading.efficiency = efficiency
+        reading.ambient_temp_c = ambient_temp_c
+        reading.irradiance_w_m2 = irradiance_w_m2
+        reading.power_factor = power_factor
+        reading.received_at = received_at
+        reading.quality_flags = 0
+        reading.dedup_key = None
+        return reading
+
+    @classmethod
+    def from_record(cls, record: Mapping[str, Any]) -> "EnergyReading":
+        """Rebuild a reading from a stored row (energy_readings or batch_contents.reading_data)
+
+        Storage columns such as ``id`` or ``created_at`` are ignored; the stored
+        ``timestamp`` becomes the server receive time.
+        """
+        try:
+            received_at = datetime.fromisoformat(record["timestamp"])
+            values = [None if record.get(name) is None else float(record[name]) for name in NUMERIC_FIELDS]
+        except (KeyError, TypeError, ValueError) as e:
+            raise ReadingValidationError(f"Invalid stored reading: {e}")
+        reading = cls.from_values(record.get("device_id"), values, received_at)
+        reading.quality_flags = record.get("quality_flags") or 0
+        return reading
+
+    @property
+    def timestamp(self) -> str:
+        """Server receive time in ISO 8601 format"""
+        return self.received_at.isoformat()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the JSON representation used for storage, hashing and broadcast"""
+        data = {"device_id": self.device_id}
+        for name in NUMERIC_FIELDS:
+            value = getattr(self, name)
+            if value is not None:
+                data[name] = value
+        timestamp = self.received_at.isoformat()
+        data["timestamp"] = timestamp
+        data["server_received_at"] = timestamp
+        if self.quality_flags:
+            data["quality_flags"] = self.quality_flags
+        return data
+
+    def __repr__(self) -> str:
+        return f"EnergyReading(device_id={self.device_id!r}, power={self.power!r}, timestamp={self.timestamp!r})"
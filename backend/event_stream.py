@@ -0,0 +1,160 @@
+"""Sequence-numbered event log behind the Server-Sent Events stream
+
+Every message pushed to ``/ws`` subscribers is also appended to a bounded
+in-memory log. Event IDs are ``<epoch>-<seq>``: ``seq`` increases by one per
+event and ``epoch`` identifies this server process, so a client reconnecting
+with ``Last-Event-ID`` gets exactly the events after that ID. When the ID is
+from another process (restart) or older than the log still holds, the
+stream sends a ``reset`` event and replays everything that is still held.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+from itertools import islice
+from typing import AsyncIterator, Collection, Deque, List, NamedTuple, Optional, Set, Tuple
+
+RESET_EVENT = "reset"
+
+class LoggedEvent(NamedTuple):
+    seq: int
+    type: str
+    device_id: Optional[str]
+    # Same JSON message as sent over /ws
+    message: str
+
+class EventLog:
+    def __init__(self, capacity: int = 10_000, epoch: Optional[str] = None):
+        self.capacity = capacity
+        self.epoch = epoch or format(int(time.time() * 1000), "x")
+        self.events: Deque[LoggedEvent] = deque(maxlen=capacity)
+        self.last_seq = 0
+        # Events may be appended from the mock data thread's own event loop
+        self._lock = threading.Lock()
+        self._waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+        self.subscribers = 0
+        # Set on shutdown: streams send what is logged and end
+        self.closed = False
+
+    @classmethod
+    def from_env(cls) -> "EventLog":
+        return cls(capacity=int(os.getenv("SSE_EVENT_LOG_SIZE", "10000")))
+
+    def event_id(self, seq: int) -> str:
+        return f"{self.epoch}-{seq}"
+
+    def append(self, event_type: str, message: str, device_id: Optional[str] = None) -> int:
+        with self._lock:
+            self.last_seq += 1
+            seq = self.last_seq
+            self.events.append(LoggedEvent(seq, event_type, device_id, message))
+        self._wake()
+        return seq
+
+    def _wake(self) -> None:
+        with self._lock:
+            # Each waiter is woken once; it re-registers after reading
+            waiters, self._waiters = self._waiters, set()
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def close(self) -> None:
+        """End every stream once it has sent the events logged so far"""
+        self.closed = True
+        self._wake()
+
+    def resume_seq(self, last_event_id: Optional[str]) -> Tuple[int, bool]:
+        """Sequence number to continue after, and whether the client missed events it cannot get back"""
+        if not last_event_id:
+            # New subscriber: live events only
+            return self.last_seq, False
+        epoch, _, seq = last_event_id.rpartition("-")
+        if epoch != self.epoch or not seq.isdigit() or int(seq) > self.last_seq:
+            return self.oldest_seq - 1, True
+        seq = int(seq)
+        if seq < self.oldest_seq - 1:
+            return self.oldest_seq - 1, True
+        return seq, False
+
+    @property
+    def oldest_seq(self) -> int:
+        return self.events[0].seq if self.events else self.last_seq + 1
+
+    def read(self, after_seq: int, limit: int = 500) -> List[LoggedEvent]:
+        """Up to ``limit`` events with a sequence number above ``after_seq``"""
+        with self._lock:
+            if not self.events:
+                return []
+            start = max(0, after_seq + 1 - self.events[0].seq)
+            return list(islice(self.events, start, start + limit))
+
+    async def wait(self, after_seq: int, timeout: float) -> bool:
+        """Wait until an event after ``after_seq`` is logged; False on timeout"""
+        event = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), event)
+        with self._lock:
+            if self.last_seq > after_seq or self.closed:
+                return True
+            self._waiters.add(waiter)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+    def _reset(self, seq: int) -> str:
+        message = json.dumps({"type": RESET_EVENT, "data": {"oldest_seq": seq + 1}})
+        return f"id: {self.event_id(seq)}\nevent: {RESET_EVENT}\ndata: {message}\n\n"
+
+    def format(self, event: LoggedEvent) -> str:
+        return f"id: {self.event_id(event.seq)}\nevent: {event.type}\ndata: {event.message}\n\n"
+
+    async def stream(self, last_event_id: Optional[str], device_ids: Optional[Collection[str]] = None,
+                     event_types: Optional[Collection[str]] = None, heartbeat_seconds: float = 15.0,
+                     retry_ms: int = 3000) -> AsyncIterator[str]:
+        """SSE text for one subscriber: replay after ``last_event_id``, then live events"""
+        seq, missed = self.resume_seq(last_event_id)
+        self.subscribers += 1
+        try:
+            yield f"retry: {retry_ms}\n\n"
+            if missed:
+                yield self._reset(seq)
+            while True:
+                events = self.read(seq)
+                if not events:
+                    if self.closed:
+                        # Clients reconnect (to another node) with Last-Event-ID after retry_ms
+                        return
+                    if not await self.wait(seq, heartbeat_seconds):
+                        # Keeps proxies from closing an idle stream; the id (without data)
+                        # moves a filtered client's Last-Event-ID past skipped events
+                        yield f": keepalive\nid: {self.event_id(seq)}\n\n"
+                    continue
+                if events[0].seq > seq + 1:
+                    # The subscriber fell further behind than the log holds
+                    yield self._reset(events[0].seq - 1)
+                seq = events[-1].seq
+                chunk = [
+                    self.format(event) for event in events
+                    if (device_ids is None or event.device_id is None or event.device_id in device_ids)
+                    and (event_types is None or event.type in event_types)
+                ]
+                if chunk:
+                    yield "".join(chunk)
+        finally:
+            self.subscribers -= 1
+
+    def stats(self) -> dict:
+        return {
+            "epoch": self.epoch,
+            "capacity": self.capacity,
+            "logged_events": len(self.events),
+            "oldest_seq": self.oldest_seq,
+            "last_seq": self.last_seq,
+            "subscribers": self.subscribers
+        }
@@ -0,0 +1,335 @@
+"""Streaming export of readings, proofs and batch contents to CSV or Parquet
+
+Usage::
+
+    python export.py readings --start 2025-09-01 --end 2025-12-01 --with-proofs -o readings.parquet
+    python export.py batch_contents --start 2025-09-01 --end 2025-10-01 --device ESP32_001 -o contents.csv
+
+Tables are walked by time range (and device) with a keyset cursor, one page
+at a time, and every page is written out before the next is fetched, so
+memory stays constant however long the range is. CSV is written row by row;
+Parquet gets one row group per page (requires the optional ``pyarrow``
+package). With ``--with-proofs`` each reading is joined to the ``batch_id``
+and ``hcs_transaction_id`` of the batch that anchored it, if any.
+
+The same chunks back the ``/api/export/{dataset}`` endpoint.
+"""
+import argparse
+import csv
+import io
+import json
+import logging
+import sys
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from energy_reading import NUMERIC_FIELDS
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # optional dependency
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 1000
+FORMAT_CSV = "csv"
+FORMAT_PARQUET = "parquet"
+MEDIA_TYPES = {FORMAT_CSV: "text/csv", FORMAT_PARQUET: "application/vnd.apache.parquet"}
+
+@dataclass(frozen=True)
+class ExportColumn:
+    name: str
+    # str, float, int, bool or timestamp
+    kind: str
+
+@dataclass(frozen=True)
+class Dataset:
+    table: str
+    time_column: str
+    # Unique column ordering rows with the same timestamp
+    tiebreak_column: str
+    columns: Tuple[ExportColumn, ...]
+    supports_device: bool = True
+
+READING_COLUMNS = (
+    (ExportColumn("device_id", "str"), ExportColumn("timestamp", "timestamp"))
+    + tuple(ExportColumn(name, "float") for name in NUMERIC_FIELDS)
+    + (ExportColumn("quality_flags", "int"),)
+)
+PROOF_JOIN_COLUMNS = (ExportColumn("batch_id", "str"), ExportColumn("hcs_transaction_id", "str"))
+
+DATASETS: Dict[str, Dataset] = {
+    "readings": Dataset(
+        "energy_readings", "timestamp", "id",
+        (ExportColumn("id", "str"),) + READING_COLUMNS
+        + (ExportColumn("quarantined", "bool"), ExportColumn("participant_id", "str"))
+    ),
+    "proofs": Dataset(
+        "proof_anchors", "created_at", "batch_id",
+        (
+            ExportColumn("batch_id", "str"),
+            ExportColumn("hcs_transaction_id", "str"),
+            ExportColumn("consensus_timestamp", "str"),
+            ExportColumn("data_hash", "str"),
+            ExportColumn("created_at", "timestamp"),
+            ExportColumn("hash_scheme", "str"),
+            ExportColumn("codec", "str"),
+            ExportColumn("reading_count", "int"),
+            ExportColumn("device_count", "int"),
+            ExportColumn("total_energy_kwh", "float"),
+            ExportColumn("partition_key", "str"),
+            ExportColumn("participant_did", "str"),
+        ),
+        # Batches are not stored per device
+        supports_device=False
+    ),
+    "batch_contents": Dataset(
+        "batch_contents", "original_timestamp", "id",
+        (ExportColumn("batch_id", "str"), ExportColumn("batch_position", "int")) + READING_COLUMNS
+    ),
+}
+
+class ExportError(ValueError):
+    """Raised for export requests that cannot be served"""
+
+def _normalize_ts(value: str) -> str:
+    return datetime.fromisoformat(value).isoformat()
+
+def scan_table(client, dataset: Dataset, start: datetime, end: datetime, device_id: Optional[str] = None,
+               page_size: int = PAGE_SIZE) -> Iterator[List[Dict]]:
+    """Yield pages of rows in [start, end) ordered by (time column, tiebreak) using a keyset cursor"""
+    time_column, tiebreak = dataset.time_column, dataset.tiebreak_column
+    cursor: Optional[Tuple[str, Any]] = None
+    while True:
+        query = client.table(dataset.table).select("*").lt(time_column, end.isoformat())
+        if device_id:
+            query = query.eq("device_id", device_id)
+        if cursor is None:
+            query = query.gte(time_column, start.isoformat())
+        else:
+            ts, key = cursor
+            query = query.or_(f"{time_column}.gt.{ts},and({time_column}.eq.{ts},{tiebreak}.gt.{key})")
+        rows = query.order(time_column).order(tiebreak).limit(page_size).execute().data
+        if rows:
+            yield rows
+        if len(rows) < page_size:
+            return
+        cursor = (rows[-1][time_column], rows[-1][tiebreak])
+
+class ProofJoiner:
+    """Look up the anchoring batch of each reading in a page, with a bounded proof cache"""
+
+    def __init__(self, client, device_id: Optional[str] = None, cache_size: int = 10_000):
+        self.client = client
+        self.device_id = device_id
+        self.cache_size = cache_size
+        self.transactions: "OrderedDict[str, Optional[str]]" = OrderedDict()
+
+    def _batch_ids(self, first_ts: str, last_ts: str) -> Dict[Tuple[str, str], str]:
+        batch_ids = {}
+        offset = 0
+        while True:
+            query = (
+                self.client.table("batch_contents").select("batch_id,device_id,original_timestamp")
+                .gte("original_timestamp", first_ts).lte("original_timestamp", last_ts)
+            )
+            if self.device_id:
+                query = query.eq("device_id", self.device_id)
+            rows = query.order("original_timestamp").range(offset, offset + PAGE_SIZE - 1).execute().data
+            for row in rows:
+                batch_ids[(row["device_id"], _normalize_ts(row["original_timestamp"]))] = row["batch_id"]
+            if len(rows) < PAGE_SIZE:
+                return batch_ids
+            offset += PAGE_SIZE
+
+    def _transactions(self, batch_ids: Iterable[str]) -> None:
+        missing = [batch_id for batch_id in set(batch_ids) if batch_id not in self.transactions]
+        for i in range(0, len(missing), 200):
+            chunk = missing[i:i + 200]
+            rows = (
+                self.client.table("proof_anchors").select("batch_id,hcs_transaction_id")
+                .in_("batch_id", chunk).execute().data
+            )
+            found = {row["batch_id"]: row["hcs_transaction_id"] for row in rows}
+            for batch_id in chunk:
+                self.transactions[batch_id] = found.get(batch_id)
+        while len(self.transactions) > self.cache_size:
+            self.transactions.popitem(last=False)
+
+    def join(self, rows: List[Dict]) -> None:
+        """Add batch_id and hcs_transaction_id to a page of energy_readings rows (time ordered)"""
+        batch_ids = self._batch_ids(rows[0]["timestamp"], rows[-1]["timestamp"])
+        self._transactions(batch_ids.values())
+        for row in rows:
+            batch_id = batch_ids.get((row["device_id"], _normalize_ts(row["timestamp"])))
+            row["batch_id"] = batch_id
+            row["hcs_transaction_id"] = self.transactions.get(batch_id) if batch_id else None
+
+def _flatten(dataset_name: str, row: Dict) -> Dict:
+    if dataset_name == "proofs":
+        return {**(row.get("batch_metadata") or {}), **row}
+    if dataset_name == "batch_contents":
+        reading = row.get("reading_data") or {}
+        return {**reading, "timestamp": row["original_timestamp"], **row}
+    return row
+
+def export_columns(dataset_name: str, with_proofs: bool = False) -> Tuple[ExportColumn, ...]:
+    columns = DATASETS[dataset_name].columns
+    return columns + PROOF_JOIN_COLUMNS if with_proofs and dataset_name == "readings" else columns
+
+def check_export(dataset_name: str, fmt: str, start: datetime, end: datetime,
+                 device_id: Optional[str] = None, with_proofs: bool = False) -> None:
+    """Raise ExportError for a request that cannot be served, before anything is written"""
+    dataset = DATASETS.get(dataset_name)
+    if dataset is None:
+        raise ExportError(f"Unknown dataset {dataset_name} (available: {', '.join(DATASETS)})")
+    if fmt not in MEDIA_TYPES:
+        raise ExportError(f"Unknown format {fmt} (available: {', '.join(MEDIA_TYPES)})")
+    if fmt == FORMAT_PARQUET and pyarrow is None:
+        raise ExportError("Parquet export requires the 'pyarrow' package")
+    if device_id and not dataset.supports_device:
+        raise ExportError(f"Dataset {dataset_name} cannot be filtered by device")
+    if with_proofs and dataset_name != "readings":
+        raise ExportError("Proof join is only available for the readings dataset")
+    if start >= end:
+        raise ExportError("start must be before end")
+
+def iter_pages(client, dataset_name: str, start: datetime, end: datetime, device_id: Optional[str] = None,
+               with_proofs: bool = False, page_size: int = PAGE_SIZE) -> Iterator[List[Dict]]:
+    """Pages of flattened export rows"""
+    joiner = ProofJoiner(client, device_id) if with_proofs else None
+    for rows in scan_table(client, DATASETS[dataset_name], start, end, device_id, page_size):
+        if joiner is not None:
+            joiner.join(rows)
+        yield [_flatten(dataset_name, row) for row in rows]
+
+def _csv_value(value: Any) -> Any:
+    return json.dumps(value) if isinstance(value, (dict, list)) else value
+
+def csv_chunks(columns: Tuple[ExportColumn, ...], pages: Iterable[List[Dict]]) -> Iterator[bytes]:
+    """CSV bytes, header first, then one chunk per page"""
+    names = [column.name for column in columns]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    for rows in pages:
+        writer.writerows([_csv_value(row.get(name)) for name in names] for row in rows)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file collecting bytes until they are taken"""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def _arrow_schema(columns: Tuple[ExportColumn, ...]):
+    types = {
+        "str": pyarrow.string(),
+        "float": pyarrow.float64(),
+        "int": pyarrow.int64(),
+        "bool": pyarrow.bool_(),
+        "timestamp": pyarrow.timestamp("us"),
+    }
+    return pyarrow.schema([(column.name, types[column.kind]) for column in columns])
+
+def _arrow_value(kind: str, value: Any) -> Any:
+    if value is None:
+        return None
+    if kind == "timestamp":
+        return datetime.fromisoformat(value)
+    if kind == "str":
+        return value if isinstance(value, str) else json.dumps(value) if isinstance(value, (dict, list)) else str(value)
+    return value
+
+def parquet_chunks(columns: Tuple[ExportColumn, ...], pages: Iterable[List[Dict]]) -> Iterator[bytes]:
+    """Parquet file bytes, one row group per page; the footer comes with the last chunk"""
+    schema = _arrow_schema(columns)
+    sink = _ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema, compression="zstd")
+    try:
+        for rows in pages:
+            arrays = {
+                column.name: [_arrow_value(column.kind, row.get(column.name)) for row in rows]
+                for column in columns
+            }
+            writer.write_table(pyarrow.Table.from_pydict(arrays, schema=schema))
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()
+
+def export_chunks(client, dataset_name: str, fmt: str, start: datetime, end: datetime,
+                  device_id: Optional[str] = None, with_proofs: bool = False,
+                  page_size: int = PAGE_SIZE) -> Iterator[bytes]:
+    """Encoded export file, chunk by chunk; the request is checked before the first chunk"""
+    check_export(dataset_name, fmt, start, end, device_id, with_proofs)
+    columns = export_columns(dataset_name, with_proofs)
+    pages = iter_pages(client, dataset_name, start, end, device_id, with_proofs, page_size)
+    return (csv_chunks if fmt == FORMAT_CSV else parquet_chunks)(columns, pages)
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Export readings, proofs or batch contents to CSV or Parquet")
+    parser.add_argument("dataset", choices=sorted(DATASETS))
+    parser.add_argument("--start", required=True, type=datetime.fromisoformat)
+    parser.add_argument("--end", type=datetime.fromisoformat, default=datetime.now())
+    parser.add_argument("--device", help="Only this device_id")
+    parser.add_argument("--with-proofs", action="store_true", help="Join readings to their batch_id / hcs_transaction_id")
+    parser.add_argument("--format", choices=sorted(MEDIA_TYPES), help="Default: from the output file extension")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    parser.add_argument("-o", "--output", help="Output file (default: CSV to stdout)")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> None:
+    from database import get_supabase
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    args = parse_args(argv)
+    fmt = args.format or (FORMAT_PARQUET if args.output and args.output.endswith(".parquet") else FORMAT_CSV)
+    client = get_supabase()
+    if client is None:
+        sys.exit("Supabase not configured")
+
+    try:
+        chunks = export_chunks(
+            client, args.dataset, fmt, args.start, args.end, args.device, args.with_proofs, args.page_size
+        )
+        if args.output:
+            with open(args.output, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            logger.info(f"✅ Exported {args.dataset} to {args.output}")
+        else:
+            if fmt == FORMAT_PARQUET:
+                sys.exit("Parquet output needs --output")
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+    except ExportError as e:
+        sys.exit(str(e))
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,10 @@
 import httpx
+import asyncio
 import json
 import logging
+import os
 from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 from dataclasses import dataclass
 
 logger = logging.getLogger(__name__)
@@ -19,6 +21,12 @@ class GuardianSubmissionResult:
     success: bool
     response_data: Optional[Dict[str, Any]] = None
     error: Optional[str] = None
+    # False when resubmitting the same request cannot succeed (rejected document)
+    retryable: bool = True
+
+def is_retryable_status(status_code: int) -> bool:
+    """Guardian responses worth retrying: timeouts, throttling, server errors and expired tokens"""
+    return status_code in (401, 408, 425, 429) or status_code >= 500
 
 class GuardianService:
     def __init__(self, guardian_url: str = "https://guardianservice.app"):
@@ -26,6 +34,12 @@ class GuardianService:
         self.client = httpx.AsyncClient(timeout=60.0)
         self.access_token = None
         self.policy_id = "68d69341152381fe552b21ec"  # AMS-I.D policy
+        # Policy block receiving monitoring reports (energy data with Hedera proofs)
+        self.report_block_tag = os.getenv("GUARDIAN_REPORT_BLOCK_TAG", "add_report_bnt")
+        self.block_ids: Dict[str, str] = {}
+        # Dry-run acts as one virtual user per policy at a time, so switching
+        # user and submitting its document must not interleave
+        self.dry_run_user_lock = asyncio.Lock()
         
     async def login(self, email: str, password: str) -> bool:
         """Login to Guardian Service and get access token"""
@@ -81,6 +95,19 @@ class GuardianService:
             logger.error(f"Guardian login error: {e}")
             return False
     
+    async def ensure_authenticated(self) -> bool:
+        """Log in with GUARDIAN_EMAIL / GUARDIAN_PASSWORD and start the dry-run if not done yet"""
+        if self.access_token:
+            return True
+        email = os.getenv("GUARDIAN_EMAIL")
+        password = os.getenv("GUARDIAN_PASSWORD")
+        if not email or not password:
+            return False
+        if not await self.login(email, password):
+            return False
+        await self.initialize_dry_run()
+        return True
+    
     def get_auth_headers(self) -> Dict[str, str]:
         """Get headers with authentication"""
         return {
@@ -227,29 +254,90 @@ class GuardianService:
             logger.error(error_msg)
             return GuardianSubmissionResult(success=False, error=error_msg)
     
-    async def submit_energy_data(self, did: str, energy_data: Dict[str, Any], hedera_proof: str) -> GuardianSubmissionResult:
-        """Submit energy data with Hedera proof to Guardian"""
+    async def get_block_id(self, tag: str) -> Optional[str]:
+        """Resolve (and cache) the ID of a policy block by its tag"""
+        if tag not in self.block_ids:
+            response = await self.client.get(
+                f"{self.guardian_url}/api/v1/policies/{self.policy_id}/tag/{tag}",
+                headers=self.get_auth_headers()
+            )
+            if response.status_code != 200:
+                logger.error(f"Failed to get Guardian block {tag}: {response.text}")
+                return None
+            self.block_ids[tag] = response.json()["id"]
+        return self.block_ids[tag]
+    
+    async def submit_energy_reports(self, did: str, reports: List[Dict[str, Any]]) -> GuardianSubmissionResult:
+        """Submit one monitoring report covering several anchored batches of a participant
+
+        Each report is a dict with ``batch_id``, ``energy_data`` (the batch
+        metadata) and ``hedera_proof`` (HCS transaction ID).
+        """
         try:
-            # This would be implemented based on Guardian's energy data submission endpoints
-            # For now, return success as placeholder
-            logger.info(f"📊 Energy data submitted to Guardian for DID: {did}")
-            logger.info(f"🔗 Hedera proof: {hedera_proof}")
+            block_id = await self.get_block_id(self.report_block_tag)
+            if block_id is None:
+                return GuardianSubmissionResult(success=False, error=f"Guardian block {self.report_block_tag} not available")
             
-            return GuardianSubmissionResult(
-                success=True,
-                response_data={
-                    "did": did,
-                    "energy_data": energy_data,
-                    "hedera_proof": hedera_proof,
-                    "submitted_at": datetime.now().isoformat()
-                }
-            )
+            document = {
+                "participant_did": did,
+                "reading_count": sum(r["energy_data"].get("reading_count", 0) for r in reports),
+                "total_energy_kwh": sum(r["energy_data"].get("total_energy_kwh", 0) for r in reports),
+                "batches": [
+                    {"batch_id": r["batch_id"], "hedera_proof": r["hedera_proof"], **r["energy_data"]}
+                    for r in reports
+                ]
+            }
+            
+            async with self.dry_run_user_lock:
+                # Act as the participant's virtual user
+                login_response = await self.client.post(
+                    f"{self.guardian_url}/api/v1/policies/{self.policy_id}/dry-run/login",
+                    json={"did": did},
+                    headers=self.get_auth_headers()
+                )
+                if login_response.status_code != 200:
+                    return self._failed_response("switch to participant", login_response)
+                
+                response = await self.client.post(
+                    f"{self.guardian_url}/api/v1/policies/{self.policy_id}/blocks/{block_id}",
+                    json={"document": document},
+                    headers=self.get_auth_headers()
+                )
+            
+            if response.status_code != 200:
+                return self._failed_response("submit energy data", response)
             
+            logger.info(f"📊 Energy data for {len(reports)} batch(es) submitted to Guardian for DID: {did}")
+            return GuardianSubmissionResult(success=True, response_data=response.json() if response.content else {})
+            
+        except (httpx.TransportError, asyncio.TimeoutError) as e:
+            error_msg = f"Guardian unreachable: {str(e)}"
+            logger.error(error_msg)
+            return GuardianSubmissionResult(success=False, error=error_msg)
         except Exception as e:
             error_msg = f"Error submitting energy data to Guardian: {str(e)}"
             logger.error(error_msg)
+            # Unexpected (e.g. a malformed Guardian response): retried with backoff, only 4xx rejections are final
             return GuardianSubmissionResult(success=False, error=error_msg)
     
+    async def submit_energy_data(self, did: str, energy_data: Dict[str, Any], hedera_proof: str) -> GuardianSubmissionResult:
+        """Submit energy data with Hedera proof to Guardian"""
+        return await self.submit_energy_reports(did, [{
+            "batch_id": energy_data.get("batch_id"),
+            "energy_data": energy_data,
+            "hedera_proof": hedera_proof
+        }])
+    
+    def _failed_response(self, action: str, response: httpx.Response) -> GuardianSubmissionResult:
+        if response.status_code == 401:
+            # Expired token: log in again on the next attempt
+            self.access_token = None
+        error_msg = f"Failed to {action}: {response.status_code} - {response.text}"
+        logger.error(error_msg)
+        return GuardianSubmissionResult(
+            success=False, error=error_msg, retryable=is_retryable_status(response.status_code)
+        )
+    
     async def close(self):
         """Close the HTTP client"""
         await self.client.aclose()
@@ -0,0 +1,231 @@
+"""Background worker turning anchored batches into Guardian energy-data submissions
+
+``proof_store`` queues a ``pending`` row in ``guardian_submissions`` for every
+anchored batch that belongs to a participant. The worker picks up due rows,
+groups them per participant DID (one Guardian report per group) and submits
+the groups one at a time: the policy runs in dry-run mode, where Guardian
+acts as a single virtual user per policy, so a report cannot be sent while
+another participant's is in flight (``GuardianService.dry_run_user_lock``).
+Each group is claimed just before it is sent, so rows waiting their turn
+stay ``pending``. Every transition is written back:
+
+    pending -> processing -> submitted
+                          -> pending (retry after exponential backoff)
+                          -> failed  (rejected, or out of attempts)
+
+Rows are claimed with a conditional update (``pending`` -> ``processing``),
+so several workers can share the queue. Rows left in ``processing`` by a
+crashed worker are released again after ``stale_after_seconds``.
+``next_attempt_at`` and ``updated_at`` are compared and written in UTC.
+"""
+import asyncio
+import logging
+import os
+import random
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from database_models import SubmissionStatus
+from guardian_service import GuardianService
+
+logger = logging.getLogger(__name__)
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+class GuardianSubmissionWorker:
+    def __init__(
+        self,
+        client,
+        guardian: GuardianService,
+        max_batches_per_submission: int = 50,
+        max_attempts: int = 8,
+        base_delay_seconds: float = 5.0,
+        max_delay_seconds: float = 900.0,
+        poll_interval_seconds: float = 15.0,
+        stale_after_seconds: float = 600.0,
+        fetch_limit: int = 500
+    ):
+        self.client = client
+        self.guardian = guardian
+        self.max_batches_per_submission = max_batches_per_submission
+        self.max_attempts = max_attempts
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.poll_interval_seconds = poll_interval_seconds
+        self.stale_after_seconds = stale_after_seconds
+        self.fetch_limit = fetch_limit
+        self.wakeup = asyncio.Event()
+        self.in_flight = 0
+        self.counters: Counter = Counter()
+        self.last_run_at: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+
+    @classmethod
+    def from_env(cls, client, guardian: GuardianService) -> "GuardianSubmissionWorker":
+        return cls(
+            client,
+            guardian,
+            max_batches_per_submission=int(os.getenv("GUARDIAN_MAX_BATCHES_PER_SUBMISSION", "50")),
+            max_attempts=int(os.getenv("GUARDIAN_MAX_ATTEMPTS", "8")),
+            poll_interval_seconds=float(os.getenv("GUARDIAN_POLL_INTERVAL_SECONDS", "15"))
+        )
+
+    def notify(self) -> None:
+        """Wake the worker because new submissions were queued"""
+        self.wakeup.set()
+
+    def backoff_seconds(self, attempts: int) -> float:
+        """Delay before the next attempt: exponential in the attempt count, with jitter"""
+        delay = min(self.max_delay_seconds, self.base_delay_seconds * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _update(self, ids: List[str], values: Dict[str, Any], expected_status: Optional[str] = None) -> List[Dict]:
+        query = self.client.table("guardian_submissions").update({**values, "updated_at": utc_now().isoformat()})
+        query = query.in_("id", ids)
+        if expected_status is not None:
+            query = query.eq("submission_status", expected_status)
+        return query.execute().data or []
+
+    def _fetch_due(self) -> List[Dict]:
+        return (
+            self.client.table("guardian_submissions").select("*")
+            .eq("submission_status", SubmissionStatus.PENDING.value)
+            .lte("next_attempt_at", utc_now().isoformat())
+            .order("submitted_at").limit(self.fetch_limit).execute().data
+        )
+
+    def _release_stale(self) -> int:
+        cutoff = (utc_now() - timedelta(seconds=self.stale_after_seconds)).isoformat()
+        rows = (
+            self.client.table("guardian_submissions")
+            .update({"submission_status": SubmissionStatus.PENDING.value, "updated_at": utc_now().isoformat()})
+            .eq("submission_status", SubmissionStatus.PROCESSING.value)
+            .lt("updated_at", cutoff).execute().data
+        ) or []
+        return len(rows)
+
+    async def run_once(self) -> int:
+        """Submit every due pending row; return the number of rows processed"""
+        self.last_run_at = datetime.now()
+        released = await asyncio.to_thread(self._release_stale)
+        if released:
+            logger.warning(f"Released {released} stale Guardian submission(s) back to pending")
+        rows = await asyncio.to_thread(self._fetch_due)
+        if not rows:
+            return 0
+        if not await self.guardian.ensure_authenticated():
+            self.last_error = "Guardian not authenticated (check GUARDIAN_EMAIL / GUARDIAN_PASSWORD)"
+            logger.warning(self.last_error)
+            return 0
+
+        groups = defaultdict(list)
+        for row in rows:
+            groups[row["participant_did"]].append(row)
+        chunks = [
+            (did, did_rows[i:i + self.max_batches_per_submission])
+            for did, did_rows in groups.items()
+            for i in range(0, len(did_rows), self.max_batches_per_submission)
+        ]
+        processed = 0
+        for did, chunk in chunks:
+            processed += await self._submit_group(did, chunk)
+        return processed
+
+    async def _submit_group(self, did: str, rows: List[Dict]) -> int:
+        claimed = await asyncio.to_thread(
+            self._update, [row["id"] for row in rows],
+            {"submission_status": SubmissionStatus.PROCESSING.value}, SubmissionStatus.PENDING.value
+        )
+        if not claimed:
+            # Another worker got there first
+            return 0
+        claimed_ids = {row["id"] for row in claimed}
+        rows = [row for row in rows if row["id"] in claimed_ids]
+
+        self.in_flight += len(rows)
+        try:
+            result = await self.guardian.submit_energy_reports(did, [
+                {"batch_id": row["batch_id"], "energy_data": row["energy_data"], "hedera_proof": row["hedera_proof_reference"]}
+                for row in rows
+            ])
+        finally:
+            self.in_flight -= len(rows)
+
+        if result.success:
+            await asyncio.to_thread(self._update, list(claimed_ids), {
+                "submission_status": SubmissionStatus.SUBMITTED.value,
+                "guardian_response": result.response_data,
+                "submitted_at": datetime.now().isoformat(),
+                "last_error": None
+            })
+            self.counters["submitted"] += len(rows)
+            self.counters["requests_ok"] += 1
+            logger.info(f"✅ Guardian submission for {did}: {len(rows)} batch(es)")
+            return len(rows)
+
+        self.counters["requests_failed"] += 1
+        self.last_error = result.error
+        await asyncio.to_thread(self._record_failure, rows, result.error, result.retryable)
+        return len(rows)
+
+    def _record_failure(self, rows: List[Dict], error: Optional[str], retryable: bool) -> None:
+        # Rows of one group can have different attempt counts, so they are updated individually
+        for row in rows:
+            attempts = (row.get("attempts") or 0) + 1
+            if retryable and attempts < self.max_attempts:
+                next_attempt_at = utc_now() + timedelta(seconds=self.backoff_seconds(attempts))
+                self._update([row["id"]], {
+                    "submission_status": SubmissionStatus.PENDING.value,
+                    "attempts": attempts,
+                    "next_attempt_at": next_attempt_at.isoformat(),
+                    "last_error": error
+                })
+                self.counters["retried"] += 1
+            else:
+                self._update([row["id"]], {
+                    "submission_status": SubmissionStatus.FAILED.value,
+                    "attempts": attempts,
+                    "last_error": error
+                })
+                self.counters["failed"] += 1
+                logger.error(f"❌ Guardian submission for batch {row['batch_id']} failed after {attempts} attempt(s): {error}")
+
+    async def run(self) -> None:
+        """Process the queue whenever new rows are queued, or every poll interval"""
+        while True:
+            self.wakeup.clear()
+            try:
+                processed = await self.run_once()
+            except Exception as e:
+                processed = 0
+                self.last_error = str(e)
+                logger.error(f"Guardian submission worker error: {e}")
+            if processed:
+                # More rows may be due already; loop without waiting
+                continue
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.poll_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    def status_counts(self) -> Dict[str, int]:
+        counts = {}
+        for status in SubmissionStatus:
+            result = (
+                self.client.table("guardian_submissions").select("id", count="exact")
+                .eq("submission_status", status.value).limit(1).execute()
+            )
+            counts[status.value] = result.count or 0
+        return counts
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight_batches": self.in_flight,
+            "max_batches_per_submission": self.max_batches_per_submission,
+            "max_attempts": self.max_attempts,
+            "counters": dict(self.counters),
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+            "last_error": self.last_error
+        }
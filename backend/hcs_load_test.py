@@ -0,0 +1,186 @@
+"""Throughput and recovery of HederaService and BatchProcessor under HCS faults
+
+Usage::
+
+    python hcs_load_test.py --phases fast:20,outage:10,fast:20 --rate 500 --batch-size 200
+    python hcs_load_test.py --url http://localhost:3001 --phases testnet:60   # running stand-in
+
+Readings are fed into a ``BatchProcessor`` at ``--rate`` readings/s and due
+batches are submitted through a real ``HederaService`` while the Hedera
+stand-in (hedera_standin.py) applies one fault profile per phase. Without
+``--url`` the stand-in runs in-process behind an ASGI transport. Per phase
+the report gives submissions, failures, submit latency, anchored
+readings/s and how long after the phase started the first batch was
+anchored again, which is the recovery time after an outage phase. Readings
+of failed batches are not retried by the batcher: they are reported as
+unanchored (backfill.py anchors them from the database).
+"""
+import argparse
+import asyncio
+import json
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Awaitable, Dict, List, Optional, Tuple
+
+import httpx
+
+import hedera_standin
+from energy_reading import EnergyReading
+from hedera_service import BatchProcessor, HederaService
+
+@dataclass
+class PhaseReport:
+    profile: str
+    duration_seconds: float
+    readings_fed: int = 0
+    submissions: int = 0
+    failed_submissions: int = 0
+    anchored_readings: int = 0
+    unanchored_readings: int = 0
+    p50_submit_ms: Optional[float] = None
+    p95_submit_ms: Optional[float] = None
+    anchored_readings_per_second: float = 0.0
+    # Seconds from the phase start to its first anchored batch
+    first_anchor_after_seconds: Optional[float] = None
+    errors: Dict[str, int] = field(default_factory=dict)
+
+def parse_phases(value: str) -> List[Tuple[str, float]]:
+    """"fast:20,outage:10" -> [("fast", 20.0), ("outage", 10.0)]"""
+    phases = []
+    for entry in filter(None, (part.strip() for part in value.split(","))):
+        name, _, seconds = entry.partition(":")
+        if name not in hedera_standin.PROFILES:
+            raise ValueError(f"Unknown profile {name!r} (choose from {', '.join(hedera_standin.PROFILES)})")
+        phases.append((name, float(seconds or 10)))
+    return phases
+
+def _error_kind(error: str) -> str:
+    # "HCS submission failed: 429 - ..." -> "429"; transport errors by exception text
+    if "submission failed:" in error:
+        return error.split("submission failed:")[1].split("-")[0].strip()
+    return "transport"
+
+def _percentile_ms(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000, 1)
+
+async def run_load(service: HederaService, set_profile: Callable[[str], Awaitable[None]],
+                   phases: List[Tuple[str, float]], rate: float, batch_size: int, devices: int,
+                   concurrency: int, tick_seconds: float = 0.05) -> List[PhaseReport]:
+    processor = BatchProcessor(service, max_batch_size=batch_size, max_batch_age_minutes=60,
+                               max_concurrent_submissions=concurrency)
+    reports = []
+    current: Dict[str, Any] = {}
+    pending_tasks = set()
+
+    async def submit_due() -> None:
+        for result in await processor.process_due_batches():
+            record(result)
+
+    def record(result) -> None:
+        # Results are credited to the phase that is running when they complete
+        report, phase_started = current["report"], current["started"]
+        report.submissions += 1
+        if result.success:
+            report.anchored_readings += len(result.batch.readings)
+            if report.first_anchor_after_seconds is None:
+                report.first_anchor_after_seconds = round(time.monotonic() - phase_started, 3)
+        else:
+            report.failed_submissions += 1
+            kind = _error_kind(result.error or "")
+            report.errors[kind] = report.errors.get(kind, 0) + 1
+            report.unanchored_readings += len(result.batch.readings) if result.batch else 0
+
+    fed = 0.0
+    sequence = 0
+    for name, duration in phases:
+        await set_profile(name)
+        report = PhaseReport(profile=name, duration_seconds=duration)
+        started = time.monotonic()
+        current.update(report=report, started=started)
+        samples_before = len(processor.submission_samples)
+        while (now := time.monotonic()) - started < duration:
+            fed += rate * tick_seconds
+            while fed >= 1:
+                fed -= 1
+                sequence += 1
+                processor.add_reading(EnergyReading(
+                    device_id=f"LOAD_{sequence % devices:04d}", current=1.0, voltage=230.0, power=230.0,
+                    received_at=datetime.now(), total_energy_kwh=sequence / 1000
+                ))
+                report.readings_fed += 1
+            if processor.should_process_batch():
+                task = asyncio.create_task(submit_due())
+                pending_tasks.add(task)
+                task.add_done_callback(pending_tasks.discard)
+            await asyncio.sleep(max(0.0, tick_seconds - (time.monotonic() - now)))
+        latencies = [latency for _, latency, ok in list(processor.submission_samples)[samples_before:] if ok]
+        report.p50_submit_ms = _percentile_ms(latencies, 0.5)
+        report.p95_submit_ms = _percentile_ms(latencies, 0.95)
+        reports.append(report)
+
+    # Submissions still running and the last partial batch count towards the final phase
+    if pending_tasks:
+        await asyncio.gather(*pending_tasks)
+    for result in await processor.process_all_batches():
+        record(result)
+    for report in reports:
+        report.anchored_readings_per_second = round(report.anchored_readings / report.duration_seconds, 1)
+    return reports
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Load and chaos test HCS anchoring against the Hedera stand-in")
+    parser.add_argument("--phases", default="fast:20,outage:10,fast:20", help="profile:seconds,... (see hedera_standin.PROFILES)")
+    parser.add_argument("--rate", type=float, default=500, help="Readings per second")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent HCS submissions")
+    parser.add_argument("--url", help="Running stand-in to target (default: in-process)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--report", help="Write the JSON report here")
+    return parser.parse_args(argv)
+
+async def run(args: argparse.Namespace) -> List[PhaseReport]:
+    phases = parse_phases(args.phases)
+    if args.url:
+        service = HederaService(args.url.rstrip("/"))
+
+        async def set_profile(name: str) -> None:
+            response = await service.client.put(f"{service.hedera_service_url}/standin/profile", json={"profile": name})
+            response.raise_for_status()
+    else:
+        hedera_standin.standin = hedera_standin.HederaStandIn(hedera_standin.PROFILES["ideal"], seed=args.seed)
+        service = HederaService("http://standin")
+        service.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=hedera_standin.app), timeout=30.0)
+
+        async def set_profile(name: str) -> None:
+            hedera_standin.standin.set_profile(hedera_standin.PROFILES[name])
+    try:
+        return await run_load(service, set_profile, phases, args.rate, args.batch_size, args.devices, args.concurrency)
+    finally:
+        await service.close()
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    reports = asyncio.run(run(args))
+    print(f"{'phase':<12}{'fed':>8}{'anchored':>10}{'rdg/s':>9}{'subs':>7}{'failed':>8}{'p50 ms':>9}{'p95 ms':>9}{'1st anchor s':>14}")
+    for r in reports:
+        print(
+            f"{r.profile:<12}{r.readings_fed:>8}{r.anchored_readings:>10}{r.anchored_readings_per_second:>9.1f}"
+            f"{r.submissions:>7}{r.failed_submissions:>8}{str(r.p50_submit_ms):>9}{str(r.p95_submit_ms):>9}"
+            f"{str(r.first_anchor_after_seconds):>14}"
+        )
+    unanchored = sum(r.unanchored_readings for r in reports)
+    if unanchored:
+        print(f"{unanchored} readings in failed batches were not anchored (backfill.py recovers them)")
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"generated_at": datetime.now().isoformat(), "args": vars(args),
+                       "phases": [asdict(r) for r in reports]}, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
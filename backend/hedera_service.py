@@ -2,14 +2,32 @@ import httpx
 import asyncio
 import json
 import hashlib
-import gzip
+import time
+from collections import deque
 from datetime import datetime
-from typing import Dict, Any, Optional, List
-from dataclasses import dataclass
+from typing import Dict, Any, Optional, List, Tuple
+from dataclasses import dataclass, field
 import logging
+from energy_reading import EnergyReading
+from batch_codecs import get_codec
+from batch_encoding import encode_readings
+from profiling import profiler
 
 logger = logging.getLogger(__name__)
 
+# Batches anchored before hash schemes were recorded used gzip.compress() with the
+# wall-clock time in the gzip header, so their hash depends on when they were sealed
+HASH_SCHEME_LEGACY = "json-gzip"
+# Same JSON and deflate stream with a fixed gzip header (mtime 0): reproducible
+HASH_SCHEME_JSON_GZIP = "json-gzip-v2"
+# SHA-256 of the canonical JSON itself; the compression codec does not affect the hash
+HASH_SCHEME_JSON_SHA256 = "json-sha256"
+# SHA-256 of the canonical columnar encoding (see batch_encoding)
+HASH_SCHEME_COLUMNAR = "columnar-v1"
+
+# "type" of the HCS messages carrying batch proofs (see topic_index)
+MESSAGE_TYPE_BATCH_PROOF = "energy_batch_proof"
+
 @dataclass
 class HederaSubmissionResult:
     success: bool
@@ -21,10 +39,47 @@ class HederaSubmissionResult:
 @dataclass
 class EnergyBatch:
     batch_id: str
-    readings: List[Dict[str, Any]]
+    readings: List[EnergyReading]
     created_at: datetime
     compressed_data: bytes
     data_hash: str
+    partition_key: Optional[str] = None
+    participant_did: Optional[str] = None
+    hash_scheme: str = HASH_SCHEME_COLUMNAR
+    codec_id: Optional[str] = None
+
+def serialize_batch_records(records: List[Dict[str, Any]]) -> bytes:
+    """Canonical JSON bytes of a batch of reading dicts"""
+    return json.dumps(records, sort_keys=True).encode('utf-8')
+
+def compute_batch_hash(readings: List[EnergyReading], codec_id: Optional[str] = None) -> tuple[bytes, str]:
+    """Compressed canonical encoding and SHA-256 hash (HASH_SCHEME_COLUMNAR) of a batch
+
+    Module-level so it can run in a process pool (backfill).
+    """
+    encoded = encode_readings(readings)
+    compressed_data = get_codec(codec_id).compress(encoded)
+    
+    # Hash the uncompressed canonical bytes so the codec does not affect it
+    data_hash = hashlib.sha256(encoded).hexdigest()
+    
+    return compressed_data, data_hash
+
+def build_proof_message(batch: EnergyBatch) -> Dict[str, Any]:
+    """Message published to the HCS topic for a sealed batch"""
+    return {
+        "type": MESSAGE_TYPE_BATCH_PROOF,
+        "batch_id": batch.batch_id,
+        "data_hash": batch.data_hash,
+        "hash_scheme": batch.hash_scheme,
+        "device_count": len(set(r.device_id for r in batch.readings)),
+        "reading_count": len(batch.readings),
+        "timestamp_range": {
+            "start": min(r.received_at for r in batch.readings).isoformat(),
+            "end": max(r.received_at for r in batch.readings).isoformat()
+        },
+        "created_at": batch.created_at.isoformat()
+    }
 
 class HederaService:
     def __init__(self, hedera_service_url: str = "http://localhost:3001"):
@@ -40,32 +95,15 @@ class HederaService:
             logger.error(f"Hedera service health check failed: {e}")
             return False
     
-    def create_batch_hash(self, readings: List[Dict[str, Any]]) -> tuple[bytes, str]:
+    def create_batch_hash(self, readings: List[EnergyReading], codec_id: Optional[str] = None) -> tuple[bytes, str]:
         """Create compressed data and hash for a batch of readings"""
-        # Convert readings to JSON and compress
-        json_data = json.dumps(readings, sort_keys=True).encode('utf-8')
-        compressed_data = gzip.compress(json_data)
-        
-        # Create SHA-256 hash
-        data_hash = hashlib.sha256(compressed_data).hexdigest()
-        
-        return compressed_data, data_hash
+        return compute_batch_hash(readings, codec_id)
     
     async def submit_proof_to_hedera(self, batch: EnergyBatch) -> HederaSubmissionResult:
         """Submit a batch proof to Hedera Consensus Service"""
         try:
             # Prepare message for HCS
-            message_data = {
-                "batch_id": batch.batch_id,
-                "data_hash": batch.data_hash,
-                "device_count": len(set(r.get("device_id") for r in batch.readings)),
-                "reading_count": len(batch.readings),
-                "timestamp_range": {
-                    "start": min(r.get("timestamp", "") for r in batch.readings),
-                    "end": max(r.get("timestamp", "") for r in batch.readings)
-                },
-                "created_at": batch.created_at.isoformat()
-            }
+            message_data = build_proof_message(batch)
             
             # Submit to HCS via Node.js service
             response = await self.client.post(
@@ -74,7 +112,7 @@ class HederaService:
                     "message": json.dumps(message_data),
                     "metadata": {
                         "batch_id": batch.batch_id,
-                        "type": "energy_batch_proof"
+                        "type": MESSAGE_TYPE_BATCH_PROOF
                     }
                 }
             )
@@ -112,63 +150,215 @@ class HederaService:
         """Close the HTTP client"""
         await self.client.aclose()
 
+DEFAULT_PARTITION = "unassigned"
+
+@dataclass
+class BatchPartition:
+    """Open batch for one participant or device group"""
+    key: str
+    max_batch_size: int
+    max_batch_age_minutes: float
+    participant_did: Optional[str] = None
+    readings: List[EnergyReading] = field(default_factory=list)
+    started_at: datetime = field(default_factory=datetime.now)
+    # Readings ever added; the adaptive controller derives the ingest rate from it
+    received: int = 0
+
+    def is_due(self, now: datetime) -> bool:
+        """Check if the partition should be sealed based on size or age"""
+        if not self.readings:
+            return False
+        if len(self.readings) >= self.max_batch_size:
+            return True
+        return (now - self.started_at).total_seconds() / 60 >= self.max_batch_age_minutes
+
+    def seal(self) -> List[EnergyReading]:
+        """Detach the pending readings and start a new batch window"""
+        readings = self.readings
+        self.readings = []
+        self.started_at = datetime.now()
+        return readings
+
 class BatchProcessor:
-    def __init__(self, hedera_service: HederaService, max_batch_size: int = 1000, max_batch_age_minutes: int = 60):
+    """Batches readings per partition (participant or device group) for HCS anchoring
+
+    Devices are mapped to a partition with ``assign_device``; unassigned devices
+    share the DEFAULT_PARTITION. Each partition has its own size and age limits
+    and is sealed independently, and sealed batches from all partitions are
+    submitted concurrently through a shared, bounded submission pool.
+    """
+
+    def __init__(
+        self,
+        hedera_service: HederaService,
+        max_batch_size: int = 1000,
+        max_batch_age_minutes: int = 60,
+        max_concurrent_submissions: int = 4
+    ):
         self.hedera_service = hedera_service
         self.max_batch_size = max_batch_size
         self.max_batch_age_minutes = max_batch_age_minutes
-        self.current_batch: List[Dict[str, Any]] = []
-        self.batch_start_time = datetime.now()
-        
-    def add_reading(self, reading: Dict[str, Any]) -> None:
-        """Add a reading to the current batch"""
-        self.current_batch.append(reading)
-        
+        self.partitions: Dict[str, BatchPartition] = {}
+        # device_id -> (partition key, participant DID)
+        self.device_partitions: Dict[str, Tuple[str, Optional[str]]] = {}
+        # partition key -> (max_batch_size, max_batch_age_minutes)
+        self.partition_limits: Dict[str, Tuple[int, float]] = {}
+        self.submission_pool = asyncio.Semaphore(max_concurrent_submissions)
+        self.in_flight_submissions = 0
+        # (monotonic finish time, latency seconds, success) of recent HCS submissions
+        self.submission_samples: deque = deque(maxlen=1024)
+        # Cluster node sealing the batches (see cluster.py); keeps batch IDs unique across nodes
+        self.node_id: Optional[str] = None
+
+    def assign_device(self, device_id: str, partition_key: str, participant_did: Optional[str] = None) -> None:
+        """Route a device's future readings to the given partition"""
+        self.device_partitions[device_id] = (partition_key, participant_did)
+        partition = self.partitions.get(partition_key)
+        if partition is not None and participant_did:
+            partition.participant_did = participant_did
+
+    def unassign_device(self, device_id: str) -> None:
+        """Send a device's future readings back to the default partition"""
+        self.device_partitions.pop(device_id, None)
+
+    def configure_partition(self, partition_key: str, max_batch_size: Optional[int] = None,
+                            max_batch_age_minutes: Optional[float] = None) -> None:
+        """Override size and age limits for one partition (pins it against adaptive tuning)"""
+        if max_batch_size is None and max_batch_age_minutes is None:
+            return
+        limits = (
+            max_batch_size or self.max_batch_size,
+            max_batch_age_minutes or self.max_batch_age_minutes
+        )
+        self.partition_limits[partition_key] = limits
+        partition = self.partitions.get(partition_key)
+        if partition is not None:
+            partition.max_batch_size, partition.max_batch_age_minutes = limits
+
+    def _partition(self, partition_key: str, participant_did: Optional[str]) -> BatchPartition:
+        partition = self.partitions.get(partition_key)
+        if partition is None:
+            max_size, max_age = self.partition_limits.get(
+                partition_key, (self.max_batch_size, self.max_batch_age_minutes)
+            )
+            partition = BatchPartition(
+                key=partition_key,
+                max_batch_size=max_size,
+                max_batch_age_minutes=max_age,
+                participant_did=participant_did
+            )
+            self.partitions[partition_key] = partition
+        elif participant_did and partition.participant_did != participant_did:
+            # DID issued after the partition was opened
+            partition.participant_did = participant_did
+        return partition
+
+    def add_reading(self, reading: EnergyReading) -> str:
+        """Add a reading to its partition's open batch and return the partition key"""
+        partition_key, participant_did = self.device_partitions.get(reading.device_id, (DEFAULT_PARTITION, None))
+        partition = self._partition(partition_key, participant_did)
+        partition.readings.append(reading)
+        partition.received += 1
+        return partition_key
+
+    @property
+    def pending_count(self) -> int:
+        """Readings waiting in open batches across all partitions"""
+        return sum(len(p.readings) for p in self.partitions.values())
+
+    def due_partitions(self) -> List[str]:
+        """Keys of partitions whose batch has reached its size or age limit"""
+        now = datetime.now()
+        return [key for key, partition in self.partitions.items() if partition.is_due(now)]
+
     def should_process_batch(self) -> bool:
-        """Check if batch should be processed based on size or age"""
-        if len(self.current_batch) >= self.max_batch_size:
-            return True
-            
-        age_minutes = (datetime.now() - self.batch_start_time).total_seconds() / 60
-        if age_minutes >= self.max_batch_age_minutes and len(self.current_batch) > 0:
-            return True
-            
-        return False
-    
-    async def process_current_batch(self) -> Optional[HederaSubmissionResult]:
-        """Process the current batch and submit to Hedera"""
-        if not self.current_batch:
+        """Check if any partition should be processed based on size or age"""
+        now = datetime.now()
+        return any(partition.is_due(now) for partition in self.partitions.values())
+
+    def _build_batch(self, partition: BatchPartition, readings: List[EnergyReading]) -> EnergyBatch:
+        created_at = datetime.now()
+        partition_scope = f"{self.node_id}/{partition.key}" if self.node_id else partition.key
+        partition_tag = hashlib.sha256(partition_scope.encode("utf-8")).hexdigest()[:8]
+        batch_id = f"batch_{created_at.strftime('%Y%m%d_%H%M%S_%f')}_{partition_tag}_{len(readings)}"
+        codec_id = get_codec().codec_id
+        with profiler.span("batch_seal"):
+            compressed_data, data_hash = self.hedera_service.create_batch_hash(readings, codec_id)
+        return EnergyBatch(
+            batch_id=batch_id,
+            readings=readings,
+            created_at=created_at,
+            compressed_data=compressed_data,
+            data_hash=data_hash,
+            partition_key=partition.key,
+            participant_did=partition.participant_did,
+            codec_id=codec_id
+        )
+
+    async def _submit(self, batch: EnergyBatch) -> HederaSubmissionResult:
+        async with self.submission_pool:
+            self.in_flight_submissions += 1
+            started = time.monotonic()
+            result = None
+            try:
+                with profiler.span("hcs_submit"):
+                    result = await self.hedera_service.submit_proof_to_hedera(batch)
+            finally:
+                self.in_flight_submissions -= 1
+                finished = time.monotonic()
+                self.submission_samples.append((finished, finished - started, result is not None and result.success))
+        # Add batch to result for database storage (and so failures can report what was lost)
+        result.batch = batch
+        return result
+
+    async def process_partition(self, partition_key: str) -> Optional[HederaSubmissionResult]:
+        """Seal one partition's batch and submit it to Hedera"""
+        partition = self.partitions.get(partition_key)
+        if partition is None or not partition.readings:
             return None
-            
+
+        # Seal before awaiting so readings arriving during submission start the next batch
+        readings = partition.seal()
         try:
-            # Create batch
-            batch_id = f"batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{len(self.current_batch)}"
-            compressed_data, data_hash = self.hedera_service.create_batch_hash(self.current_batch)
-            
-            batch = EnergyBatch(
-                batch_id=batch_id,
-                readings=self.current_batch.copy(),
-                created_at=datetime.now(),
-                compressed_data=compressed_data,
-                data_hash=data_hash
-            )
-            
-            # Submit to Hedera
-            result = await self.hedera_service.submit_proof_to_hedera(batch)
-            
-            # Add batch to result for database storage
-            if result.success:
-                result.batch = batch
-            
-            # Clear current batch
-            self.current_batch.clear()
-            self.batch_start_time = datetime.now()
-            
-            return result
-            
+            batch = self._build_batch(partition, readings)
         except Exception as e:
-            logger.error(f"Error processing batch: {e}")
+            logger.error(f"Error processing batch for partition {partition_key}: {e}")
             return HederaSubmissionResult(success=False, error=str(e))
+        return await self._submit(batch)
+
+    async def process_partitions(self, partition_keys: List[str]) -> List[HederaSubmissionResult]:
+        """Seal and submit several partitions in parallel through the submission pool"""
+        results = await asyncio.gather(*(self.process_partition(key) for key in partition_keys))
+        return [result for result in results if result is not None]
+
+    async def process_due_batches(self) -> List[HederaSubmissionResult]:
+        """Process every partition that has reached its size or age limit"""
+        return await self.process_partitions(self.due_partitions())
+
+    async def process_all_batches(self) -> List[HederaSubmissionResult]:
+        """Seal and submit every non-empty partition regardless of limits"""
+        return await self.process_partitions([key for key, p in self.partitions.items() if p.readings])
+
+    def stats(self) -> Dict[str, Any]:
+        now = datetime.now()
+        return {
+            "pending_readings": self.pending_count,
+            "in_flight_submissions": self.in_flight_submissions,
+            "partitions": {
+                key: {
+                    "participant_did": p.participant_did,
+                    "pending_readings": len(p.readings),
+                    "age_minutes": round((now - p.started_at).total_seconds() / 60, 2),
+                    "max_batch_size": p.max_batch_size,
+                    "max_batch_age_minutes": p.max_batch_age_minutes
+                }
+                for key, p in self.partitions.items()
+            },
+            "device_assignments": {
+                device_id: {"partition_key": key, "participant_did": did}
+                for device_id, (key, did) in self.device_partitions.items()
+            }
+        }
 
 # Global instances
 hedera_service = HederaService()
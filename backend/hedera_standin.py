@@ -0,0 +1,268 @@
+"""Local stand-in for hedera-service/server.js with latency and fault injection
+
+Implements the endpoints the backend uses (``/health``,
+``/api/hcs/submit-message``, ``/api/hcs/transaction/{id}`` and
+``/api/hcs/topic/{topic_id}/messages``) plus the Mirror Node topic message
+listing (``/api/v1/topics/{topic_id}/messages``), so the whole anchoring
+pipeline, topic sync included, runs without a testnet account::
+
+    python hedera_standin.py --profile testnet --port 3001
+    # backend: HEDERA_TOPIC_ID=0.0.1001 HEDERA_MIRROR_NODE_URL=http://localhost:3001
+
+Submitted messages are recorded in memory and given consensus timestamps
+and sequence numbers. Before answering, every submission goes through the
+active fault profile: a throttle (429 with Retry-After, like a BUSY
+network), a random error rate (500, like a failed receipt) and a
+log-normal latency. Profiles can be switched while running, e.g. to
+simulate an outage and measure recovery::
+
+    curl -X PUT localhost:3001/standin/profile -d '{"profile": "outage"}' -H 'Content-Type: application/json'
+
+``GET /standin/stats`` reports what was injected. See hcs_load_test.py for
+throughput and recovery measurements of HederaService and BatchProcessor.
+"""
+import argparse
+import asyncio
+import base64
+import math
+import random
+import time
+from collections import Counter, deque
+from dataclasses import asdict, dataclass, replace
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse
+
+from admission import TokenBucket
+from topic_index import LocalTopicSource, TopicMessage
+
+DEFAULT_TOPIC_ID = "0.0.1001"
+OPERATOR_ACCOUNT_ID = "0.0.1002"
+
+@dataclass
+class FaultProfile:
+    name: str
+    # Log-normal submission latency; p99 <= median means a fixed latency
+    latency_median_ms: float = 0.0
+    latency_p99_ms: float = 0.0
+    # Share of submissions answered with 500 after the latency
+    error_rate: float = 0.0
+    # Accepted submissions per second (token bucket); None disables throttling
+    throttle_per_second: Optional[float] = None
+    throttle_burst: int = 10
+
+    def sample_latency(self, rng: random.Random) -> float:
+        """Seconds to wait before answering"""
+        if self.latency_median_ms <= 0:
+            return 0.0
+        if self.latency_p99_ms <= self.latency_median_ms:
+            return self.latency_median_ms / 1000
+        # z(0.99) = 2.326: sigma puts the 99th percentile at latency_p99_ms
+        sigma = math.log(self.latency_p99_ms / self.latency_median_ms) / 2.326
+        return rng.lognormvariate(math.log(self.latency_median_ms), sigma) / 1000
+
+PROFILES: Dict[str, FaultProfile] = {
+    "ideal": FaultProfile("ideal"),
+    # Submit plus receipt on testnet typically takes a few seconds
+    "testnet": FaultProfile("testnet", latency_median_ms=2500, latency_p99_ms=8000),
+    "fast": FaultProfile("fast", latency_median_ms=50, latency_p99_ms=250),
+    "flaky": FaultProfile("flaky", latency_median_ms=2500, latency_p99_ms=12000, error_rate=0.1),
+    "throttled": FaultProfile("throttled", latency_median_ms=200, latency_p99_ms=1000,
+                              throttle_per_second=2.0, throttle_burst=5),
+    "outage": FaultProfile("outage", latency_median_ms=100, error_rate=1.0)
+}
+
+@dataclass
+class RecordedTransaction:
+    transaction_id: str
+    topic_id: str
+    message: TopicMessage
+    metadata: Dict[str, Any]
+    submitted_at: str
+
+def _percentiles(values) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    ordered = sorted(values)
+    pick = lambda fraction: round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000, 1)
+    return {"p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99)}
+
+class HederaStandIn:
+    """Recorded topic messages plus the active fault profile"""
+
+    def __init__(self, profile: FaultProfile, topic_id: str = DEFAULT_TOPIC_ID, seed: Optional[int] = None):
+        self.topic_id = topic_id
+        self.topics = LocalTopicSource()
+        self.transactions: Dict[str, RecordedTransaction] = {}
+        self.rng = random.Random(seed)
+        self.counters: Counter = Counter()
+        self.latencies: deque = deque(maxlen=10_000)
+        self._last_valid_start = 0
+        self.set_profile(profile)
+
+    def set_profile(self, profile: FaultProfile) -> None:
+        self.profile = profile
+        self.bucket = None
+        if profile.throttle_per_second:
+            self.bucket = TokenBucket(profile.throttle_per_second, profile.throttle_burst,
+                                      profile.throttle_burst, time.monotonic())
+        self.counters[f"profile_{profile.name}"] += 1
+
+    def _transaction_id(self) -> str:
+        # Valid-start timestamps are unique per operator account
+        self._last_valid_start = max(time.time_ns(), self._last_valid_start + 1)
+        seconds, nanos = divmod(self._last_valid_start, 10**9)
+        return f"{OPERATOR_ACCOUNT_ID}@{seconds}.{nanos:09d}"
+
+    async def submit(self, message: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
+        """Apply the fault profile, then record the message like a successful HCS submit"""
+        self.counters["submissions"] += 1
+        profile = self.profile
+        if self.bucket is not None:
+            wait = self.bucket.try_acquire(time.monotonic())
+            if wait:
+                self.counters["throttled"] += 1
+                raise HTTPException(status_code=429, detail="BUSY: throttled by stand-in",
+                                    headers={"Retry-After": str(max(1, math.ceil(wait)))})
+        latency = profile.sample_latency(self.rng)
+        if latency:
+            await asyncio.sleep(latency)
+        self.latencies.append(latency)
+        if profile.error_rate and self.rng.random() < profile.error_rate:
+            self.counters["errors_injected"] += 1
+            raise HTTPException(status_code=500, detail="Failed to submit message to HCS (injected)")
+
+        transaction_id = self._transaction_id()
+        entry = self.topics.publish(self.topic_id, message)
+        submitted_at = datetime.now().isoformat()
+        self.transactions[transaction_id] = RecordedTransaction(transaction_id, self.topic_id, entry, metadata, submitted_at)
+        self.counters["accepted"] += 1
+        return {
+            "status": "success",
+            "transactionId": transaction_id,
+            "consensusTimestamp": entry.consensus_timestamp,
+            "topicId": self.topic_id,
+            "message": message,
+            "metadata": metadata,
+            "submittedAt": submitted_at
+        }
+
+    async def page(self, topic_id: str, after: Optional[str], limit: int) -> List[TopicMessage]:
+        return await self.topics.fetch_page(topic_id, after, limit)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "profile": asdict(self.profile),
+            "topic_id": self.topic_id,
+            "messages": len(self.transactions),
+            "counters": dict(self.counters),
+            "injected_latency_ms": _percentiles(self.latencies)
+        }
+
+standin = HederaStandIn(PROFILES["ideal"])
+app = FastAPI(title="Hedera service stand-in")
+
+@app.get("/health")
+async def health():
+    return {
+        "status": "healthy",
+        "network": "local-standin",
+        "profile": standin.profile.name,
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.post("/api/hcs/submit-message")
+async def submit_message(body: Dict[str, Any]):
+    if not body.get("message"):
+        return JSONResponse(status_code=400, content={"error": "Message is required"})
+    try:
+        return await standin.submit(body["message"], body.get("metadata") or {})
+    except HTTPException as e:
+        # Same body shape as server.js errors
+        return JSONResponse(status_code=e.status_code, content={"error": e.detail}, headers=e.headers)
+
+@app.get("/api/hcs/transaction/{transaction_id}")
+async def get_transaction(transaction_id: str):
+    recorded = standin.transactions.get(transaction_id)
+    if recorded is None:
+        return JSONResponse(status_code=404, content={"error": "Transaction not found"})
+    return {
+        "transactionId": transaction_id,
+        "status": "success",
+        "topicId": recorded.topic_id,
+        "consensusTimestamp": recorded.message.consensus_timestamp,
+        "sequenceNumber": recorded.message.sequence_number,
+        "metadata": recorded.metadata
+    }
+
+@app.get("/api/hcs/topic/{topic_id}/messages")
+async def list_topic_messages(topic_id: str, limit: int = 10, after: Optional[str] = None):
+    messages = await standin.page(topic_id, after, min(max(limit, 1), 100))
+    return {
+        "topicId": topic_id,
+        "messages": [
+            {
+                "consensusTimestamp": m.consensus_timestamp,
+                "sequenceNumber": m.sequence_number,
+                "message": m.contents.decode("utf-8")
+            }
+            for m in messages
+        ]
+    }
+
+@app.get("/api/v1/topics/{topic_id}/messages")
+async def mirror_topic_messages(topic_id: str, limit: int = 25, timestamp: Optional[str] = None):
+    """Mirror Node REST listing (ascending), for TopicSync / MirrorNodeSource"""
+    after = timestamp[3:] if timestamp and timestamp.startswith("gt:") else None
+    messages = await standin.page(topic_id, after, min(max(limit, 1), 100))
+    return {
+        "messages": [
+            {
+                "consensus_timestamp": m.consensus_timestamp,
+                "sequence_number": m.sequence_number,
+                "topic_id": topic_id,
+                "message": base64.b64encode(m.contents).decode("ascii")
+            }
+            for m in messages
+        ],
+        "links": {"next": None}
+    }
+
+@app.get("/standin/stats")
+async def get_stats():
+    return standin.stats()
+
+@app.put("/standin/profile")
+async def set_profile(body: Dict[str, Any]):
+    """Switch to a named profile and/or override its fields, e.g. {"profile": "flaky", "error_rate": 0.3}"""
+    base = PROFILES.get(body.get("profile", standin.profile.name))
+    if base is None:
+        raise HTTPException(status_code=400, detail=f"Unknown profile (choose from {', '.join(PROFILES)})")
+    overrides = {k: v for k, v in body.items() if k != "profile"}
+    try:
+        standin.set_profile(replace(base, **overrides))
+    except TypeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return standin.stats()
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run a local Hedera service stand-in")
+    parser.add_argument("--port", type=int, default=3001)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="ideal")
+    parser.add_argument("--topic-id", default=DEFAULT_TOPIC_ID)
+    parser.add_argument("--seed", type=int, default=None, help="Seed for reproducible latency and error draws")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> None:
+    global standin
+    args = parse_args(argv)
+    standin = HederaStandIn(PROFILES[args.profile], args.topic_id, args.seed)
+    print(f"🧪 Hedera stand-in on http://{args.host}:{args.port} (profile {args.profile}, topic {args.topic_id})")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Conditional HTTP caching for polled snapshots and immutable proofs
+
+Dashboards poll ``/api/latest-readings`` and ``/api/readings-history``;
+both views only change when a reading is remembered, so they are
+version-stamped: ``VersionedSnapshot`` serializes a view once per version
+and its ETag is the version, so a poll that sends ``If-None-Match`` with
+the current ETag gets a bodiless 304 without any serialization.
+
+Anchored proofs never change, so proof responses are served from an
+in-process ``LRUCache`` keyed by ``batch_id`` with
+``Cache-Control: immutable`` and an ETag derived from the batch's
+``data_hash``.
+"""
+import hashlib
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response
+
+# Snapshots must be revalidated on every poll; proofs can be kept forever
+SNAPSHOT_CACHE_CONTROL = "no-cache"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Versions restart at 0 with the process, so ETags also carry a boot ID
+BOOT_ID = uuid.uuid4().hex[:8]
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether the request's If-None-Match names ``etag`` (weak comparison)"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(candidate.strip().removeprefix("W/") == etag for candidate in header.split(","))
+
+def cached_response(request: Request, etag: str, body: Callable[[], bytes], cache_control: str,
+                    headers: Optional[Dict[str, str]] = None) -> Response:
+    """304 when the client already has ``etag``; otherwise the body with ETag and Cache-Control"""
+    headers = {"ETag": etag, "Cache-Control": cache_control, **(headers or {})}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body(), media_type="application/json", headers=headers)
+
+def content_etag(body: bytes) -> str:
+    """ETag for views without a version (e.g. merged from other cluster nodes)"""
+    return f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+
+class VersionedSnapshot:
+    """JSON views of in-memory state, serialized at most once per version"""
+
+    def __init__(self, name: str, max_variants: int = 16):
+        self.name = name
+        self.version = 0
+        self.max_variants = max_variants
+        self._bodies: "OrderedDict[Hashable, Tuple[int, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def bump(self) -> None:
+        """Mark the underlying state as changed"""
+        self.version += 1
+
+    def etag(self, variant: Hashable = None) -> str:
+        suffix = f"-{variant}" if variant is not None else ""
+        return f'"{self.name}-{BOOT_ID}-{self.version}{suffix}"'
+
+    def body(self, build: Callable[[], Any], variant: Hashable = None) -> bytes:
+        """Serialized view for the current version (``variant`` tells query variants apart)"""
+        version = self.version
+        with self._lock:
+            cached = self._bodies.get(variant)
+            if cached is not None and cached[0] == version:
+                self._bodies.move_to_end(variant)
+                return cached[1]
+        body = json.dumps(build()).encode("utf-8")
+        with self._lock:
+            self._bodies[variant] = (version, body)
+            self._bodies.move_to_end(variant)
+            while len(self._bodies) > self.max_variants:
+                self._bodies.popitem(last=False)
+        return body
+
+    def response(self, request: Request, build: Callable[[], Any], variant: Hashable = None) -> Response:
+        # Take the ETag first: a bump while building only makes the next poll refetch
+        etag = self.etag(variant)
+        return cached_response(request, etag, lambda: self.body(build, variant), SNAPSHOT_CACHE_CONTROL)
+
+class LRUCache:
+    """Bounded in-process cache with hit/miss counters"""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls, name: str, default: int) -> "LRUCache":
+        return cls(max_entries=int(os.getenv(name, str(default))))
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None
+        }
@@ -0,0 +1,175 @@
+"""Event-driven device online/offline tracking
+
+Each online device has exactly one entry in a deadline heap. A reading only
+moves the device's deadline forward in its state (O(1)); when the heap entry
+comes due and the device has been seen since, the entry is pushed again at
+the new deadline (O(log n)), otherwise the device goes offline. Online and
+offline counts and ID sets are maintained on every transition, so health
+checks never scan the devices.
+"""
+import asyncio
+import heapq
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+DEVICE_ONLINE = "device_online"
+DEVICE_OFFLINE = "device_offline"
+
+@dataclass
+class DeviceLiveness:
+    device_id: str
+    timeout: float
+    last_seen: float
+    last_seen_at: datetime
+    online: bool = False
+    # Only the heap entry carrying the current generation is acted on
+    generation: int = 0
+
+    @property
+    def deadline(self) -> float:
+        return self.last_seen + self.timeout
+
+@dataclass
+class LivenessEvent:
+    type: str
+    device_id: str
+    last_seen_at: datetime
+    timeout: float
+
+    def to_message(self) -> Dict[str, object]:
+        return {
+            "type": self.type,
+            "data": {
+                "device_id": self.device_id,
+                "last_seen": self.last_seen_at.isoformat(),
+                "timeout_seconds": self.timeout,
+                "timestamp": datetime.now().isoformat()
+            }
+        }
+
+class LivenessTracker:
+    def __init__(self, default_timeout: float = 30.0):
+        self.default_timeout = default_timeout
+        self.devices: Dict[str, DeviceLiveness] = {}
+        self.timeouts: Dict[str, float] = {}
+        self.online_count = 0
+        self.online_ids: Set[str] = set()
+        self.offline_ids: Set[str] = set()
+        self._heap: List[Tuple[float, int, str]] = []
+        # Readings may be recorded from other threads (mock data worker)
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup = asyncio.Event()
+
+    @classmethod
+    def from_env(cls) -> "LivenessTracker":
+        return cls(default_timeout=float(os.getenv("DEVICE_OFFLINE_TIMEOUT_SECONDS", "30")))
+
+    @property
+    def offline_count(self) -> int:
+        return len(self.devices) - self.online_count
+
+    def _schedule(self, device: DeviceLiveness) -> None:
+        device.generation += 1
+        earliest = self._heap[0][0] if self._heap else None
+        heapq.heappush(self._heap, (device.deadline, device.generation, device.device_id))
+        if self._loop is not None and (earliest is None or device.deadline < earliest):
+            # The expiry loop may be sleeping towards a later deadline
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def set_timeout(self, device_id: str, timeout: float) -> None:
+        """Use a device-specific offline timeout instead of the default"""
+        with self._lock:
+            self.timeouts[device_id] = timeout
+            device = self.devices.get(device_id)
+            if device is not None:
+                device.timeout = timeout
+                if device.online:
+                    self._schedule(device)
+
+    def record(self, device_id: str, seen_at: datetime, now: Optional[float] = None) -> Optional[LivenessEvent]:
+        """Note a reading from a device; return a device_online event if it was offline or new"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            device = self.devices.get(device_id)
+            if device is None:
+                device = self.devices[device_id] = DeviceLiveness(
+                    device_id=device_id,
+                    timeout=self.timeouts.get(device_id, self.default_timeout),
+                    last_seen=now,
+                    last_seen_at=seen_at
+                )
+            device.last_seen = now
+            device.last_seen_at = seen_at
+            if device.online:
+                return None
+            device.online = True
+            self.online_count += 1
+            self.online_ids.add(device_id)
+            self.offline_ids.discard(device_id)
+            self._schedule(device)
+        return LivenessEvent(DEVICE_ONLINE, device_id, seen_at, device.timeout)
+
+    def expire(self, now: Optional[float] = None) -> List[LivenessEvent]:
+        """Take devices whose deadline has passed offline; return their device_offline events"""
+        now = time.monotonic() if now is None else now
+        events = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, generation, device_id = heapq.heappop(self._heap)
+                device = self.devices[device_id]
+                if generation != device.generation or not device.online:
+                    continue
+                if device.deadline > now:
+                    self._schedule(device)
+                    continue
+                device.online = False
+                self.online_count -= 1
+                self.online_ids.discard(device_id)
+                self.offline_ids.add(device_id)
+                events.append(LivenessEvent(DEVICE_OFFLINE, device_id, device.last_seen_at, device.timeout))
+        return events
+
+    def next_deadline(self) -> Optional[float]:
+        return self._heap[0][0] if self._heap else None
+
+    async def run(self, publish: Callable[[LivenessEvent], Awaitable[None]]) -> None:
+        """Sleep until the next deadline, publish offline transitions, repeat"""
+        self._loop = asyncio.get_running_loop()
+        while True:
+            for event in self.expire():
+                await publish(event)
+            self._wakeup.clear()
+            deadline = self.next_deadline()
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def counts(self) -> Dict[str, object]:
+        """/health fields: device ID lists under their original keys, plus the maintained counts"""
+        with self._lock:
+            online, offline = list(self.online_ids), list(self.offline_ids)
+            return {
+                "total_devices": len(self.devices),
+                "online_devices": online,
+                "offline_devices": offline,
+                "online_count": self.online_count,
+                "offline_count": self.offline_count
+            }
+
+    def snapshot(self) -> Dict[str, Dict[str, object]]:
+        with self._lock:
+            return {
+                device_id: {
+                    "online": d.online,
+                    "last_seen": d.last_seen_at.isoformat(),
+                    "timeout_seconds": d.timeout
+                }
+                for device_id, d in self.devices.items()
+            }
@@ -1,24 +1,63 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
+from collections import deque
+from itertools import islice
 import asyncio
 import json
 from datetime import datetime
+from dataclasses import asdict
 import uvicorn
 import os
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from contextlib import asynccontextmanager
+from starlette.concurrency import run_in_threadpool
+from database import get_supabase, SUPABASE_URL
+from migrations import apply_migrations
 from dashboard_content import dashboard_html
 from hedera_service import hedera_service, batch_processor
+from batch_control import AdaptiveBatchController
 from guardian_service import guardian_service
+from guardian_worker import GuardianSubmissionWorker, utc_now
+from energy_reading import EnergyReading, ReadingValidationError, MAX_IDEMPOTENCY_KEY_LENGTH
+from reading_codec import decode_readings, media_type, UnsupportedContentType
+from device_channel import DeviceChannel
+from admission import AdmissionController, AdmissionDecision, AdmissionRejected
+from audit import AuditJob
+from topic_index import TopicSync, create_topic_sync
+from liveness import LivenessTracker, LivenessEvent
+from screening import ReadingScreener, ScreeningConfig, flag_names
+from dedup import DedupIndex, apply_idempotency_key
+from profiling import profiler
+from event_stream import EventLog
+from export import export_chunks, ExportError, FORMAT_CSV, MEDIA_TYPES
+from proof_bundle import load_bundle, bundle_filename, BundleNotFound
+from cluster import Cluster, ForwardRejected, FORWARDED_HEADER
+from device_registry import DeviceRegistry, DeviceAttribution, UnknownParticipant, participant_partition_key
+from shutdown import GracefulServer, ShutdownCoordinator, wait_until
+from http_cache import (
+    VersionedSnapshot,
+    LRUCache,
+    cached_response,
+    content_etag,
+    IMMUTABLE_CACHE_CONTROL,
+    SNAPSHOT_CACHE_CONTROL
+)
 from database_models import (
     ParticipantRegistrationRequest, 
     ParticipantRegistrationResponse,
     ParticipantStatusResponse,
-    DATABASE_SCHEMA
+    BatchPartitionRequest,
+    DeviceLivenessRequest,
+    DeviceRegistrationRequest,
+    RegistryInvalidationRequest,
+    ProfilingRequest,
+    ProfileCaptureRequest,
+    SubmissionStatus
 )
+import proof_store
 import uuid
 
 # Mock data functionality
@@ -29,7 +68,59 @@ import time
 # Load environment variables
 load_dotenv()
 
-app = FastAPI(title="ESP32 Carbon Credit Backend", version="0.6")
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "true").lower() not in ("0", "false", "no")
+TOPIC_SYNC_INTERVAL_SECONDS = float(os.getenv("TOPIC_SYNC_INTERVAL_SECONDS", "30"))
+
+# Local index of our HCS topic, opened in the app lifespan (None when HEDERA_TOPIC_ID is not set)
+topic_sync: Optional[TopicSync] = None
+
+# Devices sharded across backend nodes (disabled unless CLUSTER_NODES is set)
+cluster = Cluster.from_env()
+if cluster.enabled:
+    batch_processor.node_id = cluster.node_id
+    print(f"🧩 Cluster node {cluster.node_id} of {len(cluster.nodes)}: {', '.join(cluster.nodes)}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Connect to Supabase and bring the schema up to date before serving"""
+    global supabase, guardian_worker, topic_sync
+    supabase = get_supabase()
+    if supabase is not None:
+        print(f"✅ Supabase client ready: {SUPABASE_URL}")
+        if AUTO_MIGRATE:
+            try:
+                # Single SELECT when the schema is already current
+                applied = await run_in_threadpool(apply_migrations, supabase)
+                if applied:
+                    print(f"✅ Applied database migrations: {applied}")
+            except Exception as schema_error:
+                print(f"⚠️ Database migration warning: {schema_error}")
+        try:
+            registered = await run_in_threadpool(device_registry.load, supabase)
+            print(f"📇 Device registry loaded: {registered} device(s), {len(device_registry.participants)} participant(s)")
+        except Exception as registry_error:
+            print(f"⚠️ Device registry not loaded: {registry_error}")
+
+    topic_sync_task = None
+    topic_sync = create_topic_sync()
+    if topic_sync is not None:
+        topic_sync_task = asyncio.create_task(topic_sync.run(TOPIC_SYNC_INTERVAL_SECONDS))
+        print(f"📥 Syncing HCS topic {topic_sync.topic_id} every {TOPIC_SYNC_INTERVAL_SECONDS}s")
+    liveness_task = asyncio.create_task(liveness.run(publish_liveness_event))
+    batch_control_task = asyncio.create_task(batch_controller.run(handle_batch_results))
+    guardian_task = None
+    if supabase is not None:
+        guardian_worker = GuardianSubmissionWorker.from_env(supabase, guardian_service)
+        guardian_task = asyncio.create_task(guardian_worker.run())
+    yield
+    # uvicorn has stopped accepting connections and finished open requests
+    report = await shutdown.drain(drain_steps(liveness_task, batch_control_task, guardian_task, topic_sync_task))
+    for step in report["steps"]:
+        print(f"{'✅' if step['status'] == 'ok' else '⚠️'} Shutdown {step['name']}: {step['status']} "
+              f"({step['elapsed_ms']}ms) {json.dumps(step['details'])}")
+    print(f"🛑 Shutdown {'complete' if report['clean'] else 'incomplete'} in {report['elapsed_seconds']}s")
+
+app = FastAPI(title="ESP32 Carbon Credit Backend", version="0.6", lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
@@ -59,33 +150,42 @@ async def log_requests(request, call_next):
     
     return response
 
+# Ingest requests traced stage by stage while profiling is enabled (see profiling.py)
+PROFILED_PATHS = frozenset({"/api/energy-data", "/api/energy-data/bulk"})
+
+@app.middleware("http")
+async def profile_ingest(request, call_next):
+    if not profiler.enabled or request.url.path not in PROFILED_PATHS:
+        return await call_next(request)
+    with profiler.trace(f"{request.method} {request.url.path}"):
+        return await call_next(request)
+
+# Ingest answers 503 once draining has started (see shutdown.py); clients retry elsewhere
+@app.middleware("http")
+async def refuse_ingest_while_draining(request, call_next):
+    if shutdown.draining and request.url.path in PROFILED_PATHS:
+        return Response(
+            content=json.dumps({"detail": "Server is shutting down"}),
+            status_code=503,
+            media_type="application/json",
+            headers={"Retry-After": str(shutdown.retry_after_seconds), "Connection": "close"}
+        )
+    return await call_next(request)
+
 # Mount static files directory
 assets_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "assets")
 app.mount("/static", StaticFiles(directory=assets_path), name="static")
 
-# Supabase configuration
-SUPABASE_URL = os.getenv("SUPABASE_URL", "your_supabase_url")
-SUPABASE_KEY = os.getenv("SUPABASE_ANON_KEY", "your_supabase_anon_key")
-
-try:
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-    print(f"✅ Connected to Supabase: {SUPABASE_URL}")
-    
-    # Initialize database schema
-    try:
-        supabase.rpc('exec_sql', {'sql': DATABASE_SCHEMA}).execute()
-        print("✅ Database schema initialized")
-    except Exception as schema_error:
-        print(f"⚠️ Database schema initialization warning: {schema_error}")
-        
-except Exception as e:
-    print(f"❌ Supabase connection error: {e}")
-    supabase = None
+# Supabase client is created lazily in the app lifespan (see database.py)
+supabase = None
+# Submits anchored participant batches to Guardian (started with Supabase)
+guardian_worker: Optional[GuardianSubmissionWorker] = None
 
 # WebSocket connection manager
 class ConnectionManager:
     def __init__(self):
         self.active_connections: List[WebSocket] = []
+        self.pending_sends = 0
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
@@ -96,19 +196,84 @@ class ConnectionManager:
             self.active_connections.remove(websocket)
 
     async def broadcast(self, message: str):
-        for connection in self.active_connections[:]:  # Create a copy to avoid modification during iteration
+        connections = self.active_connections[:]  # Create a copy to avoid modification during iteration
+        self.pending_sends += len(connections)
+        for connection in connections:
             try:
                 await connection.send_text(message)
             except:
                 # Remove dead connections
-                self.active_connections.remove(connection)
+                self.disconnect(connection)
+            finally:
+                self.pending_sends -= 1
 
 manager = ConnectionManager()
 
+# Every /ws message is also logged for the resumable SSE stream
+event_log = EventLog.from_env()
+
+async def publish_event(event_type: str, data: Dict[str, Any], device_id: Optional[str] = None) -> None:
+    """Log an event for SSE subscribers and broadcast it to /ws clients"""
+    message = json.dumps({"type": event_type, "data": data})
+    event_log.append(event_type, message, device_id)
+    await manager.broadcast(message)
+
+# Stops ingest and drains in-flight work on SIGTERM (see drain_steps)
+shutdown = ShutdownCoordinator.from_env()
+# Open SSE streams would otherwise hold the shutdown until the graceful timeout
+shutdown.on_begin(event_log.close)
+
+# Per-device rate limiting and backpressure on ingest
+admission = AdmissionController.from_env()
+# Tunes partition batch size/age to the ingest rate and HCS behaviour (see batch_control.py)
+batch_controller = AdaptiveBatchController.from_env(batch_processor)
+
+admission.register_queue("batch", lambda: batch_processor.pending_count, high_water=50_000, drain_seconds=30.0)
+admission.register_queue("hcs_submissions", lambda: batch_processor.in_flight_submissions, high_water=32, drain_seconds=5.0)
+admission.register_queue("broadcast", lambda: manager.pending_sends, high_water=10_000)
+
 # Store latest readings in memory
-latest_readings = {}
-readings_history = []
-device_last_seen = {}
+READINGS_HISTORY_SIZE = 1000
+latest_readings: Dict[str, EnergyReading] = {}
+readings_history: deque = deque(maxlen=READINGS_HISTORY_SIZE)
+# Both views change together; polls with a current ETag get 304 (see http_cache.py)
+readings_snapshot = VersionedSnapshot("readings")
+# Retried submissions (same seq / idempotency key) are dropped before anything else
+dedup_index = DedupIndex.from_env()
+
+# device -> participant/DID attribution, kept in memory write-through (see device_registry.py)
+device_registry = DeviceRegistry()
+
+def route_registered_device(device_id: str, attribution: Optional[DeviceAttribution]) -> None:
+    """Batch a registered device's readings in its participant's partition"""
+    if attribution is None:
+        batch_processor.unassign_device(device_id)
+    else:
+        batch_processor.assign_device(device_id, participant_partition_key(attribution.participant_id), attribution.participant_did)
+
+device_registry.on_change(route_registered_device)
+
+# Anomaly screening in front of the batcher; quarantined readings are never anchored
+screener = ReadingScreener(ScreeningConfig.from_env())
+
+# Online/offline state per device, pushed to /ws subscribers on change
+liveness = LivenessTracker.from_env()
+
+async def publish_liveness_event(event: LivenessEvent) -> None:
+    print(f"{'🟢' if event.type == 'device_online' else '🔴'} Device {event.device_id}: {event.type}")
+    await publish_event(event.type, event.to_message()["data"], event.device_id)
+
+def remember_reading(reading: EnergyReading) -> Optional[LivenessEvent]:
+    """Record a reading in the in-memory latest/history views; return a device_online event if any"""
+    latest_readings[reading.device_id] = reading
+    # The deque drops the oldest reading once READINGS_HISTORY_SIZE is reached
+    readings_history.append(reading)
+    readings_snapshot.bump()
+    return liveness.record(reading.device_id, reading.received_at)
+
+def latest_readings_snapshot() -> Dict[str, Dict[str, Any]]:
+    """JSON view of the latest reading per device"""
+    return {device_id: reading.to_dict() for device_id, reading in latest_readings.items()}
 
 @app.get("/", response_class=HTMLResponse)
 async def get_dashboard():
@@ -148,132 +313,288 @@ async def test_post(data: Dict[str, Any]):
         "timestamp": datetime.now().isoformat()
     }
 
-@app.post("/api/energy-data")
-async def receive_energy_data(reading: Dict[str, Any]):
-    """Receive energy data from ESP32 and process through Guardian Tools"""
+MAX_BULK_READINGS = 5000
+
+def store_batch_proof(hedera_result, current_time: str) -> None:
+    """Persist the proof anchor and batch contents of a submitted batch"""
+    if not supabase or not hedera_result.batch:
+        return
+    try:
+        with profiler.span("proof_store"):
+            proof_store.store_batch_proof(supabase, hedera_result)
+        print(f"💾 [{current_time}] Proof anchor stored in database")
+        if guardian_worker is not None and hedera_result.batch.participant_did:
+            guardian_worker.notify()
+    except Exception as db_error:
+        print(f"❌ [{current_time}] Database storage error: {db_error}")
+
+def handle_batch_result(hedera_result, current_time: str) -> None:
+    """Log a batch submission result and persist its proof on success"""
+    if hedera_result.success:
+        print(f"✅ [{current_time}] Batch submitted to Hedera: {hedera_result.transaction_id}")
+        
+        # Store proof anchor in database
+        store_batch_proof(hedera_result, current_time)
+    else:
+        print(f"❌ [{current_time}] Hedera submission failed: {hedera_result.error}")
+
+async def handle_batch_results(results) -> None:
+    """Handle batches sealed by the adaptive batch controller's tick"""
     current_time = datetime.now().strftime("%H:%M:%S")
+    for hedera_result in results:
+        handle_batch_result(hedera_result, current_time)
+
+async def process_readings(readings: List[EnergyReading], current_time: str) -> int:
+    """Run validated readings through memory, Hedera batching, Supabase and broadcast
+
+    Returns the number of readings dropped as retried duplicates.
+    """
+    with profiler.span("dedup"):
+        readings, duplicates = dedup_index.filter(readings)
+    if duplicates:
+        print(f"♻️ [{current_time}] Dropped {duplicates} duplicate reading(s)")
+    if not readings:
+        return duplicates
+    
+    # Flag anomalies before anything else sees the readings
+    with profiler.span("screen"):
+        anchorable, quarantined = screener.screen_all(readings)
+    if quarantined:
+        print(f"🚩 [{current_time}] Quarantined {len(quarantined)} reading(s): "
+              f"{', '.join(sorted(set(r.device_id for r in quarantined)))}")
+    
+    # Store in memory
+    with profiler.span("remember"):
+        liveness_events = [event for event in map(remember_reading, readings) if event is not None]
+    
+    print(f"💾 [{current_time}] Stored in memory: {len(readings)} reading(s)")
+    
+    # Add to Hedera batch for proof anchoring
+    try:
+        with profiler.span("batch_add"):
+            for reading in anchorable:
+                batch_processor.add_reading(reading)
+        if batch_processor.should_process_batch():
+            print(f"🔗 [{current_time}] Processing due batches for Hedera submission")
+            with profiler.span("batch_process"):
+                for hedera_result in await batch_processor.process_due_batches():
+                    handle_batch_result(hedera_result, current_time)
+    except Exception as e:
+        print(f"❌ [{current_time}] Error in Hedera batching: {e}")
+    
+    # Store in Supabase with corrected timestamp
+    if supabase:
+        try:
+            # Database rows carry the server timestamp only
+            db_readings = []
+            for reading in readings:
+                db_reading = reading.to_dict()
+                db_reading.pop("server_received_at", None)
+                if screener.is_quarantined(reading):
+                    db_reading["quarantined"] = True
+                attribution = device_registry.attribution(reading.device_id)
+                if attribution is not None:
+                    db_reading["participant_id"] = attribution.participant_id
+                db_readings.append(db_reading)
+            
+            with profiler.span("supabase_insert"):
+                supabase.table("energy_readings").insert(db_readings if len(db_readings) > 1 else db_readings[0]).execute()
+            print(f"💾 [{current_time}] Stored in Supabase: {len(db_readings)} reading(s)")
+        except Exception as e:
+            print(f"❌ [{current_time}] Supabase insert error: {e}")
+    
+    # Broadcast to WebSocket clients
+    try:
+        with profiler.span("broadcast"):
+            for event in liveness_events:
+                await publish_liveness_event(event)
+            for reading in readings:
+                await publish_event("energy_reading", reading.to_dict(), reading.device_id)
+        print(f"📡 [{current_time}] Broadcasted to WebSocket clients")
+    except Exception as e:
+        print(f"❌ [{current_time}] WebSocket broadcast error: {e}")
+    
+    return duplicates
+
+def admit_local(readings: List[EnergyReading], bulk: bool = False) -> None:
+    """Charge readings to this node's admission control, raising AdmissionRejected when throttled
+
+    Admitted readings count as in flight until ``admission.release``.
+    """
+    if not readings:
+        return
+    with profiler.span("admission"):
+        decision = admission.admit((r.device_id for r in readings), bulk=bulk)
+    if not decision.allowed:
+        raise AdmissionRejected(decision)
+
+def _rejection_error(rejected: Dict[str, Dict[str, Any]]) -> Exception:
+    """The error to answer with when every forwarded part was refused"""
+    for node_id, response in rejected.items():
+        if response["status_code"] != 429:
+            # Not a throttle: retrying the same request cannot succeed
+            return ForwardRejected(node_id, response["status_code"], response["detail"])
+    retry_after = max(float(response["retry_after"] or 1) for response in rejected.values())
+    details = "; ".join(f"node {node_id}: {response['detail']}" for node_id, response in rejected.items())
+    return AdmissionRejected(AdmissionDecision(False, retry_after, details))
+
+async def route_readings(readings: List[EnergyReading], forwarded_by: Optional[str], current_time: str,
+                         bulk: bool = False) -> Tuple[List[EnergyReading], Dict[str, Dict[str, Any]], Dict[str, Dict[str, Any]]]:
+    """Admit this node's readings and forward the others to their owner nodes
+
+    Returns the admitted readings to process here (the caller releases them
+    from admission), the owners' responses and the owners' rejections.
+    Local readings are admitted before anything is forwarded, so a local
+    throttle never leaves a remote part stored. Readings forwarded by
+    another node are always processed here. When an owner is unreachable its
+    readings are processed here instead. When owners refuse their part and
+    no other owner took any, nothing has been stored and AdmissionRejected
+    (429 from an owner) or ForwardRejected (other client errors) is raised;
+    otherwise the rejections are returned for a partial response.
+    """
+    if not cluster.enabled or forwarded_by:
+        admit_local(readings, bulk)
+        return readings, {}, {}
+    local, remote = cluster.split(readings)
+    admit_local(local, bulk)
+    if not remote:
+        return local, {}, {}
+    try:
+        responses = await asyncio.gather(*(cluster.forward(node_id, node_readings) for node_id, node_readings in remote.items()))
+        forwarded, rejected = {}, {}
+        for (node_id, node_readings), response in zip(remote.items(), responses):
+            if response is None:
+                print(f"⚠️ [{current_time}] Node {node_id} unreachable, processing {len(node_readings)} reading(s) here")
+                try:
+                    admit_local(node_readings, bulk)
+                except AdmissionRejected as e:
+                    # Same shape as an owner's 429 (Retry-After header value)
+                    rejected[node_id] = {"status_code": 429, "detail": str(e), "retry_after": e.decision.retry_after_header}
+                    continue
+                local.extend(node_readings)
+            elif response["status_code"] != 200:
+                rejected[node_id] = response
+            else:
+                forwarded[node_id] = response
+    except BaseException:
+        admission.release(len(local))
+        raise
+    for node_id, response in rejected.items():
+        response["device_ids"] = sorted({r.device_id for r in remote[node_id]})
+        response["reading_count"] = len(remote[node_id])
+    if rejected and not forwarded:
+        admission.release(len(local))
+        raise _rejection_error(rejected)
+    if forwarded:
+        targets = ", ".join(f"{node_id} ({response['reading_count']})" for node_id, response in forwarded.items())
+        print(f"🧩 [{current_time}] Forwarded to {targets}")
+    if rejected:
+        print(f"🚦 [{current_time}] Partially accepted: refused by {', '.join(rejected)}")
+    return local, forwarded, rejected
+
+async def route_ingest_request(readings: List[EnergyReading], request: Request, current_time: str,
+                               bulk: bool = False) -> Tuple[List[EnergyReading], Dict[str, Dict[str, Any]], Dict[str, Dict[str, Any]]]:
+    """route_readings for HTTP ingest: 429 with Retry-After when throttled, an owner's 4xx passed through"""
+    try:
+        return await route_readings(readings, request.headers.get(FORWARDED_HEADER), current_time, bulk)
+    except AdmissionRejected as e:
+        retry_after = e.decision.retry_after_header
+        print(f"🚦 [{current_time}] Ingest throttled ({e}), retry after {retry_after}s")
+        raise HTTPException(status_code=429, detail=f"Ingest throttled: {e}", headers={"Retry-After": retry_after})
+    except ForwardRejected as e:
+        print(f"❌ [{current_time}] Rejected by owner node {e.node_id}: {e.status_code} {e.detail}")
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+async def decode_ingest_request(request: Request, server_time: datetime, current_time: str) -> List[EnergyReading]:
+    """Decode a JSON, MessagePack or binary struct ingest body into validated readings"""
+    content_type = request.headers.get("content-type")
+    with profiler.span("read_body"):
+        body = await request.body()
     
     # Debug: Log all incoming requests
+    print(f"🔍 [{current_time}] Content-Type: {media_type(content_type)} ({len(body)} bytes)")
+    
+    try:
+        with profiler.span("decode_validate"):
+            readings = decode_readings(body, content_type, server_time)
+    except UnsupportedContentType as e:
+        print(f"❌ [{current_time}] UNSUPPORTED MEDIA TYPE: {e}")
+        raise HTTPException(status_code=415, detail=str(e))
+    except ReadingValidationError as validation_error:
+        error_msg = str(validation_error)
+        print(f"❌ [{current_time}] VALIDATION ERROR: {error_msg}")
+        raise HTTPException(status_code=400, detail=error_msg)
+    
+    idempotency_key = request.headers.get("idempotency-key")
+    if idempotency_key is not None and not 0 < len(idempotency_key) <= MAX_IDEMPOTENCY_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1-{MAX_IDEMPOTENCY_KEY_LENGTH} characters")
+    apply_idempotency_key(readings, idempotency_key)
+    
+    if not readings:
+        raise HTTPException(status_code=400, detail="No readings in request")
+    if len(readings) > MAX_BULK_READINGS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_READINGS} readings per request")
+    return readings
+
+@app.post("/api/energy-data")
+async def receive_energy_data(request: Request):
+    """Receive energy data from ESP32 and process through Guardian Tools
+    
+    Accepts a JSON object, a MessagePack map or a single binary struct record
+    (see reading_codec) selected by Content-Type.
+    """
+    current_time = datetime.now().strftime("%H:%M:%S")
+    
     print(f"🔍 [{current_time}] ESP32 DATA ENDPOINT HIT!")
-    print(f"🔍 [{current_time}] Raw data received: {reading}")
-    print(f"🔍 [{current_time}] Data type: {type(reading)}")
-    print(f"🔍 [{current_time}] Data keys: {list(reading.keys()) if isinstance(reading, dict) else 'Not a dict'}")
     
     try:
-        # Validate required fields
-        required_fields = ["device_id", "current", "voltage", "power"]
-        missing_fields = []
-        
-        for field in required_fields:
-            if field not in reading:
-                missing_fields.append(field)
-        
-        if missing_fields:
-            error_msg = f"Missing required fields: {missing_fields}"
-            print(f"❌ [{current_time}] VALIDATION ERROR: {error_msg}")
-            print(f"❌ [{current_time}] Available fields: {list(reading.keys())}")
-            raise HTTPException(status_code=400, detail=error_msg)
-        
-        print(f"✅ [{current_time}] Validation passed for device: {reading['device_id']}")
-        
-        # Fix timestamp - use server time instead of ESP32's fake timestamp
+        # Validate and use server time instead of ESP32's fake timestamp
         server_time = datetime.now()
-        reading["timestamp"] = server_time.isoformat()
-        reading["server_received_at"] = server_time.isoformat()
+        readings = await decode_ingest_request(request, server_time, current_time)
+        if len(readings) != 1:
+            raise HTTPException(status_code=400, detail="Expected a single reading; use /api/energy-data/bulk for batches")
+        reading = readings[0]
         
-        # Store in memory
-        latest_readings[reading["device_id"]] = reading
-        readings_history.append(reading)
-        device_last_seen[reading["device_id"]] = server_time
+        print(f"✅ [{current_time}] Validation passed for device: {reading.device_id}")
         
-        print(f"💾 [{current_time}] Stored in memory: {reading['device_id']}")
+        readings, forwarded, _ = await route_ingest_request(readings, request, current_time)
+        if forwarded:
+            # Owned by another cluster node, which stored it
+            (node_id, response), = forwarded.items()
+            return {
+                "status": "duplicate" if response["duplicate_count"] else "success",
+                "message": "Reading already received" if response["duplicate_count"] else "Data received and stored successfully",
+                "server_time": response["server_time"],
+                "device_id": reading.device_id,
+                "power": reading.power,
+                "quarantined": response["quarantined_count"] > 0,
+                "node_id": node_id
+            }
         
-        # Keep only last 1000 readings in memory
-        if len(readings_history) > 1000:
-            readings_history.pop(0)
-        
-        # Add to Hedera batch for proof anchoring
         try:
-            batch_processor.add_reading(reading)
-            if batch_processor.should_process_batch():
-                print(f"🔗 [{current_time}] Processing batch for Hedera submission")
-                hedera_result = await batch_processor.process_current_batch()
-                if hedera_result and hedera_result.success:
-                    print(f"✅ [{current_time}] Batch submitted to Hedera: {hedera_result.transaction_id}")
-                    
-                    # Store proof anchor in database
-                    if supabase and hasattr(hedera_result, 'batch'):
-                        try:
-                            batch = hedera_result.batch
-                            proof_data = {
-                                "batch_id": batch.batch_id,
-                                "hcs_transaction_id": hedera_result.transaction_id,
-                                "consensus_timestamp": hedera_result.consensus_timestamp,
-                                "data_hash": batch.data_hash,
-                                "batch_metadata": {
-                                    "device_count": len(set(r.get("device_id") for r in batch.readings)),
-                                    "reading_count": len(batch.readings),
-                                    "total_energy_kwh": sum(r.get("total_energy_kwh", 0) for r in batch.readings)
-                                }
-                            }
-                            
-                            supabase.table("proof_anchors").insert(proof_data).execute()
-                            
-                            # Store batch contents
-                            batch_contents = []
-                            for i, reading in enumerate(batch.readings):
-                                batch_contents.append({
-                                    "batch_id": batch.batch_id,
-                                    "device_id": reading.get("device_id"),
-                                    "reading_data": reading,
-                                    "original_timestamp": reading.get("timestamp"),
-                                    "batch_position": i
-                                })
-                            
-                            if batch_contents:
-                                supabase.table("batch_contents").insert(batch_contents).execute()
-                            
-                            print(f"💾 [{current_time}] Proof anchor stored in database")
-                            
-                        except Exception as db_error:
-                            print(f"❌ [{current_time}] Database storage error: {db_error}")
-                    
-                else:
-                    print(f"❌ [{current_time}] Hedera submission failed: {hedera_result.error if hedera_result else 'Unknown error'}")
-        except Exception as e:
-            print(f"❌ [{current_time}] Error in Hedera batching: {e}")
+            duplicates = await process_readings(readings, current_time)
+        finally:
+            admission.release(len(readings))
         
-        # Store in Supabase with corrected timestamp
-        if supabase:
-            try:
-                # Create a copy for database with proper timestamp
-                db_reading = reading.copy()
-                db_reading["timestamp"] = server_time.isoformat()
-                db_reading.pop("server_received_at", None)
-                
-                result = supabase.table("energy_readings").insert(db_reading).execute()
-                print(f"💾 [{current_time}] Stored in Supabase: {reading['device_id']} - {reading['power']}W")
-            except Exception as e:
-                print(f"❌ [{current_time}] Supabase insert error: {e}")
-        
-        # Broadcast to WebSocket clients
-        try:
-            await manager.broadcast(json.dumps({
-                "type": "energy_reading",
-                "data": reading
-            }))
-            print(f"📡 [{current_time}] Broadcasted to WebSocket clients")
-        except Exception as e:
-            print(f"❌ [{current_time}] WebSocket broadcast error: {e}")
+        if duplicates:
+            # Retried submission: acknowledge it without storing it again
+            return {
+                "status": "duplicate",
+                "message": "Reading already received",
+                "server_time": server_time.isoformat(),
+                "device_id": reading.device_id
+            }
         
-        print(f"✅ [{current_time}] SUCCESS: Received data from {reading['device_id']}: {reading['power']}W")
+        print(f"✅ [{current_time}] SUCCESS: Received data from {reading.device_id}: {reading.power}W")
         
         return {
             "status": "success", 
             "message": "Data received and stored successfully", 
             "server_time": server_time.isoformat(),
-            "device_id": reading["device_id"],
-            "power": reading["power"]
+            "device_id": reading.device_id,
+            "power": reading.power,
+            "quality_flags": flag_names(reading.quality_flags),
+            "quarantined": screener.is_quarantined(reading)
         }
     
     except HTTPException:
@@ -287,39 +608,91 @@ async def receive_energy_data(reading: Dict[str, Any]):
         print(f"❌ [{current_time}] Traceback: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=error_msg)
 
+@app.post("/api/energy-data/bulk")
+async def receive_energy_data_bulk(request: Request):
+    """Receive a batch of readings (JSON list, MessagePack array or binary struct records)"""
+    current_time = datetime.now().strftime("%H:%M:%S")
+    
+    print(f"🔍 [{current_time}] ESP32 BULK DATA ENDPOINT HIT!")
+    
+    try:
+        server_time = datetime.now()
+        readings = await decode_ingest_request(request, server_time, current_time)
+        
+        print(f"✅ [{current_time}] Validation passed for {len(readings)} reading(s)")
+        
+        all_device_ids = sorted(set(r.device_id for r in readings))
+        readings, forwarded, rejected = await route_ingest_request(readings, request, current_time, bulk=True)
+        duplicates = 0
+        if readings:
+            try:
+                duplicates = await process_readings(readings, current_time)
+            finally:
+                admission.release(len(readings))
+        
+        response = {
+            "status": "partial" if rejected else "success",
+            "message": "Some readings were refused; resend only those" if rejected else "Data received and stored successfully",
+            "server_time": server_time.isoformat(),
+            "reading_count": len(readings) - duplicates + sum(r["reading_count"] for r in forwarded.values()),
+            "duplicate_count": duplicates + sum(r["duplicate_count"] for r in forwarded.values()),
+            "quarantined_count": (
+                sum(1 for r in readings if screener.is_quarantined(r))
+                + sum(r["quarantined_count"] for r in forwarded.values())
+            ),
+            "device_ids": all_device_ids
+        }
+        if forwarded:
+            response["forwarded"] = {node_id: r["reading_count"] + r["duplicate_count"] for node_id, r in forwarded.items()}
+        if rejected:
+            # Everything else is stored: resending the whole array would store it twice
+            response["rejected"] = {
+                node_id: {key: r[key] for key in ("status_code", "detail", "retry_after", "reading_count", "device_ids")}
+                for node_id, r in rejected.items()
+            }
+        return response
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        error_msg = f"Unexpected error processing ESP32 bulk data: {str(e)}"
+        print(f"❌ [{current_time}] CRITICAL ERROR: {error_msg}")
+        raise HTTPException(status_code=500, detail=error_msg)
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    # Check which devices are online (received data in last 30 seconds)
-    now = datetime.now()
-    online_devices = []
-    offline_devices = []
-    
-    for device_id, last_seen in device_last_seen.items():
-        time_diff = (now - last_seen).total_seconds()
-        if time_diff <= 30:  # 30 seconds timeout
-            online_devices.append(device_id)
-        else:
-            offline_devices.append(device_id)
-    
+    # Online/offline counts are maintained by the liveness tracker
     return {
         "status": "healthy",
-        "timestamp": now.isoformat(),
-        "total_devices": len(device_last_seen),
-        "online_devices": online_devices,
-        "offline_devices": offline_devices,
-        "supabase_connected": supabase is not None
+        "timestamp": datetime.now().isoformat(),
+        **liveness.counts(),
+        "supabase_connected": supabase is not None,
+        "draining": shutdown.draining
     }
 
 @app.get("/api/latest-readings")
-async def get_latest_readings():
-    """Get latest readings from all devices"""
-    return latest_readings
+async def get_latest_readings(request: Request, scope: str = "cluster"):
+    """Get latest readings from all devices
+    
+    In cluster mode the view is merged from every node; scope=local returns
+    this node's devices only. Send If-None-Match with the last ETag to get
+    304 when nothing changed.
+    """
+    if scope == "local" or not cluster.enabled:
+        return readings_snapshot.response(request, latest_readings_snapshot, "latest")
+    # Peers have their own versions: the merged view is tagged by content
+    body = json.dumps(await cluster.merged_latest(latest_readings_snapshot())).encode("utf-8")
+    return cached_response(request, content_etag(body), lambda: body, SNAPSHOT_CACHE_CONTROL)
+
+def readings_history_view(limit: int) -> List[Dict[str, Any]]:
+    start = max(0, len(readings_history) - max(0, limit))
+    return [reading.to_dict() for reading in islice(readings_history, start, None)]
 
 @app.get("/api/readings-history")
-async def get_readings_history(limit: int = 100):
-    """Get historical readings"""
-    return readings_history[-limit:]
+async def get_readings_history(request: Request, limit: int = 100):
+    """Get historical readings (ETag / If-None-Match as for latest readings)"""
+    return readings_snapshot.response(request, lambda: readings_history_view(limit), f"history-{limit}")
 
 @app.get("/api/supabase-data/{device_id}")
 async def get_supabase_data(device_id: str, limit: int = 10):
@@ -373,13 +746,16 @@ mock_data_active = False
 mock_data_thread = None
 
 import random
+import sys
 from datetime import datetime, timedelta
 
+MOCK_DEVICE_ID = sys.intern("ESP32_MOCK_001")
+
 # Simulate accumulated energy for the session (global variable)
 total_energy_wh = 0
 last_mock_time = datetime.now()
 
-def generate_mock_data():
+def generate_mock_data() -> EnergyReading:
     """Generate realistic mock ESP32 data and accumulate energy as power sum over time"""
     global total_energy_wh, last_mock_time
 
@@ -412,45 +788,35 @@ def generate_mock_data():
     total_energy_kwh = round(total_energy_wh / 1000, 3)
     last_mock_time = current_time
 
-    return {
-        "device_id": "ESP32_MOCK_001",
-        "current": round(current, 2),
-        "voltage": round(voltage, 1),
-        "power": round(power, 1),
-        "total_energy_kwh": total_energy_kwh,
-        "efficiency": efficiency,
-        "ambient_temp_c": round(25 + random.uniform(-5, 10), 1),
-        "irradiance_w_m2": round(irradiance, 1),
-        "power_factor": power_factor
-    }
+    return EnergyReading(
+        device_id=MOCK_DEVICE_ID,
+        current=round(current, 2),
+        voltage=round(voltage, 1),
+        power=round(power, 1),
+        received_at=current_time,
+        total_energy_kwh=total_energy_kwh,
+        efficiency=efficiency,
+        ambient_temp_c=round(25 + random.uniform(-5, 10), 1),
+        irradiance_w_m2=round(irradiance, 1),
+        power_factor=power_factor
+    )
 
 
 async def send_mock_data():
     """Send mock data through the normal data processing pipeline"""
+    # Mock readings are stamped with server time when generated
     mock_reading = generate_mock_data()
     
-    # Process through the same pipeline as real ESP32 data
-    server_time = datetime.now()
-    mock_reading["timestamp"] = server_time.isoformat()
-    mock_reading["server_received_at"] = server_time.isoformat()
-    
     # Store in memory
-    latest_readings[mock_reading["device_id"]] = mock_reading
-    readings_history.append(mock_reading)
-    device_last_seen[mock_reading["device_id"]] = server_time
-    
-    # Keep only last 1000 readings in memory
-    if len(readings_history) > 1000:
-        readings_history.pop(0)
+    liveness_event = remember_reading(mock_reading)
     
     # Broadcast to WebSocket clients
-    await manager.broadcast(json.dumps({
-        "type": "energy_reading",
-        "data": mock_reading
-    }))
+    if liveness_event is not None:
+        await publish_liveness_event(liveness_event)
+    await publish_event("energy_reading", mock_reading.to_dict(), mock_reading.device_id)
     
-    current_time = server_time.strftime("%H:%M:%S")
-    print(f"🧪 [{current_time}] Mock data sent: {mock_reading['device_id']} - {mock_reading['power']}W")
+    current_time = mock_reading.received_at.strftime("%H:%M:%S")
+    print(f"🧪 [{current_time}] Mock data sent: {mock_reading.device_id} - {mock_reading.power}W")
 
 def mock_data_worker():
     """Background worker for continuous mock data generation"""
@@ -470,6 +836,12 @@ def mock_data_worker():
             print(f"❌ Mock data worker error: {e}")
             time.sleep(5)
 
+def stop_mock_data_worker() -> None:
+    global mock_data_active
+    mock_data_active = False
+
+shutdown.on_begin(stop_mock_data_worker)
+
 @app.post("/api/test/send-mock-data")
 async def send_single_mock_data():
     """Send a single mock data point"""
@@ -555,6 +927,8 @@ async def register_participant(request: ParticipantRegistrationRequest):
                 }
                 
                 supabase.table("guardian_participants").insert(participant_data).execute()
+                device_registry.add_participant(participant_id)
+                await cluster.notify_peers("/api/devices/registry/invalidate", {"participant_ids": [participant_id]})
                 print(f"💾 [{current_time}] Participant stored in database")
                 
             except Exception as db_error:
@@ -562,17 +936,8 @@ async def register_participant(request: ParticipantRegistrationRequest):
                 raise HTTPException(status_code=500, detail="Database error")
         
         # Initialize Guardian if not already done
-        if not guardian_service.access_token:
-            # Use environment variables for Guardian credentials
-            guardian_email = os.getenv("GUARDIAN_EMAIL")
-            guardian_password = os.getenv("GUARDIAN_PASSWORD")
-            
-            if guardian_email and guardian_password:
-                login_success = await guardian_service.login(guardian_email, guardian_password)
-                if login_success:
-                    await guardian_service.initialize_dry_run()
-                else:
-                    print(f"⚠️ [{current_time}] Guardian login failed, will retry later")
+        if not await guardian_service.ensure_authenticated():
+            print(f"⚠️ [{current_time}] Guardian login failed or not configured, will retry later")
         
         # Create Guardian DID
         guardian_response = None
@@ -591,6 +956,8 @@ async def register_participant(request: ParticipantRegistrationRequest):
                             "guardian_email_sent": True,
                             "updated_at": datetime.now().isoformat()
                         }).eq("id", participant_id).execute()
+                        device_registry.add_participant(participant_id, guardian_response.did)
+                        await cluster.notify_peers("/api/devices/registry/invalidate", {"participant_ids": [participant_id]})
                     
                     print(f"✅ [{current_time}] Guardian DID created: {guardian_response.did}")
                     
@@ -644,7 +1011,8 @@ async def get_participant_status(participant_id: str):
             profile_completion_status=participant["profile_completion_status"],
             guardian_email_sent=participant["guardian_email_sent"],
             created_at=datetime.fromisoformat(participant["created_at"].replace('Z', '+00:00')),
-            updated_at=datetime.fromisoformat(participant["updated_at"].replace('Z', '+00:00'))
+            updated_at=datetime.fromisoformat(participant["updated_at"].replace('Z', '+00:00')),
+            device_ids=device_registry.devices_of(participant["id"])
         )
         
     except HTTPException:
@@ -652,6 +1020,45 @@ async def get_participant_status(participant_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving participant status: {str(e)}")
 
+@app.post("/api/participants/{participant_id}/devices")
+async def register_participant_devices(participant_id: str, request: DeviceRegistrationRequest):
+    """Register devices to a participant; their readings are attributed to it from now on
+    
+    A device registered to another participant is moved. Its readings are
+    batched in the participant's partition (with its DID once issued).
+    """
+    if not supabase:
+        raise HTTPException(status_code=503, detail="Database not available")
+    moved = {}
+    try:
+        for device_id in request.device_ids:
+            previous = device_registry.register(supabase, device_id, participant_id, request.label)
+            if previous is not None and previous.participant_id != participant_id:
+                moved[device_id] = previous.participant_id
+    except UnknownParticipant:
+        raise HTTPException(status_code=404, detail="Participant not found")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error registering devices: {str(e)}")
+    await cluster.notify_peers("/api/devices/registry/invalidate", {"device_ids": request.device_ids})
+    print(f"📇 Registered {len(request.device_ids)} device(s) to participant {participant_id}")
+    return {
+        "participant_id": participant_id,
+        "participant_did": device_registry.participants.get(participant_id),
+        "device_ids": device_registry.devices_of(participant_id),
+        "moved_from": moved
+    }
+
+@app.get("/api/participants/{participant_id}/devices")
+async def get_participant_devices(participant_id: str):
+    """Devices registered to a participant (served from memory)"""
+    if participant_id not in device_registry.participants:
+        raise HTTPException(status_code=404, detail="Participant not found")
+    return {
+        "participant_id": participant_id,
+        "participant_did": device_registry.participants[participant_id],
+        "device_ids": device_registry.devices_of(participant_id)
+    }
+
 @app.get("/api/participants/list")
 async def list_participants():
     """List all registered participants"""
@@ -681,9 +1088,25 @@ async def list_participants():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error listing participants: {str(e)}")
 
+# Anchored proofs never change: (ETag, body) per batch_id
+proof_cache = LRUCache.from_env("PROOF_CACHE_SIZE", 4096)
+proof_bundle_cache = LRUCache.from_env("PROOF_BUNDLE_CACHE_SIZE", 64)
+
+def proof_etag(data_hash: str, variant: str) -> str:
+    return f'"{variant}-{data_hash}"'
+
 @app.get("/api/proofs/{batch_id}")
-async def get_proof_by_batch_id(batch_id: str):
-    """Get Hedera proof for a specific batch"""
+async def get_proof_by_batch_id(batch_id: str, request: Request):
+    """Get Hedera proof for a specific batch
+    
+    Served from an in-process LRU cache after the first request, with
+    Cache-Control: immutable and an ETag for If-None-Match.
+    """
+    cached = proof_cache.get(batch_id)
+    if cached is not None:
+        etag, body = cached
+        return cached_response(request, etag, lambda: body, IMMUTABLE_CACHE_CONTROL)
+
     if not supabase:
         raise HTTPException(status_code=503, detail="Database not available")
     
@@ -696,25 +1119,67 @@ async def get_proof_by_batch_id(batch_id: str):
         
         proof = proof_result.data[0]
         
-        # Get batch contents
-        contents_result = supabase.table("batch_contents").select("*").eq("batch_id", batch_id).execute()
+        # Count batch contents
+        contents_result = supabase.table("batch_contents").select("batch_position", count="exact").eq("batch_id", batch_id).execute()
+        reading_count = contents_result.count
         
-        return {
+        body = json.dumps({
             "batch_id": proof["batch_id"],
             "hcs_transaction_id": proof["hcs_transaction_id"],
             "consensus_timestamp": proof["consensus_timestamp"],
             "data_hash": proof["data_hash"],
             "batch_metadata": proof["batch_metadata"],
             "created_at": proof["created_at"],
-            "reading_count": len(contents_result.data),
+            "reading_count": reading_count,
             "verification_url": f"https://hashscan.io/testnet/transaction/{proof['hcs_transaction_id']}"
-        }
+        }).encode("utf-8")
         
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving proof: {str(e)}")
 
+    etag = proof_etag(proof["data_hash"], "proof")
+    # The anchor row is written before its batch contents; cache only the complete proof
+    if reading_count == (proof["batch_metadata"] or {}).get("reading_count", reading_count):
+        proof_cache.put(batch_id, (etag, body))
+        return cached_response(request, etag, lambda: body, IMMUTABLE_CACHE_CONTROL)
+    return Response(content=body, media_type="application/json", headers={"Cache-Control": "no-store"})
+
+@app.get("/api/proofs/{batch_id}/bundle")
+async def get_proof_bundle(batch_id: str, request: Request):
+    """Download a self-contained proof bundle for offline verification
+    
+    Holds the compressed batch and its readings, the hash inputs, data_hash,
+    the HCS transaction ID and consensus timestamp, and the message published
+    on the topic (when indexed). Check bundles with verify_bundles.py.
+    """
+    headers = {"Content-Disposition": f'attachment; filename="{bundle_filename(batch_id)}"'}
+    cached = proof_bundle_cache.get(batch_id)
+    if cached is not None:
+        etag, body = cached
+        return cached_response(request, etag, lambda: body, IMMUTABLE_CACHE_CONTROL, headers)
+
+    if not supabase:
+        raise HTTPException(status_code=503, detail="Database not available")
+    message_lookup = topic_sync.index.lookup_batch if topic_sync else None
+    try:
+        bundle = await run_in_threadpool(
+            load_bundle, supabase, batch_id, message_lookup, os.getenv("HEDERA_TOPIC_ID")
+        )
+    except BundleNotFound:
+        raise HTTPException(status_code=404, detail="Proof not found")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error building proof bundle: {str(e)}")
+    body = json.dumps(bundle).encode("utf-8")
+    # Until the topic index has the HCS message (and all readings are stored) the bundle is incomplete
+    reading_count = bundle["batch_metadata"].get("reading_count", len(bundle["readings"]))
+    if bundle["hcs"]["message"] is None or reading_count != len(bundle["readings"]):
+        return Response(content=body, media_type="application/json", headers={**headers, "Cache-Control": "no-store"})
+    etag = proof_etag(bundle["data_hash"], "bundle")
+    proof_bundle_cache.put(batch_id, (etag, body))
+    return cached_response(request, etag, lambda: body, IMMUTABLE_CACHE_CONTROL, headers)
+
 @app.get("/api/proofs/verify/{transaction_id}")
 async def verify_proof_by_transaction_id(transaction_id: str):
     """Verify a proof exists on Hedera by transaction ID"""
@@ -726,6 +1191,20 @@ async def verify_proof_by_transaction_id(transaction_id: str):
             if result.data:
                 proof = result.data[0]
                 
+                # Compare with the message indexed from the HCS topic when it has been synced
+                message = topic_sync.index.lookup_batch(proof["batch_id"]) if topic_sync else None
+                if message is not None:
+                    return {
+                        "transaction_id": transaction_id,
+                        "batch_id": proof["batch_id"],
+                        "data_hash": proof["data_hash"],
+                        "consensus_timestamp": message["consensus_timestamp"],
+                        "topic_sequence_number": message["sequence_number"],
+                        "verified": message["data_hash"] == proof["data_hash"],
+                        "verification_source": "topic_index",
+                        "verification_url": f"https://hashscan.io/testnet/transaction/{transaction_id}"
+                    }
+                
                 # Verify with Hedera service
                 is_valid = await hedera_service.verify_proof(proof["data_hash"], transaction_id)
                 
@@ -735,6 +1214,7 @@ async def verify_proof_by_transaction_id(transaction_id: str):
                     "data_hash": proof["data_hash"],
                     "consensus_timestamp": proof["consensus_timestamp"],
                     "verified": is_valid,
+                    "verification_source": "hedera_service",
                     "verification_url": f"https://hashscan.io/testnet/transaction/{transaction_id}"
                 }
         
@@ -751,6 +1231,33 @@ async def verify_proof_by_transaction_id(transaction_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error verifying proof: {str(e)}")
 
+@app.post("/api/batching/partitions")
+async def configure_batch_partition(request: BatchPartitionRequest):
+    """Assign devices to a batching partition and set its size/age limits"""
+    batch_processor.configure_partition(
+        request.partition_key,
+        max_batch_size=request.max_batch_size,
+        max_batch_age_minutes=request.max_batch_age_minutes
+    )
+    for device_id in request.device_ids:
+        batch_processor.assign_device(device_id, request.partition_key, request.participant_did)
+    
+    return {
+        "status": "success",
+        "partition_key": request.partition_key,
+        "device_ids": request.device_ids
+    }
+
+@app.get("/api/batching/partitions")
+async def get_batch_partitions():
+    """Get open batch state per partition"""
+    return batch_processor.stats()
+
+@app.get("/api/batching/controller")
+async def get_batch_controller_stats():
+    """Get the adaptive batch controller's targets, measurements and decisions"""
+    return batch_controller.stats()
+
 @app.get("/api/proofs/list")
 async def list_proofs(limit: int = 50):
     """List recent Hedera proofs"""
@@ -779,6 +1286,31 @@ async def list_proofs(limit: int = 50):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error listing proofs: {str(e)}")
 
+@app.get("/api/export/{dataset}")
+async def export_dataset(dataset: str, start: datetime, end: Optional[datetime] = None, device_id: Optional[str] = None,
+                         format: str = FORMAT_CSV, with_proofs: bool = False):
+    """Stream readings, proofs or batch contents in a time range as CSV or Parquet
+    
+    Rows are fetched and written one page at a time, so exports of any size
+    run in constant memory. with_proofs adds the batch_id and
+    hcs_transaction_id anchoring each reading.
+    """
+    if not supabase:
+        raise HTTPException(status_code=503, detail="Database not available")
+    end = end or datetime.now()
+    try:
+        chunks = export_chunks(supabase, dataset, format, start, end, device_id, with_proofs)
+    except ExportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    filename = f"{dataset}_{start:%Y%m%dT%H%M%S}_{end:%Y%m%dT%H%M%S}.{format}"
+    print(f"📤 Exporting {dataset} ({format}) from {start.isoformat()} to {end.isoformat()}")
+    # A sync iterator: Starlette pulls each chunk (and its Supabase query) in the threadpool
+    return StreamingResponse(
+        chunks,
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     """WebSocket endpoint for real-time data"""
@@ -786,15 +1318,340 @@ async def websocket_endpoint(websocket: WebSocket):
     try:
         while True:
             # Send latest readings every 5 seconds
-            if latest_readings:
+            snapshot = await cluster.merged_latest(latest_readings_snapshot())
+            if snapshot:
                 await websocket.send_text(json.dumps({
                     "type": "latest_readings",
-                    "data": latest_readings
+                    "data": snapshot
                 }))
             await asyncio.sleep(5)
     except WebSocketDisconnect:
         manager.disconnect(websocket)
 
+@app.get("/api/events/stream")
+async def stream_events(request: Request, device_id: Optional[str] = None, types: Optional[str] = None,
+                        last_event_id: Optional[str] = None):
+    """Server-Sent Events stream of readings and device events
+    
+    Reconnecting clients send Last-Event-ID (or ?last_event_id=) and get
+    every event they missed replayed from the event log first. device_id and
+    types take comma-separated filters.
+    """
+    resume_from = request.headers.get("last-event-id") or last_event_id
+    device_ids = set(device_id.split(",")) if device_id else None
+    event_types = set(types.split(",")) if types else None
+    return StreamingResponse(
+        event_log.stream(resume_from, device_ids, event_types),
+        media_type="text/event-stream",
+        headers={
+            # Proxies and CDNs must neither cache nor buffer the stream
+            "Cache-Control": "no-cache, no-transform",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+@app.get("/api/events/stats")
+async def get_event_log_stats():
+    """Get the SSE event log range and subscriber count"""
+    return event_log.stats()
+
+async def ingest_device_readings(readings: List[EnergyReading]) -> None:
+    """Feed readings from the device WebSocket into the normal ingest pipeline"""
+    if shutdown.draining:
+        raise AdmissionRejected(AdmissionDecision(False, float(shutdown.retry_after_seconds), "shutting down"))
+    with profiler.trace("ws /ws/devices"):
+        readings, _, _ = await route_readings(readings, None, datetime.now().strftime("%H:%M:%S"))
+        if not readings:
+            return
+        try:
+            await process_readings(readings, datetime.now().strftime("%H:%M:%S"))
+        finally:
+            admission.release(len(readings))
+
+device_channel = DeviceChannel(ingest_device_readings)
+
+@app.websocket("/ws/devices")
+async def device_websocket_endpoint(websocket: WebSocket):
+    """Persistent ingest channel for ESP32 devices (see device_channel.py)"""
+    await device_channel.serve(websocket)
+
+@app.get("/api/cluster")
+async def get_cluster_status():
+    """Get this node's cluster membership and forwarding counters"""
+    return {**cluster.stats(), "local_devices": len(latest_readings)}
+
+@app.get("/api/cluster/owner/{device_id}")
+async def get_device_owner(device_id: str):
+    """Get the cluster node owning a device"""
+    owner = cluster.owner(device_id)
+    return {"device_id": device_id, "node_id": owner, "url": cluster.nodes.get(owner), "local": cluster.is_local(device_id)}
+
+@app.get("/api/admission/stats")
+async def get_admission_stats():
+    """Get ingest admission counters, queue depths and the most throttled devices"""
+    return admission.stats()
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """Get proof cache hit rates and the readings snapshot version"""
+    return {
+        "readings_snapshot_version": readings_snapshot.version,
+        "proofs": proof_cache.stats(),
+        "proof_bundles": proof_bundle_cache.stats()
+    }
+
+@app.get("/api/dedup/stats")
+async def get_dedup_stats():
+    """Get counts of retried readings dropped as duplicates"""
+    return dedup_index.stats()
+
+@app.get("/api/screening/stats")
+async def get_screening_stats():
+    """Get anomaly screening counters per quality flag"""
+    return screener.stats()
+
+@app.get("/api/screening/quarantine")
+async def get_quarantined_readings(limit: int = 100):
+    """Get the most recent quarantined readings with their quality flags"""
+    return {"readings": screener.recent_quarantine(min(limit, 1000))}
+
+@app.get("/api/devices/liveness")
+async def get_device_liveness():
+    """Get online state, last seen time and offline timeout per device"""
+    return {**liveness.counts(), "devices": liveness.snapshot()}
+
+@app.post("/api/devices/{device_id}/liveness")
+async def configure_device_liveness(device_id: str, request: DeviceLivenessRequest):
+    """Set how long a device may stay silent before it is reported offline"""
+    liveness.set_timeout(device_id, request.timeout_seconds)
+    print(f"⏱️ Device {device_id} offline timeout set to {request.timeout_seconds}s")
+    return {"device_id": device_id, "timeout_seconds": request.timeout_seconds}
+
+@app.get("/api/devices/{device_id}/participant")
+async def get_device_participant(device_id: str):
+    """Participant and DID a device's readings are attributed to"""
+    attribution = device_registry.attribution(device_id)
+    if attribution is None:
+        raise HTTPException(status_code=404, detail="Device not registered")
+    return asdict(attribution)
+
+@app.delete("/api/devices/{device_id}/participant")
+async def unregister_device(device_id: str):
+    """Stop attributing a device's readings to its participant"""
+    if not supabase:
+        raise HTTPException(status_code=503, detail="Database not available")
+    try:
+        previous = device_registry.unregister(supabase, device_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error unregistering device: {str(e)}")
+    if previous is None:
+        raise HTTPException(status_code=404, detail="Device not registered")
+    await cluster.notify_peers("/api/devices/registry/invalidate", {"device_ids": [device_id]})
+    return {"status": "success", "device_id": device_id, "participant_id": previous.participant_id}
+
+@app.post("/api/devices/registry/invalidate")
+async def invalidate_device_registry(request: RegistryInvalidationRequest):
+    """Reload changed registry rows (sent by the cluster node that changed them)"""
+    if not supabase:
+        raise HTTPException(status_code=503, detail="Database not available")
+    for participant_id in request.participant_ids:
+        await run_in_threadpool(device_registry.refresh_participant, supabase, participant_id)
+    for device_id in request.device_ids:
+        await run_in_threadpool(device_registry.refresh_device, supabase, device_id)
+    return {"status": "success", "devices": len(request.device_ids), "participants": len(request.participant_ids)}
+
+@app.get("/api/devices/registry/stats")
+async def get_device_registry_stats():
+    """Get device registry index sizes"""
+    return device_registry.stats()
+
+@app.get("/api/devices/sessions")
+async def get_device_sessions():
+    """Get WebSocket ingest session state per device"""
+    return device_channel.store.stats()
+
+audit_job = AuditJob(
+    checkpoint_path=os.getenv("AUDIT_CHECKPOINT_PATH", ".audit_checkpoint.json"),
+    report_path=os.getenv("AUDIT_REPORT_PATH")
+)
+
+@app.post("/api/audit/run")
+async def run_audit(resume: bool = True):
+    """Start a background audit that recomputes every anchored batch hash"""
+    if not supabase:
+        raise HTTPException(status_code=503, detail="Supabase not configured")
+    message_lookup = topic_sync.index.lookup_batch if topic_sync else None
+    if not audit_job.start(supabase, message_lookup=message_lookup, resume=resume):
+        raise HTTPException(status_code=409, detail="Audit already running")
+    print(f"🔍 Batch hash audit started (resume={resume})")
+    return {"status": "started", "resume": resume}
+
+@app.get("/api/audit/status")
+async def get_audit_status():
+    """Get progress of the running audit and the last signed report"""
+    return audit_job.status()
+
+@app.post("/api/hcs/topic-index/sync")
+async def sync_topic_index():
+    """Pull new messages from the HCS topic into the local index now"""
+    if topic_sync is None:
+        raise HTTPException(status_code=503, detail="HEDERA_TOPIC_ID not configured")
+    try:
+        indexed = await topic_sync.sync_once()
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Topic sync failed: {str(e)}")
+    return {"indexed": indexed, **topic_sync.stats()}
+
+@app.get("/api/hcs/topic-index/stats")
+async def get_topic_index_stats():
+    """Get the local topic index size and sync cursor"""
+    if topic_sync is None:
+        return {"configured": False}
+    return {"configured": True, **topic_sync.stats()}
+
+@app.get("/api/guardian/submissions")
+async def list_guardian_submissions(status: Optional[str] = None, limit: int = 50):
+    """List Guardian energy-data submissions, optionally by status"""
+    if not supabase:
+        raise HTTPException(status_code=503, detail="Database not available")
+    query = supabase.table("guardian_submissions").select("*")
+    if status:
+        query = query.eq("submission_status", status)
+    result = query.order("submitted_at", desc=True).limit(min(limit, 500)).execute()
+    return {"submissions": result.data, "total": len(result.data)}
+
+@app.get("/api/guardian/submissions/stats")
+async def get_guardian_submission_stats():
+    """Get Guardian submission counts per status and worker counters"""
+    if guardian_worker is None:
+        raise HTTPException(status_code=503, detail="Database not available")
+    counts = await run_in_threadpool(guardian_worker.status_counts)
+    return {"status_counts": counts, **guardian_worker.stats()}
+
+@app.post("/api/guardian/submissions/retry-failed")
+async def retry_failed_guardian_submissions():
+    """Queue every failed Guardian submission for another round of attempts"""
+    if guardian_worker is None:
+        raise HTTPException(status_code=503, detail="Database not available")
+    result = supabase.table("guardian_submissions").update({
+        "submission_status": SubmissionStatus.PENDING.value,
+        "attempts": 0,
+        "next_attempt_at": utc_now().isoformat(),
+        "updated_at": utc_now().isoformat()
+    }).eq("submission_status", SubmissionStatus.FAILED.value).execute()
+    guardian_worker.notify()
+    print(f"🔁 Requeued {len(result.data)} failed Guardian submission(s)")
+    return {"requeued": len(result.data)}
+
+@app.get("/debug/profile")
+async def get_profile(slow_limit: int = 20):
+    """Get per-stage ingest latency histograms and the slowest sampled request traces"""
+    return profiler.snapshot(min(slow_limit, 100))
+
+@app.post("/debug/profile")
+async def configure_profiling(request: ProfilingRequest):
+    """Turn ingest stage profiling on or off, optionally clearing collected data"""
+    profiler.set_enabled(request.enabled)
+    if request.reset:
+        profiler.reset()
+    print(f"⏱️ Ingest profiling {'enabled' if request.enabled else 'disabled'}")
+    return {"enabled": profiler.enabled}
+
+@app.post("/debug/profile/capture")
+async def start_profile_capture(request: ProfileCaptureRequest):
+    """Capture a cProfile or sampling profile of the server for the given number of seconds"""
+    if not profiler.start_capture(request.seconds, request.mode):
+        raise HTTPException(status_code=409, detail="A profile capture is already running")
+    print(f"⏱️ {request.mode} capture started for {request.seconds}s")
+    return profiler.capture_status()
+
+@app.get("/debug/profile/capture")
+async def get_profile_capture():
+    """Get the running or last profile capture, including its result once finished"""
+    if profiler.capture_state is None:
+        raise HTTPException(status_code=404, detail="No profile capture has been run")
+    return profiler.capture_state
+
+def drain_steps(liveness_task: asyncio.Task, batch_control_task: asyncio.Task, guardian_task: Optional[asyncio.Task],
+                topic_sync_task: Optional[asyncio.Task]) -> List[Tuple[str, Any]]:
+    """Ordered shutdown steps: finish ingest, seal and submit batches, flush queues, close clients"""
+
+    async def stop_mock():
+        if mock_data_thread is not None and mock_data_thread.is_alive():
+            await asyncio.to_thread(mock_data_thread.join)
+        return {}
+
+    async def finish_ingest():
+        # Device WebSocket frames being processed when the signal arrived
+        await wait_until(lambda: admission.in_flight == 0)
+        return {}
+
+    async def seal_batches():
+        pending = batch_processor.pending_count
+        current_time = datetime.now().strftime("%H:%M:%S")
+        results = await batch_processor.process_all_batches()
+        for hedera_result in results:
+            handle_batch_result(hedera_result, current_time)
+        submitted = [r for r in results if r.success]
+        return {
+            "pending_readings": pending,
+            "batches_submitted": len(submitted),
+            "batches_failed": len(results) - len(submitted),
+            # Stored in Supabase but not anchored; backfill.py anchors them later
+            "unanchored_readings": pending - sum(len(r.batch.readings) for r in submitted)
+        }
+
+    async def finish_hcs_submissions():
+        await wait_until(lambda: batch_processor.in_flight_submissions == 0)
+        return {}
+
+    async def flush_guardian_queue():
+        if guardian_worker is None:
+            return {}
+        # Let the submission in progress finish, then submit what the last batches queued
+        await wait_until(lambda: guardian_worker.in_flight == 0)
+        guardian_task.cancel()
+        return {"submitted": await guardian_worker.run_once()}
+
+    async def flush_broadcasts():
+        await wait_until(lambda: manager.pending_sends == 0)
+        connections = manager.active_connections[:]
+        for connection in connections:
+            try:
+                await connection.close(code=1001)
+            except Exception:
+                pass
+            manager.disconnect(connection)
+        return {"websockets_closed": len(connections)}
+
+    async def stop_background_tasks():
+        tasks = [task for task in (liveness_task, batch_control_task, guardian_task, topic_sync_task) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if topic_sync is not None:
+            topic_sync.index.close()
+        return {"cancelled": len(tasks)}
+
+    async def close_clients():
+        await hedera_service.close()
+        await guardian_service.close()
+        await cluster.close()
+        if topic_sync is not None:
+            await topic_sync.source.close()
+        return {}
+
+    return [
+        ("stop_mock_stream", stop_mock),
+        ("finish_ingest", finish_ingest),
+        ("seal_batches", seal_batches),
+        ("finish_hcs_submissions", finish_hcs_submissions),
+        ("flush_guardian_queue", flush_guardian_queue),
+        ("flush_broadcasts", flush_broadcasts),
+        ("stop_background_tasks", stop_background_tasks),
+        ("close_clients", close_clients)
+    ]
+
 # Dashboard HTML is imported from dashboard_content.py
 
 if __name__ == "__main__":
@@ -805,4 +1662,11 @@ if __name__ == "__main__":
     print(f"🔌 ESP32 endpoint: http://localhost:{port}/api/energy-data")
     print(f"📋 Supabase stats: http://localhost:{port}/api/supabase-stats")
     # Bind to all interfaces so both localhost and ESP32 can connect
-    uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
+    config = uvicorn.Config(
+        app,
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=port,
+        # Bounds waiting for open requests; the drain itself is bounded by SHUTDOWN_DEADLINE_SECONDS
+        timeout_graceful_shutdown=shutdown.deadline_seconds
+    )
+    GracefulServer(config, shutdown).run()
\ No newline at end of file
@@ -0,0 +1,124 @@
+"""Versioned database migrations
+
+Each migration runs once, in order, through the ``exec_sql`` RPC together with
+the insert that records it in ``schema_migrations``. Checking whether the
+schema is current costs a single SELECT, so a cold start against an
+up-to-date database does no DDL at all.
+
+Run pending migrations manually with ``python migrations.py``; the app also
+applies them at startup unless ``AUTO_MIGRATE=false``.
+"""
+import logging
+import sys
+from dataclasses import dataclass
+from typing import List, Optional
+
+from database_models import DATABASE_SCHEMA
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    sql: str
+
+MIGRATIONS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    applied_at TIMESTAMP DEFAULT NOW()
+);
+"""
+
+READING_QUALITY_FLAGS_SQL = """
+ALTER TABLE IF EXISTS energy_readings ADD COLUMN IF NOT EXISTS quality_flags INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE IF EXISTS energy_readings ADD COLUMN IF NOT EXISTS quarantined BOOLEAN NOT NULL DEFAULT FALSE;
+"""
+
+GUARDIAN_SUBMISSION_QUEUE_SQL = """
+ALTER TABLE IF EXISTS guardian_submissions ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE IF EXISTS guardian_submissions ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMP NOT NULL DEFAULT NOW();
+ALTER TABLE IF EXISTS guardian_submissions ADD COLUMN IF NOT EXISTS last_error TEXT;
+ALTER TABLE IF EXISTS guardian_submissions ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT NOW();
+CREATE INDEX IF NOT EXISTS idx_guardian_submissions_due ON guardian_submissions(submission_status, next_attempt_at);
+"""
+
+DEVICE_REGISTRY_SQL = """
+CREATE TABLE IF NOT EXISTS devices (
+    device_id VARCHAR(255) PRIMARY KEY,
+    participant_id UUID NOT NULL REFERENCES guardian_participants(id) ON DELETE CASCADE,
+    label VARCHAR(255),
+    registered_at TIMESTAMP DEFAULT NOW(),
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_devices_participant_id ON devices(participant_id);
+ALTER TABLE IF EXISTS energy_readings ADD COLUMN IF NOT EXISTS participant_id UUID;
+CREATE INDEX IF NOT EXISTS idx_energy_readings_participant_id ON energy_readings(participant_id);
+"""
+
+# Scheduling columns compared against the app's clock: stored in UTC so due-ness
+# does not depend on the database session or app host timezone (existing values
+# were written by NOW() in the session timezone, UTC on Supabase)
+GUARDIAN_QUEUE_UTC_SQL = """
+ALTER TABLE IF EXISTS guardian_submissions
+    ALTER COLUMN next_attempt_at TYPE TIMESTAMPTZ USING next_attempt_at AT TIME ZONE 'UTC',
+    ALTER COLUMN updated_at TYPE TIMESTAMPTZ USING updated_at AT TIME ZONE 'UTC';
+"""
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "initial_schema", DATABASE_SCHEMA),
+    Migration(2, "reading_quality_flags", READING_QUALITY_FLAGS_SQL),
+    Migration(3, "guardian_submission_queue", GUARDIAN_SUBMISSION_QUEUE_SQL),
+    Migration(4, "device_registry", DEVICE_REGISTRY_SQL),
+    Migration(5, "guardian_queue_utc", GUARDIAN_QUEUE_UTC_SQL),
+]
+
+def latest_version() -> int:
+    return MIGRATIONS[-1].version if MIGRATIONS else 0
+
+def current_version(client) -> int:
+    """Highest applied migration version, or 0 if none have been recorded"""
+    try:
+        result = client.table("schema_migrations").select("version").order("version", desc=True).limit(1).execute()
+    except Exception as e:
+        # Table does not exist yet on a fresh (or pre-migration) database
+        logger.info(f"schema_migrations not readable, assuming version 0: {e}")
+        return 0
+    return result.data[0]["version"] if result.data else 0
+
+def pending_migrations(version: int) -> List[Migration]:
+    return [m for m in MIGRATIONS if m.version > version]
+
+def apply_migrations(client, target: Optional[int] = None) -> List[int]:
+    """Apply every pending migration up to ``target``; return the versions applied"""
+    target = latest_version() if target is None else target
+    version = current_version(client)
+    if version >= target:
+        logger.info(f"✅ Database schema current (version {version})")
+        return []
+
+    applied = []
+    for migration in pending_migrations(version):
+        if migration.version > target:
+            break
+        sql = (
+            MIGRATIONS_TABLE_SQL
+            + migration.sql
+            + f"\nINSERT INTO schema_migrations (version, name) VALUES ({migration.version}, '{migration.name}')"
+            + " ON CONFLICT (version) DO NOTHING;\n"
+        )
+        client.rpc('exec_sql', {'sql': sql}).execute()
+        applied.append(migration.version)
+        logger.info(f"✅ Applied migration {migration.version}: {migration.name}")
+    return applied
+
+if __name__ == "__main__":
+    from database import get_supabase
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    client = get_supabase()
+    if client is None:
+        sys.exit("Supabase not configured")
+    applied = apply_migrations(client)
+    print(f"Applied migrations: {applied}" if applied else "Schema already up to date")
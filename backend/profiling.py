@@ -0,0 +1,293 @@
+"""Opt-in stage profiling of the ingest pipeline
+
+``profiler.span(stage)`` times one pipeline stage. When profiling is off it
+returns a shared no-op context manager, so instrumented code pays one
+attribute check. When it is on, every span feeds a per-stage log-bucket
+histogram, and spans that run inside ``profiler.trace(name)`` (one ingest
+request or device frame) are also appended to that trace. Traces slower than
+the slow threshold are sampled into a bounded buffer.
+
+``profiler.start_capture(seconds, mode)`` records a cProfile of the event loop
+thread or a statistical stack profile (sampled ``sys._current_frames``) for
+a fixed time, independently of the span instrumentation.
+"""
+import asyncio
+import contextvars
+import cProfile
+import io
+import math
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+
+CAPTURE_CPROFILE = "cprofile"
+CAPTURE_SAMPLING = "sampling"
+
+# Histogram buckets grow by 2**(1/4) (~19%) from 1 µs up to ~2 minutes
+_BUCKETS_PER_OCTAVE = 4
+_BUCKET_COUNT = 27 * _BUCKETS_PER_OCTAVE
+_BUCKET_BASE = 1e-6
+
+class Histogram:
+    __slots__ = ("buckets", "count", "total", "max")
+
+    def __init__(self):
+        self.buckets = [0] * (_BUCKET_COUNT + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        if seconds > _BUCKET_BASE:
+            index = min(int(math.log2(seconds / _BUCKET_BASE) * _BUCKETS_PER_OCTAVE), _BUCKET_COUNT)
+        else:
+            index = 0
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction: float) -> float:
+        """Upper bound (seconds) of the bucket holding the given fraction of samples"""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(_BUCKET_BASE * 2 ** ((index + 1) / _BUCKETS_PER_OCTAVE), self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "total_ms": round(self.total * 1000, 3),
+            "mean_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            "p50_ms": round(self.percentile(0.5) * 1000, 3),
+            "p90_ms": round(self.percentile(0.9) * 1000, 3),
+            "p99_ms": round(self.percentile(0.99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3)
+        }
+
+@dataclass
+class Trace:
+    name: str
+    started: float
+    started_at: datetime
+    spans: List[tuple] = field(default_factory=list)
+
+    def to_dict(self, duration: float) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round(duration * 1000, 3),
+            "spans": [
+                {"stage": stage, "offset_ms": round((started - self.started) * 1000, 3), "duration_ms": round(elapsed * 1000, 3)}
+                for stage, started, elapsed in self.spans
+            ]
+        }
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NOOP = _NoopSpan()
+
+class _Span:
+    __slots__ = ("profiler", "stage", "started")
+
+    def __init__(self, profiler: "Profiler", stage: str):
+        self.profiler = profiler
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.stage, self.started, time.perf_counter() - self.started)
+        return False
+
+class _TraceScope:
+    __slots__ = ("profiler", "trace", "token")
+
+    def __init__(self, profiler: "Profiler", name: str):
+        self.profiler = profiler
+        self.trace = Trace(name, time.perf_counter(), datetime.now())
+
+    def __enter__(self):
+        self.token = _current_trace.set(self.trace)
+        return self.trace
+
+    def __exit__(self, *exc_info):
+        _current_trace.reset(self.token)
+        self.profiler.finish(self.trace, time.perf_counter() - self.trace.started)
+        return False
+
+# Spans in tasks spawned from a traced request see the same trace object
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("profiling_trace", default=None)
+
+class Profiler:
+    def __init__(self, enabled: bool = False, slow_threshold_ms: float = 250.0,
+                 slow_sample_rate: float = 1.0, slow_trace_limit: int = 100):
+        self.enabled = enabled
+        self.slow_threshold = slow_threshold_ms / 1000
+        self.slow_sample_rate = slow_sample_rate
+        self.stages: Dict[str, Histogram] = {}
+        self.requests: Dict[str, Histogram] = {}
+        self.slow_traces: Deque[Dict[str, Any]] = deque(maxlen=slow_trace_limit)
+        self.enabled_at: Optional[datetime] = datetime.now() if enabled else None
+        # Spans may also be recorded from the mock data thread
+        self._lock = threading.Lock()
+        self.capture_state: Optional[Dict[str, Any]] = None
+        self._capture_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls) -> "Profiler":
+        return cls(
+            enabled=os.getenv("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes"),
+            slow_threshold_ms=float(os.getenv("PROFILING_SLOW_MS", "250")),
+            slow_sample_rate=float(os.getenv("PROFILING_SLOW_SAMPLE_RATE", "1.0"))
+        )
+
+    def set_enabled(self, enabled: bool) -> None:
+        if enabled and not self.enabled:
+            self.enabled_at = datetime.now()
+        self.enabled = enabled
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stages.clear()
+            self.requests.clear()
+            self.slow_traces.clear()
+
+    def span(self, stage: str):
+        """Context manager timing one stage; a no-op while profiling is disabled"""
+        if not self.enabled:
+            return _NOOP
+        return _Span(self, stage)
+
+    def trace(self, name: str):
+        """Context manager collecting the spans of one request"""
+        if not self.enabled:
+            return _NOOP
+        return _TraceScope(self, name)
+
+    def record(self, stage: str, started: float, elapsed: float) -> None:
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.add(elapsed)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.spans.append((stage, started, elapsed))
+
+    def finish(self, trace: Trace, duration: float) -> None:
+        with self._lock:
+            histogram = self.requests.get(trace.name)
+            if histogram is None:
+                histogram = self.requests[trace.name] = Histogram()
+            histogram.add(duration)
+            if duration >= self.slow_threshold and random.random() < self.slow_sample_rate:
+                self.slow_traces.append(trace.to_dict(duration))
+
+    def snapshot(self, slow_limit: int = 20) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "enabled_at": self.enabled_at.isoformat() if self.enabled_at else None,
+                "slow_threshold_ms": self.slow_threshold * 1000,
+                "slow_sample_rate": self.slow_sample_rate,
+                "requests": {name: h.summary() for name, h in self.requests.items()},
+                "stages": {stage: h.summary() for stage, h in self.stages.items()},
+                "slow_traces": list(self.slow_traces)[-slow_limit:][::-1],
+                "capture": self.capture_status()
+            }
+
+    @property
+    def capturing(self) -> bool:
+        return self._capture_task is not None and not self._capture_task.done()
+
+    def capture_status(self) -> Optional[Dict[str, Any]]:
+        """State of the running or last capture, without its (possibly large) result"""
+        if self.capture_state is None:
+            return None
+        return {key: value for key, value in self.capture_state.items() if key != "result"}
+
+    def start_capture(self, seconds: float, mode: str = CAPTURE_CPROFILE, interval: float = 0.005) -> bool:
+        """Start a profile capture of the running event loop; False if one is in progress"""
+        if self.capturing:
+            return False
+        self.capture_state = {
+            "mode": mode,
+            "seconds": seconds,
+            "started_at": datetime.now().isoformat(),
+            "finished_at": None,
+            "running": True
+        }
+        self._capture_task = asyncio.create_task(self._capture(seconds, mode, interval))
+        return True
+
+    async def _capture(self, seconds: float, mode: str, interval: float) -> None:
+        try:
+            if mode == CAPTURE_CPROFILE:
+                result = await self._capture_cprofile(seconds)
+            else:
+                result = await asyncio.to_thread(self._sample_stacks, threading.get_ident(), seconds, interval)
+        except Exception as e:
+            result = {"error": str(e)}
+        self.capture_state.update(result=result, running=False, finished_at=datetime.now().isoformat())
+
+    @staticmethod
+    async def _capture_cprofile(seconds: float, limit: int = 60) -> Dict[str, Any]:
+        # cProfile hooks the calling thread: the event loop running the ingest handlers
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profile.disable()
+        stream = io.StringIO()
+        pstats.Stats(profile, stream=stream).sort_stats("cumulative").print_stats(limit)
+        return {"stats": stream.getvalue()}
+
+    @staticmethod
+    def _sample_stacks(thread_id: int, seconds: float, interval: float, limit: int = 50) -> Dict[str, Any]:
+        stacks: Counter = Counter()
+        samples = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                stacks[";".join(reversed(stack))] += 1
+                samples += 1
+            time.sleep(interval)
+        return {
+            "samples": samples,
+            "interval_ms": interval * 1000,
+            # Folded stacks (root first), the input format of flamegraph tools
+            "stacks": [{"stack": stack, "samples": count} for stack, count in stacks.most_common(limit)]
+        }
+
+# Global instance
+profiler = Profiler.from_env()
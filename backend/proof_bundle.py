@@ -0,0 +1,167 @@
+"""Self-contained proof bundles of anchored batches
+
+A bundle is one JSON document with everything needed to verify a batch
+offline (``verify_bundles.py``)::
+
+    format, version            "verifiedcc-proof-bundle", 1
+    batch_id, data_hash        as in proof_anchors
+    hash_scheme                scheme data_hash was computed with
+    hash_input                 "decompressed": SHA-256 over the canonical bytes
+                               "compressed": SHA-256 over compressed_batch
+                               (the gzip hash schemes)
+    encoding                   "columnar-v1" (batch_encoding) or "json"
+    codec, compressed_batch    canonical bytes compressed with a batch codec,
+                               base64
+    readings                   the batch readings in batch order
+    batch_metadata             proof_anchors.batch_metadata
+    hcs                        transaction_id, consensus_timestamp and topic_id
+                               of the anchor, plus the message published on
+                               the topic (from the local topic index) with its
+                               consensus timestamp and sequence number
+
+Usage (writes one bundle per anchored batch)::
+
+    python proof_bundle.py --out bundles/ --topic-index topic_index.sqlite3
+"""
+import argparse
+import base64
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from audit import iter_proof_anchors, load_batch_records, recompute_batch_hash
+from batch_codecs import DEFAULT_CODEC_ID, get_codec, gzip_member
+from batch_encoding import encode_records
+from database import get_supabase
+from hedera_service import (
+    HASH_SCHEME_COLUMNAR,
+    HASH_SCHEME_JSON_GZIP,
+    HASH_SCHEME_JSON_SHA256,
+    serialize_batch_records,
+)
+from topic_index import TopicIndex
+from verify_bundles import (
+    BUNDLE_FORMAT,
+    BUNDLE_VERSION,
+    ENCODING_COLUMNAR,
+    ENCODING_JSON,
+    HASH_INPUT_COMPRESSED,
+    HASH_INPUT_DECOMPRESSED,
+)
+
+logger = logging.getLogger(__name__)
+
+# Codecs a verifier can decompress with the standard library alone
+OFFLINE_CODEC_PREFIXES = ("gzip-", "zlib-", "lzma-")
+
+MessageLookup = Callable[[str], Optional[Dict[str, Any]]]
+
+class BundleNotFound(LookupError):
+    """Raised when no anchored batch has the requested batch_id"""
+
+def _bundle_codec(codec_id: Optional[str]) -> str:
+    # zstd (and its trained dictionaries) would tie the bundle to this deployment
+    if codec_id and codec_id.startswith(OFFLINE_CODEC_PREFIXES):
+        return codec_id
+    return DEFAULT_CODEC_ID
+
+def batch_payload(records: List[Dict[str, Any]], hash_scheme: Optional[str], data_hash: str,
+                  codec_id: Optional[str] = None) -> Dict[str, Any]:
+    """Bundle fields describing the hashed bytes of a stored batch"""
+    if hash_scheme == HASH_SCHEME_COLUMNAR:
+        encoding, canonical = ENCODING_COLUMNAR, encode_records(records)
+    else:
+        encoding, canonical = ENCODING_JSON, serialize_batch_records(records)
+
+    if hash_scheme in (HASH_SCHEME_COLUMNAR, HASH_SCHEME_JSON_SHA256):
+        codec_id = _bundle_codec(codec_id)
+        compressed, hash_input = get_codec(codec_id).compress(canonical), HASH_INPUT_DECOMPRESSED
+    elif hash_scheme == HASH_SCHEME_JSON_GZIP:
+        codec_id, compressed, hash_input = "gzip-9", gzip_member(canonical), HASH_INPUT_COMPRESSED
+    else:
+        # Legacy gzip: the hash covers a header with the seal time, recovered by the audit search
+        _, details = recompute_batch_hash(records, hash_scheme, data_hash)
+        codec_id, hash_input = "gzip-9", HASH_INPUT_COMPRESSED
+        compressed = gzip_member(canonical, details.get("gzip_mtime", 0))
+
+    return {
+        "hash_input": hash_input,
+        "encoding": encoding,
+        "codec": codec_id,
+        "compressed_batch": base64.b64encode(compressed).decode("ascii")
+    }
+
+def build_bundle(proof: Dict[str, Any], records: List[Dict[str, Any]],
+                 hcs_message: Optional[Dict[str, Any]], topic_id: Optional[str] = None) -> Dict[str, Any]:
+    """Bundle of a proof_anchors row, its stored readings and its indexed topic message"""
+    metadata = proof.get("batch_metadata") or {}
+    hash_scheme = metadata.get("hash_scheme")
+    return {
+        "format": BUNDLE_FORMAT,
+        "version": BUNDLE_VERSION,
+        "batch_id": proof["batch_id"],
+        "data_hash": proof["data_hash"],
+        "hash_algorithm": "sha256",
+        "hash_scheme": hash_scheme,
+        **batch_payload(records, hash_scheme, proof["data_hash"], metadata.get("codec")),
+        "readings": records,
+        "batch_metadata": metadata,
+        "created_at": proof.get("created_at"),
+        "hcs": {
+            "transaction_id": proof["hcs_transaction_id"],
+            "consensus_timestamp": proof.get("consensus_timestamp"),
+            "topic_id": hcs_message["topic_id"] if hcs_message else topic_id,
+            "message_consensus_timestamp": hcs_message["consensus_timestamp"] if hcs_message else None,
+            "sequence_number": hcs_message["sequence_number"] if hcs_message else None,
+            "message": hcs_message["payload"] if hcs_message else None
+        },
+        "generated_at": datetime.now().isoformat()
+    }
+
+def load_bundle(client, batch_id: str, message_lookup: Optional[MessageLookup] = None,
+                topic_id: Optional[str] = None) -> Dict[str, Any]:
+    """Build the bundle of one anchored batch from Supabase (and the topic index)"""
+    rows = client.table("proof_anchors").select("*").eq("batch_id", batch_id).execute().data
+    if not rows:
+        raise BundleNotFound(batch_id)
+    records = load_batch_records(client, batch_id)
+    hcs_message = message_lookup(batch_id) if message_lookup else None
+    return build_bundle(rows[0], records, hcs_message, topic_id)
+
+def bundle_filename(batch_id: str) -> str:
+    return f"{batch_id}.proof.json"
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Write a proof bundle for every anchored batch")
+    parser.add_argument("--out", required=True, help="Output directory")
+    parser.add_argument("--topic-index", help="SQLite topic index (see topic_index.py) holding the HCS messages")
+    parser.add_argument("--after", help="Only batches with a batch_id after this one")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    client = get_supabase()
+    if client is None:
+        logger.error("Supabase not configured")
+        return 1
+    index = TopicIndex(args.topic_index) if args.topic_index else None
+    if index is None:
+        logger.warning("No --topic-index: bundles will not contain the HCS message")
+    os.makedirs(args.out, exist_ok=True)
+
+    written = 0
+    for proof in iter_proof_anchors(client, args.after):
+        records = load_batch_records(client, proof["batch_id"])
+        hcs_message = index.lookup_batch(proof["batch_id"]) if index else None
+        bundle = build_bundle(proof, records, hcs_message, os.getenv("HEDERA_TOPIC_ID"))
+        with open(os.path.join(args.out, bundle_filename(proof["batch_id"])), "w") as f:
+            json.dump(bundle, f)
+        written += 1
+    logger.info(f"✅ Wrote {written} proof bundles to {args.out}")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,60 @@
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict
+
+from database_models import SubmissionStatus
+from hedera_service import EnergyBatch, HederaSubmissionResult
+
+logger = logging.getLogger(__name__)
+
+def build_batch_metadata(batch: EnergyBatch) -> Dict[str, Any]:
+    """Summary stored in proof_anchors.batch_metadata"""
+    return {
+        "device_count": len(set(r.device_id for r in batch.readings)),
+        "reading_count": len(batch.readings),
+        "total_energy_kwh": sum(r.total_energy_kwh or 0 for r in batch.readings),
+        "partition_key": batch.partition_key,
+        "participant_did": batch.participant_did,
+        "hash_scheme": batch.hash_scheme,
+        "codec": batch.codec_id,
+        "compressed_size": len(batch.compressed_data)
+    }
+
+def store_batch_proof(client, hedera_result: HederaSubmissionResult) -> None:
+    """Persist the proof anchor, batch contents and pending Guardian submission of a submitted batch"""
+    batch = hedera_result.batch
+    proof_data = {
+        "batch_id": batch.batch_id,
+        "hcs_transaction_id": hedera_result.transaction_id,
+        "consensus_timestamp": hedera_result.consensus_timestamp,
+        "data_hash": batch.data_hash,
+        "batch_metadata": build_batch_metadata(batch)
+    }
+    
+    client.table("proof_anchors").insert(proof_data).execute()
+    
+    # Store batch contents
+    batch_contents = []
+    for i, batch_reading in enumerate(batch.readings):
+        batch_contents.append({
+            "batch_id": batch.batch_id,
+            "device_id": batch_reading.device_id,
+            "reading_data": batch_reading.to_dict(),
+            "original_timestamp": batch_reading.timestamp,
+            "batch_position": i
+        })
+    
+    if batch_contents:
+        client.table("batch_contents").insert(batch_contents).execute()
+    
+    # Batches sealed for a participant become pending Guardian submissions
+    if batch.participant_did:
+        client.table("guardian_submissions").insert({
+            "batch_id": batch.batch_id,
+            "participant_did": batch.participant_did,
+            "energy_data": proof_data["batch_metadata"],
+            "hedera_proof_reference": hedera_result.transaction_id,
+            "submission_status": SubmissionStatus.PENDING.value,
+            # Due now, in UTC like the worker's clock (not the database session's NOW())
+            "next_attempt_at": datetime.now(timezone.utc).isoformat()
+        }).execute()
@@ -0,0 +1,174 @@
+"""Wire formats accepted on the ESP32 ingest endpoints
+
+Three encodings are supported and selected by the request Content-Type:
+
+* ``application/json`` - the original verbose JSON object (or a list for bulk)
+* ``application/msgpack`` - the same objects encoded with MessagePack
+  (requires the optional ``msgpack`` package)
+* ``application/vnd.verifiedcc.reading`` - a fixed-layout binary struct format
+  versioned by a leading schema ID byte, decoded straight into EnergyReading
+
+Struct schema 1 (all integers little-endian)::
+
+    header:  u8 schema_id (=1) | u16 record_count
+    record:  u8 device_id_len | device_id (UTF-8)
+             u8 optional_mask   (bit i set => OPTIONAL_FIELDS[i] present)
+             i32 current_mA | i32 voltage_cV | i32 power_cW
+             then, for each present optional field in order:
+             i64 total_energy_Wh | i32 efficiency_x10000 | i32 ambient_temp_cC
+             i32 irradiance_cW_m2 | i32 power_factor_x10000
+
+Values are fixed-point so decoding is exact: a field with ``d`` decimals is
+sent as ``round(value * 10**d)`` and decoded as ``raw / 10**d``, which is the
+same float JSON parsing of the decimal text would give. A full record is 25-50 bytes versus roughly
+250 bytes of JSON.
+"""
+import json
+import struct
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from energy_reading import (
+    EnergyReading,
+    ReadingValidationError,
+    NUMERIC_FIELDS,
+    OPTIONAL_FIELDS,
+)
+
+try:
+    import msgpack
+except ImportError:  # optional dependency
+    msgpack = None
+
+CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_MSGPACK = "application/msgpack"
+CONTENT_TYPE_STRUCT = "application/vnd.verifiedcc.reading"
+
+MSGPACK_CONTENT_TYPES = frozenset({CONTENT_TYPE_MSGPACK, "application/x-msgpack"})
+STRUCT_CONTENT_TYPES = frozenset({CONTENT_TYPE_STRUCT, "application/octet-stream"})
+
+STRUCT_SCHEMA_V1 = 1
+
+# (struct format, decimal places) per numeric field, in NUMERIC_FIELDS order
+_SCHEMA_V1_FIELDS = {
+    "current": ("i", 3),
+    "voltage": ("i", 2),
+    "power": ("i", 2),
+    "total_energy_kwh": ("q", 3),
+    "efficiency": ("i", 4),
+    "ambient_temp_c": ("i", 2),
+    "irradiance_w_m2": ("i", 2),
+    "power_factor": ("i", 4),
+}
+
+_HEADER = struct.Struct("<BH")
+_REQUIRED_V1 = struct.Struct("<iii")
+_REQUIRED_DECIMALS = tuple(_SCHEMA_V1_FIELDS[name][1] for name in NUMERIC_FIELDS[:3])
+_OPTIONAL_V1 = tuple(
+    (struct.Struct("<" + _SCHEMA_V1_FIELDS[name][0]), _SCHEMA_V1_FIELDS[name][1]) for name in OPTIONAL_FIELDS
+)
+
+def _record_layout(mask: int) -> tuple:
+    """Struct plus per-field (raw index, divisor) plan for a given optional mask"""
+    fmt = "<iii"
+    plan = [(index, 10.0 ** decimals) for index, decimals in enumerate(_REQUIRED_DECIMALS)]
+    for bit, name in enumerate(OPTIONAL_FIELDS):
+        if mask & (1 << bit):
+            code, decimals = _SCHEMA_V1_FIELDS[name]
+            plan.append((len(fmt) - 1, 10.0 ** decimals))
+            fmt += code
+        else:
+            plan.append((-1, 1.0))
+    return struct.Struct(fmt), tuple(plan)
+
+# One precompiled layout per optional-field combination
+_RECORD_LAYOUTS = tuple(_record_layout(mask) for mask in range(1 << len(OPTIONAL_FIELDS)))
+
+class UnsupportedContentType(ValueError):
+    """Raised when an ingest request uses a Content-Type we cannot decode"""
+
+def media_type(content_type: Optional[str]) -> str:
+    """Normalize a Content-Type header to its bare media type"""
+    if not content_type:
+        return CONTENT_TYPE_JSON
+    return content_type.split(";", 1)[0].strip().lower()
+
+def _to_fixed(value: float, decimals: int) -> int:
+    return int(round(value * 10 ** decimals))
+
+def encode_struct_readings(payloads: Iterable[Dict[str, Any]]) -> bytes:
+    """Encode reading dicts with struct schema 1 (reference encoder for firmware and tests)"""
+    payloads = list(payloads)
+    parts = [_HEADER.pack(STRUCT_SCHEMA_V1, len(payloads))]
+    for payload in payloads:
+        device_id = payload["device_id"].encode("utf-8")
+        mask = 0
+        optional_parts = []
+        for bit, (name, (codec, decimals)) in enumerate(zip(OPTIONAL_FIELDS, _OPTIONAL_V1)):
+            value = payload.get(name)
+            if value is not None:
+                mask |= 1 << bit
+                optional_parts.append(codec.pack(_to_fixed(value, decimals)))
+        parts.append(struct.pack("<B", len(device_id)))
+        parts.append(device_id)
+        parts.append(struct.pack("<B", mask))
+        parts.append(_REQUIRED_V1.pack(*(
+            _to_fixed(payload[name], decimals) for name, decimals in zip(NUMERIC_FIELDS[:3], _REQUIRED_DECIMALS)
+        )))
+        parts.extend(optional_parts)
+    return b"".join(parts)
+
+def decode_struct_readings(body: bytes, received_at: datetime) -> List[EnergyReading]:
+    """Decode a struct-format body directly into validated readings"""
+    if len(body) < _HEADER.size:
+        raise ReadingValidationError("Binary payload too short")
+    schema_id, count = _HEADER.unpack_from(body, 0)
+    if schema_id != STRUCT_SCHEMA_V1:
+        raise ReadingValidationError(f"Unsupported binary schema ID: {schema_id}")
+
+    readings = []
+    offset = _HEADER.size
+    try:
+        for _ in range(count):
+            id_length = body[offset]
+            offset += 1
+            device_id = body[offset:offset + id_length].decode("utf-8")
+            offset += id_length
+            layout, plan = _RECORD_LAYOUTS[body[offset]]
+            offset += 1
+            raw = layout.unpack_from(body, offset)
+            offset += layout.size
+            values = [None if index < 0 else raw[index] / divisor for index, divisor in plan]
+            readings.append(EnergyReading.from_values(device_id, values, received_at))
+    except (IndexError, struct.error, UnicodeDecodeError) as e:
+        raise ReadingValidationError(f"Malformed binary payload: {e}")
+
+    if offset != len(body):
+        raise ReadingValidationError(f"Binary payload has {len(body) - offset} trailing bytes")
+    return readings
+
+def decode_readings(body: bytes, content_type: Optional[str], received_at: datetime) -> List[EnergyReading]:
+    """Decode an ingest request body (single object or list) into readings"""
+    kind = media_type(content_type)
+
+    if kind in STRUCT_CONTENT_TYPES:
+        return decode_struct_readings(body, received_at)
+
+    if kind in MSGPACK_CONTENT_TYPES:
+        if msgpack is None:
+            raise UnsupportedContentType("MessagePack support requires the 'msgpack' package")
+        try:
+            decoded = msgpack.unpackb(body, raw=False)
+        except Exception as e:
+            raise ReadingValidationError(f"Malformed MessagePack payload: {e}")
+    elif kind == CONTENT_TYPE_JSON or kind.endswith("+json"):
+        try:
+            decoded = json.loads(body)
+        except ValueError as e:
+            raise ReadingValidationError(f"Malformed JSON payload: {e}")
+    else:
+        raise UnsupportedContentType(f"Unsupported Content-Type: {kind}")
+
+    if isinstance(decoded, list):
+        return [EnergyReading.from_payload(item, received_at) for item in decoded]
+    return [EnergyReading.from_payload(decoded, received_at)]
@@ -0,0 +1,191 @@
+"""Streaming anomaly screening of readings before they are batched for anchoring
+
+Every reading gets a ``quality_flags`` bitmask. Readings with a flag in the
+quarantine mask are stored for review but never batched, so they are neither
+anchored on HCS nor counted towards credits; the remaining flags are
+informational and travel with the anchored reading.
+
+Rolling per-device state lives in parallel ``array`` columns indexed by a
+device slot (a few dozen bytes per device) and every check is O(1).
+"""
+import math
+import os
+from array import array
+from collections import Counter, deque
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional, Tuple
+
+from energy_reading import EnergyReading
+
+# Quality flag bits
+QF_NEGATIVE_POWER = 1 << 0
+QF_VOLTAGE_OUTLIER = 1 << 1
+QF_POWER_EXCEEDS_APPARENT = 1 << 2
+QF_FROZEN_SENSOR = 1 << 3
+QF_COUNTER_REGRESSION = 1 << 4
+QF_POWER_SPIKE = 1 << 5
+
+QUALITY_FLAG_NAMES = {
+    QF_NEGATIVE_POWER: "negative_power",
+    QF_VOLTAGE_OUTLIER: "voltage_outlier",
+    QF_POWER_EXCEEDS_APPARENT: "power_exceeds_apparent",
+    QF_FROZEN_SENSOR: "frozen_sensor",
+    QF_COUNTER_REGRESSION: "counter_regression",
+    QF_POWER_SPIKE: "power_spike",
+}
+
+DEFAULT_QUARANTINE_MASK = (
+    QF_NEGATIVE_POWER | QF_VOLTAGE_OUTLIER | QF_POWER_EXCEEDS_APPARENT | QF_FROZEN_SENSOR | QF_COUNTER_REGRESSION
+)
+
+def flag_names(flags: int) -> List[str]:
+    return [name for bit, name in QUALITY_FLAG_NAMES.items() if flags & bit]
+
+@dataclass
+class ScreeningConfig:
+    # EWMA smoothing for the rolling voltage/power mean and variance
+    alpha: float = 0.05
+    # Samples per device before the statistical checks start flagging
+    warmup: int = 20
+    voltage_sigmas: float = 6.0
+    power_sigmas: float = 6.0
+    # Floors so a very steady signal does not flag ordinary noise
+    min_voltage_sigma: float = 1.0
+    min_power_sigma: float = 5.0
+    # Identical current/voltage/power this many times in a row means a stuck sensor
+    frozen_run: int = 10
+    # Real power may exceed V*I by this factor plus slack (W) for measurement error
+    apparent_power_tolerance: float = 1.1
+    apparent_power_slack: float = 5.0
+    negative_power_tolerance: float = 1.0
+    counter_tolerance_kwh: float = 0.001
+    quarantine_mask: int = DEFAULT_QUARANTINE_MASK
+
+    @classmethod
+    def from_env(cls) -> "ScreeningConfig":
+        return cls(
+            frozen_run=int(os.getenv("SCREENING_FROZEN_RUN", "10")),
+            quarantine_mask=int(os.getenv("SCREENING_QUARANTINE_MASK", str(DEFAULT_QUARANTINE_MASK)))
+        )
+
+class ReadingScreener:
+    def __init__(self, config: Optional[ScreeningConfig] = None, quarantine_history: int = 1000):
+        self.config = config or ScreeningConfig()
+        self.slots: Dict[str, int] = {}
+        # Per-device columns, indexed by slot
+        self.samples = array("I")
+        self.voltage_mean = array("d")
+        self.voltage_var = array("d")
+        self.power_mean = array("d")
+        self.power_var = array("d")
+        self.last_current = array("d")
+        self.last_voltage = array("d")
+        self.last_power = array("d")
+        self.same_run = array("I")
+        # NaN until the device reports a counter
+        self.last_energy = array("d")
+        self.screened = 0
+        self.quarantined = 0
+        self.flag_counts: Counter = Counter()
+        self.quarantine: Deque[EnergyReading] = deque(maxlen=quarantine_history)
+
+    def _slot(self, device_id: str) -> int:
+        slot = self.slots.get(device_id)
+        if slot is None:
+            slot = self.slots[device_id] = len(self.samples)
+            for column in (self.samples, self.same_run):
+                column.append(0)
+            for column in (self.voltage_mean, self.voltage_var, self.power_mean, self.power_var,
+                           self.last_current, self.last_voltage, self.last_power):
+                column.append(0.0)
+            self.last_energy.append(math.nan)
+        return slot
+
+    def screen(self, reading: EnergyReading) -> bool:
+        """Set ``reading.quality_flags``; return True if the reading may be anchored"""
+        config = self.config
+        slot = self._slot(reading.device_id)
+        current, voltage, power = reading.current, reading.voltage, reading.power
+        flags = 0
+
+        if power < -config.negative_power_tolerance:
+            flags |= QF_NEGATIVE_POWER
+        if abs(power) > abs(voltage * current) * config.apparent_power_tolerance + config.apparent_power_slack:
+            flags |= QF_POWER_EXCEEDS_APPARENT
+
+        if current == self.last_current[slot] and voltage == self.last_voltage[slot] and power == self.last_power[slot]:
+            self.same_run[slot] += 1
+            if self.same_run[slot] >= config.frozen_run:
+                flags |= QF_FROZEN_SENSOR
+        else:
+            self.same_run[slot] = 1
+            self.last_current[slot] = current
+            self.last_voltage[slot] = voltage
+            self.last_power[slot] = power
+
+        energy = reading.total_energy_kwh
+        if energy is not None:
+            last_energy = self.last_energy[slot]
+            if energy < last_energy - config.counter_tolerance_kwh:
+                flags |= QF_COUNTER_REGRESSION
+            # Follow the counter even when it went backwards so a device reset is flagged once
+            self.last_energy[slot] = energy
+
+        samples = self.samples[slot]
+        if samples >= config.warmup:
+            voltage_sigma = max(math.sqrt(self.voltage_var[slot]), config.min_voltage_sigma)
+            if abs(voltage - self.voltage_mean[slot]) > config.voltage_sigmas * voltage_sigma:
+                flags |= QF_VOLTAGE_OUTLIER
+            power_sigma = max(math.sqrt(self.power_var[slot]), config.min_power_sigma)
+            if abs(power - self.power_mean[slot]) > config.power_sigmas * power_sigma:
+                flags |= QF_POWER_SPIKE
+
+        anchorable = not flags & config.quarantine_mask
+        if anchorable:
+            # Only accepted readings move the rolling statistics
+            if samples == 0:
+                self.voltage_mean[slot] = voltage
+                self.power_mean[slot] = power
+            else:
+                alpha = config.alpha
+                delta = voltage - self.voltage_mean[slot]
+                self.voltage_mean[slot] += alpha * delta
+                self.voltage_var[slot] = (1 - alpha) * (self.voltage_var[slot] + alpha * delta * delta)
+                delta = power - self.power_mean[slot]
+                self.power_mean[slot] += alpha * delta
+                self.power_var[slot] = (1 - alpha) * (self.power_var[slot] + alpha * delta * delta)
+            self.samples[slot] = samples + 1
+
+        self.screened += 1
+        if flags:
+            reading.quality_flags = flags
+            for bit in QUALITY_FLAG_NAMES:
+                if flags & bit:
+                    self.flag_counts[bit] += 1
+        if not anchorable:
+            self.quarantined += 1
+            self.quarantine.append(reading)
+        return anchorable
+
+    def screen_all(self, readings: List[EnergyReading]) -> Tuple[List[EnergyReading], List[EnergyReading]]:
+        """Split readings into (anchorable, quarantined)"""
+        accepted, quarantined = [], []
+        for reading in readings:
+            (accepted if self.screen(reading) else quarantined).append(reading)
+        return accepted, quarantined
+
+    def is_quarantined(self, reading: EnergyReading) -> bool:
+        return bool(reading.quality_flags & self.config.quarantine_mask)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "screened_readings": self.screened,
+            "quarantined_readings": self.quarantined,
+            "tracked_devices": len(self.slots),
+            "quarantine_mask": flag_names(self.config.quarantine_mask),
+            "flags": {QUALITY_FLAG_NAMES[bit]: count for bit, count in self.flag_counts.items()}
+        }
+
+    def recent_quarantine(self, limit: int = 100) -> List[Dict[str, object]]:
+        readings = list(self.quarantine)[-limit:]
+        return [{**r.to_dict(), "flags": flag_names(r.quality_flags)} for r in reversed(readings)]
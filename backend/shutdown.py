@@ -0,0 +1,109 @@
+"""Graceful shutdown: stop taking ingest, drain in-flight work, report
+
+On SIGTERM/SIGINT ``GracefulServer`` flips the coordinator into draining
+before uvicorn starts closing connections, so ingest endpoints answer 503
+with Retry-After, device frames are refused and SSE streams end instead of
+holding the shutdown open. The app lifespan then runs the drain steps
+(seal and submit open batches, wait for HCS and Guardian submissions,
+flush broadcasts, close clients) under one deadline, and the report says
+what was drained and what, if anything, was left behind.
+"""
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import uvicorn
+
+logger = logging.getLogger(__name__)
+
+DrainStep = Callable[[], Awaitable[Optional[Dict[str, Any]]]]
+
+@dataclass
+class StepResult:
+    name: str
+    status: str
+    elapsed_ms: float
+    details: Dict[str, Any] = field(default_factory=dict)
+
+async def wait_until(condition: Callable[[], bool], interval: float = 0.05) -> None:
+    """Poll until ``condition()`` is true; bounded by the caller's deadline"""
+    while not condition():
+        await asyncio.sleep(interval)
+
+class ShutdownCoordinator:
+    def __init__(self, deadline_seconds: float = 20.0, retry_after_seconds: int = 5):
+        self.deadline_seconds = deadline_seconds
+        self.retry_after_seconds = retry_after_seconds
+        self.draining = False
+        self.drain_started_at: Optional[datetime] = None
+        self._on_begin: List[Callable[[], None]] = []
+        self.report: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def from_env(cls) -> "ShutdownCoordinator":
+        return cls(deadline_seconds=float(os.getenv("SHUTDOWN_DEADLINE_SECONDS", "20")))
+
+    def on_begin(self, callback: Callable[[], None]) -> None:
+        """Run ``callback`` (synchronously) when draining starts"""
+        self._on_begin.append(callback)
+
+    def begin(self) -> None:
+        """Stop accepting new work; safe to call more than once"""
+        if self.draining:
+            return
+        self.draining = True
+        self.drain_started_at = datetime.now()
+        for callback in self._on_begin:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Shutdown hook failed: {e}")
+
+    async def drain(self, steps: List[tuple]) -> Dict[str, Any]:
+        """Run (name, step) pairs in order within the shared deadline and return the report
+
+        A step that runs past the remaining time is cancelled and reported as a
+        timeout; later steps still run (with whatever time is left, at least a
+        short grace) so clients are always closed.
+        """
+        self.begin()
+        started = time.monotonic()
+        deadline = started + self.deadline_seconds
+        results = []
+        for name, step in steps:
+            step_started = time.monotonic()
+            remaining = max(deadline - step_started, 0.5)
+            try:
+                details = await asyncio.wait_for(step(), remaining)
+                status = "ok"
+            except asyncio.TimeoutError:
+                details, status = None, "timeout"
+                logger.warning(f"Shutdown step {name} did not finish in {remaining:.1f}s")
+            except Exception as e:
+                details, status = {"error": str(e)}, "error"
+                logger.error(f"Shutdown step {name} failed: {e}")
+            results.append(StepResult(name, status, round((time.monotonic() - step_started) * 1000, 1), details or {}))
+
+        self.report = {
+            "drain_started_at": self.drain_started_at.isoformat(),
+            "elapsed_seconds": round(time.monotonic() - started, 3),
+            "deadline_seconds": self.deadline_seconds,
+            "clean": all(result.status == "ok" for result in results),
+            "steps": [result.__dict__ for result in results]
+        }
+        return self.report
+
+class GracefulServer(uvicorn.Server):
+    """uvicorn server that starts draining as soon as the exit signal arrives"""
+
+    def __init__(self, config: uvicorn.Config, coordinator: ShutdownCoordinator):
+        super().__init__(config)
+        self.coordinator = coordinator
+
+    def handle_exit(self, sig, frame) -> None:
+        self.coordinator.begin()
+        super().handle_exit(sig, frame)
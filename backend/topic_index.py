@@ -0,0 +1,264 @@
+"""Local index of the HCS topic our batch proofs are published to
+
+``TopicSync`` pages through the topic's messages on a mirror node
+(``GET /api/v1/topics/{topic_id}/messages``) in consensus order, starting
+after the last consensus timestamp it has seen, and stores every
+``energy_batch_proof`` message in a SQLite index keyed by batch_id and
+data_hash. Verifying a proof is then a local lookup; only the incremental
+sync talks to the network.
+
+``LocalTopicSource`` is an in-memory stand-in for the mirror node with the
+same paging semantics, for running without Hedera credentials.
+"""
+import asyncio
+import base64
+import json
+import logging
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Protocol
+
+import httpx
+
+from hedera_service import MESSAGE_TYPE_BATCH_PROOF
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIRROR_NODE_URL = "https://testnet.mirrornode.hedera.com"
+PAGE_LIMIT = 100
+
+@dataclass
+class TopicMessage:
+    consensus_timestamp: str
+    sequence_number: int
+    contents: bytes
+
+    @classmethod
+    def from_mirror(cls, item: Dict[str, Any]) -> "TopicMessage":
+        return cls(
+            consensus_timestamp=item["consensus_timestamp"],
+            sequence_number=item["sequence_number"],
+            contents=base64.b64decode(item["message"])
+        )
+
+@dataclass
+class BatchProofMessage:
+    batch_id: str
+    data_hash: str
+    consensus_timestamp: str
+    sequence_number: int
+    reading_count: Optional[int]
+    payload: Dict[str, Any]
+
+def timestamp_key(consensus_timestamp: str) -> tuple:
+    """Sortable (seconds, nanos) key for a mirror node "seconds.nanos" timestamp"""
+    seconds, _, nanos = consensus_timestamp.partition(".")
+    return int(seconds), int(nanos.ljust(9, "0"))
+
+def parse_batch_proof(message: TopicMessage) -> Optional[BatchProofMessage]:
+    """Decode one of our batch proof messages; None for anything else on the topic"""
+    try:
+        payload = json.loads(message.contents)
+    except ValueError:
+        return None
+    if not isinstance(payload, dict):
+        return None
+    # Messages published before the type field was added carry batch_id and data_hash only
+    if payload.get("type", MESSAGE_TYPE_BATCH_PROOF) != MESSAGE_TYPE_BATCH_PROOF:
+        return None
+    if not isinstance(payload.get("batch_id"), str) or not isinstance(payload.get("data_hash"), str):
+        return None
+    return BatchProofMessage(
+        batch_id=payload["batch_id"],
+        data_hash=payload["data_hash"],
+        consensus_timestamp=message.consensus_timestamp,
+        sequence_number=message.sequence_number,
+        reading_count=payload.get("reading_count"),
+        payload=payload
+    )
+
+class TopicSource(Protocol):
+    async def fetch_page(self, topic_id: str, after: Optional[str], limit: int) -> List[TopicMessage]:
+        """Messages with a consensus timestamp after ``after``, oldest first"""
+        ...
+
+class MirrorNodeSource:
+    def __init__(self, base_url: str = DEFAULT_MIRROR_NODE_URL, client: Optional[httpx.AsyncClient] = None):
+        self.base_url = base_url.rstrip("/")
+        self.client = client or httpx.AsyncClient(timeout=30.0)
+
+    async def fetch_page(self, topic_id: str, after: Optional[str], limit: int) -> List[TopicMessage]:
+        params = {"order": "asc", "limit": limit}
+        if after:
+            params["timestamp"] = f"gt:{after}"
+        response = await self.client.get(f"{self.base_url}/api/v1/topics/{topic_id}/messages", params=params)
+        response.raise_for_status()
+        return [TopicMessage.from_mirror(item) for item in response.json().get("messages", [])]
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+class LocalTopicSource:
+    """In-memory topic with mirror node paging semantics"""
+
+    def __init__(self):
+        self.messages: Dict[str, List[TopicMessage]] = {}
+        self._clock = 0
+
+    def publish(self, topic_id: str, message: Any) -> TopicMessage:
+        """Append a message (dict, str or bytes) and assign it a consensus timestamp"""
+        if isinstance(message, dict):
+            message = json.dumps(message)
+        if isinstance(message, str):
+            message = message.encode("utf-8")
+        topic = self.messages.setdefault(topic_id, [])
+        self._clock += 1
+        now = datetime.now().timestamp()
+        entry = TopicMessage(
+            consensus_timestamp=f"{int(now)}.{self._clock:09d}",
+            sequence_number=len(topic) + 1,
+            contents=message
+        )
+        topic.append(entry)
+        return entry
+
+    async def fetch_page(self, topic_id: str, after: Optional[str], limit: int) -> List[TopicMessage]:
+        topic = self.messages.get(topic_id, [])
+        if after:
+            cursor = timestamp_key(after)
+            topic = [m for m in topic if timestamp_key(m.consensus_timestamp) > cursor]
+        return topic[:limit]
+
+    async def close(self) -> None:
+        pass
+
+class TopicIndex:
+    """SQLite index of batch proof messages plus the sync cursor per topic"""
+
+    def __init__(self, path: str = ":memory:"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS batch_proof_messages (
+                topic_id TEXT NOT NULL,
+                sequence_number INTEGER NOT NULL,
+                consensus_timestamp TEXT NOT NULL,
+                batch_id TEXT NOT NULL,
+                data_hash TEXT NOT NULL,
+                reading_count INTEGER,
+                payload TEXT NOT NULL,
+                PRIMARY KEY (topic_id, sequence_number)
+            );
+            CREATE INDEX IF NOT EXISTS idx_batch_proof_messages_batch_id ON batch_proof_messages(batch_id);
+            CREATE INDEX IF NOT EXISTS idx_batch_proof_messages_data_hash ON batch_proof_messages(data_hash);
+            CREATE TABLE IF NOT EXISTS topic_sync_state (
+                topic_id TEXT PRIMARY KEY,
+                last_consensus_timestamp TEXT,
+                messages_seen INTEGER NOT NULL DEFAULT 0,
+                synced_at TEXT
+            );
+        """)
+
+    def cursor(self, topic_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT last_consensus_timestamp FROM topic_sync_state WHERE topic_id = ?", (topic_id,)
+            ).fetchone()
+        return row["last_consensus_timestamp"] if row else None
+
+    def store_page(self, topic_id: str, messages: List[TopicMessage]) -> int:
+        """Index a page and advance the cursor in one transaction; return the proofs indexed"""
+        proofs = [p for p in (parse_batch_proof(m) for m in messages) if p is not None]
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO batch_proof_messages VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (topic_id, p.sequence_number, p.consensus_timestamp, p.batch_id, p.data_hash,
+                     p.reading_count, json.dumps(p.payload))
+                    for p in proofs
+                ]
+            )
+            if messages:
+                self._db.execute(
+                    """INSERT INTO topic_sync_state (topic_id, last_consensus_timestamp, messages_seen, synced_at)
+                       VALUES (?, ?, ?, ?)
+                       ON CONFLICT(topic_id) DO UPDATE SET
+                           last_consensus_timestamp = excluded.last_consensus_timestamp,
+                           messages_seen = messages_seen + excluded.messages_seen,
+                           synced_at = excluded.synced_at""",
+                    (topic_id, messages[-1].consensus_timestamp, len(messages), datetime.now().isoformat())
+                )
+        return len(proofs)
+
+    def _rows(self, column: str, value: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT * FROM batch_proof_messages WHERE {column} = ? ORDER BY sequence_number", (value,)
+            ).fetchall()
+        return [{**dict(row), "payload": json.loads(row["payload"])} for row in rows]
+
+    def lookup_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """First message published for a batch (later duplicates do not override it)"""
+        rows = self._rows("batch_id", batch_id)
+        return rows[0] if rows else None
+
+    def lookup_hash(self, data_hash: str) -> List[Dict[str, Any]]:
+        return self._rows("data_hash", data_hash)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            indexed = self._db.execute("SELECT COUNT(*) FROM batch_proof_messages").fetchone()[0]
+            topics = [dict(row) for row in self._db.execute("SELECT * FROM topic_sync_state")]
+        return {"indexed_batch_proofs": indexed, "topics": topics}
+
+    def close(self) -> None:
+        self._db.close()
+
+class TopicSync:
+    def __init__(self, topic_id: str, source: TopicSource, index: TopicIndex, page_limit: int = PAGE_LIMIT):
+        self.topic_id = topic_id
+        self.source = source
+        self.index = index
+        self.page_limit = page_limit
+        self.last_error: Optional[str] = None
+
+    async def sync_once(self) -> int:
+        """Pull every message after the stored cursor; return the number of batch proofs indexed"""
+        indexed = 0
+        while True:
+            page = await self.source.fetch_page(self.topic_id, self.index.cursor(self.topic_id), self.page_limit)
+            if not page:
+                return indexed
+            indexed += await asyncio.to_thread(self.index.store_page, self.topic_id, page)
+            if len(page) < self.page_limit:
+                return indexed
+
+    async def run(self, interval_seconds: float = 30.0) -> None:
+        """Sync forever; mirror node errors are logged and retried next interval"""
+        while True:
+            try:
+                indexed = await self.sync_once()
+                self.last_error = None
+                if indexed:
+                    logger.info(f"📥 Indexed {indexed} batch proof messages from topic {self.topic_id}")
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Topic sync failed for {self.topic_id}: {e}")
+            await asyncio.sleep(interval_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"topic_id": self.topic_id, "last_error": self.last_error, **self.index.stats()}
+
+def create_topic_sync() -> Optional[TopicSync]:
+    """Topic sync configured from the environment, or None when no topic is configured"""
+    topic_id = os.getenv("HEDERA_TOPIC_ID")
+    if not topic_id:
+        return None
+    source = MirrorNodeSource(os.getenv("HEDERA_MIRROR_NODE_URL", DEFAULT_MIRROR_NODE_URL))
+    index = TopicIndex(os.getenv("TOPIC_INDEX_PATH", "topic_index.sqlite3"))
+    return TopicSync(topic_id, source, index)
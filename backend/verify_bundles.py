@@ -0,0 +1,207 @@
+"""Offline verifier for proof bundles (see proof_bundle.py)
+
+Usage::
+
+    python verify_bundles.py bundles/ --workers 8 --report verify_report.json
+
+A bundle is one JSON document holding everything needed to check a batch
+without network access: the compressed batch, its readings, the stored
+``data_hash`` and the HCS message published for it. For every bundle the
+verifier
+
+1. decompresses the batch with the recorded codec,
+2. recomputes SHA-256 over the hash input (the decompressed canonical bytes,
+   or the compressed bytes for the gzip hash schemes) and compares it with
+   ``data_hash``,
+3. re-encodes the bundled readings and checks they are exactly the canonical
+   bytes that were hashed,
+4. checks the HCS message names the same batch and ``data_hash``, and that
+   its consensus timestamp matches the anchor's.
+
+Bundles are verified in a process pool. Only the standard library plus
+``batch_codecs`` and ``batch_encoding`` are needed (``zstandard`` for
+bundles of zstd batches).
+"""
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+from batch_codecs import get_codec
+from batch_encoding import BatchEncodingError, encode_records
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_FORMAT = "verifiedcc-proof-bundle"
+BUNDLE_VERSION = 1
+ENCODING_COLUMNAR = "columnar-v1"
+ENCODING_JSON = "json"
+# Whether data_hash covers the decompressed canonical bytes or the compressed batch
+HASH_INPUT_DECOMPRESSED = "decompressed"
+HASH_INPUT_COMPRESSED = "compressed"
+
+@dataclass
+class BundleVerification:
+    path: str
+    batch_id: Optional[str] = None
+    status: str = "ok"
+    hcs_status: str = "unchecked"
+    issues: List[str] = field(default_factory=list)
+
+def _consensus_key(value: Any) -> Optional[tuple]:
+    """(seconds, nanos) for a "seconds.nanos" consensus timestamp; None for other formats"""
+    if not isinstance(value, str):
+        return None
+    seconds, _, nanos = value.partition(".")
+    if not seconds.isdigit() or (nanos and not nanos.isdigit()):
+        return None
+    return int(seconds), int(nanos.ljust(9, "0"))
+
+def canonical_bytes(encoding: str, readings: List[Dict[str, Any]]) -> bytes:
+    """Canonical bytes of the readings in a bundle's encoding"""
+    if encoding == ENCODING_COLUMNAR:
+        return encode_records(readings)
+    if encoding == ENCODING_JSON:
+        return json.dumps(readings, sort_keys=True).encode("utf-8")
+    raise ValueError(f"unknown encoding {encoding}")
+
+def verify_bundle(bundle: Dict[str, Any], allow_missing_hcs: bool = False) -> BundleVerification:
+    """Check one parsed bundle; the result lists every failed check"""
+    result = BundleVerification(path="", batch_id=bundle.get("batch_id"))
+    issues = result.issues
+    if bundle.get("format") != BUNDLE_FORMAT or bundle.get("version") != BUNDLE_VERSION:
+        issues.append("unsupported_bundle_format")
+        result.status = "failed"
+        return result
+
+    data_hash = bundle.get("data_hash")
+    decompressed = None
+    try:
+        compressed = base64.b64decode(bundle["compressed_batch"])
+        decompressed = get_codec(bundle["codec"]).decompress(compressed)
+    except ValueError as e:
+        # Unknown codec (e.g. zstd without the package) or corrupt data
+        issues.append("codec_unavailable" if "Unknown batch codec" in str(e) else "decompress_failed")
+    except Exception:
+        issues.append("decompress_failed")
+
+    if decompressed is not None:
+        hash_input = compressed if bundle.get("hash_input") == HASH_INPUT_COMPRESSED else decompressed
+        if hashlib.sha256(hash_input).hexdigest() != data_hash:
+            issues.append("hash_mismatch")
+        readings = bundle.get("readings") or []
+        try:
+            if canonical_bytes(bundle.get("encoding"), readings) != decompressed:
+                issues.append("readings_mismatch")
+        except (BatchEncodingError, ValueError, TypeError, KeyError):
+            issues.append("readings_mismatch")
+        reading_count = (bundle.get("batch_metadata") or {}).get("reading_count")
+        if reading_count not in (None, len(readings)):
+            issues.append("reading_count_mismatch")
+
+    hcs = bundle.get("hcs") or {}
+    message = hcs.get("message")
+    if message is None:
+        result.hcs_status = "missing"
+        if not allow_missing_hcs:
+            issues.append("hcs_message_missing")
+    else:
+        result.hcs_status = "match"
+        if message.get("data_hash") != data_hash:
+            issues.append("hcs_hash_mismatch")
+        if message.get("batch_id") != bundle.get("batch_id"):
+            issues.append("hcs_batch_mismatch")
+        anchored, published = _consensus_key(hcs.get("consensus_timestamp")), _consensus_key(hcs.get("message_consensus_timestamp"))
+        if anchored is not None and published is not None and anchored != published:
+            issues.append("hcs_timestamp_mismatch")
+        if any(issue.startswith("hcs_") for issue in issues):
+            result.hcs_status = "mismatch"
+
+    if issues:
+        result.status = "failed"
+    return result
+
+def load_bundle(path: str) -> Dict[str, Any]:
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        return json.load(f)
+
+def verify_bundle_file(path: str, allow_missing_hcs: bool = False) -> BundleVerification:
+    try:
+        bundle = load_bundle(path)
+    except (OSError, ValueError):
+        return BundleVerification(path=path, status="failed", issues=["unreadable_bundle"])
+    result = verify_bundle(bundle, allow_missing_hcs)
+    result.path = path
+    return result
+
+def iter_bundle_paths(paths: List[str]) -> Iterator[str]:
+    """Bundle files among the given files and directories (searched recursively)"""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, _, files in os.walk(path):
+            for name in sorted(files):
+                if name.endswith((".json", ".json.gz")):
+                    yield os.path.join(root, name)
+
+def verify_bundles(paths: List[str], workers: Optional[int] = None,
+                   allow_missing_hcs: bool = False) -> Dict[str, Any]:
+    """Verify bundle files in a process pool and return the report"""
+    started = time.perf_counter()
+    checked = 0
+    failures = []
+    bundle_paths = list(iter_bundle_paths(paths))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(verify_bundle_file, bundle_paths, [allow_missing_hcs] * len(bundle_paths), chunksize=16)
+        for result in results:
+            checked += 1
+            if result.status != "ok":
+                failures.append(asdict(result))
+                logger.warning(f"❌ {result.path} ({result.batch_id}): {', '.join(result.issues)}")
+    elapsed = time.perf_counter() - started
+    return {
+        "report_type": "proof_bundle_verification",
+        "generated_at": datetime.now().isoformat(),
+        "bundles_checked": checked,
+        "bundles_ok": checked - len(failures),
+        "bundles_failed": len(failures),
+        "hcs_required": not allow_missing_hcs,
+        "elapsed_seconds": round(elapsed, 3),
+        "bundles_per_second": round(checked / elapsed, 2) if elapsed > 0 else None,
+        "failures": failures
+    }
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Verify proof bundles offline")
+    parser.add_argument("paths", nargs="+", help="Bundle files or directories of bundles (.json / .json.gz)")
+    parser.add_argument("--workers", type=int, default=None, help="Verifier processes (default: CPU count)")
+    parser.add_argument("--allow-missing-hcs", action="store_true",
+                        help="Accept bundles exported before their HCS message was indexed")
+    parser.add_argument("--report", help="Write the JSON report here")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    report = verify_bundles(args.paths, args.workers, args.allow_missing_hcs)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    logger.info(
+        f"Verified {report['bundles_checked']} bundles ({report['bundles_per_second']} bundles/s): "
+        f"{report['bundles_failed']} failed"
+    )
+    return 1 if report["bundles_failed"] or not report["bundles_checked"] else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
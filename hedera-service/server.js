@@ -121,19 +121,39 @@ app.get('/api/hcs/transaction/:transactionId', async (req, res) => {
     }
 });
 
-// Get topic messages (placeholder - would use Mirror Node API)
+// Get topic messages from the Mirror Node, oldest first, after an optional consensus timestamp
+const mirrorNodeUrl = process.env.HEDERA_MIRROR_NODE_URL ||
+    (process.env.HEDERA_NETWORK === 'mainnet'
+        ? 'https://mainnet.mirrornode.hedera.com'
+        : 'https://testnet.mirrornode.hedera.com');
+
 app.get('/api/hcs/topic/:topicId/messages', async (req, res) => {
     try {
         const { topicId } = req.params;
-        const { limit = 10 } = req.query;
+        const { limit = 10, after } = req.query;
         
         console.log(`📋 Querying messages for topic: ${topicId}`);
         
-        // Placeholder response - in production use Mirror Node API
+        const params = new URLSearchParams({ order: 'asc', limit: String(Math.min(Number(limit) || 10, 100)) });
+        if (after) {
+            params.set('timestamp', `gt:${after}`);
+        }
+        const response = await fetch(`${mirrorNodeUrl}/api/v1/topics/${topicId}/messages?${params}`);
+        if (!response.ok) {
+            return res.status(response.status).json({
+                error: 'Mirror Node request failed',
+                details: await response.text()
+            });
+        }
+        const data = await response.json();
+        
         res.json({
             topicId: topicId,
-            messages: [],
-            note: 'Use Mirror Node API to retrieve topic messages'
+            messages: (data.messages || []).map((message) => ({
+                consensusTimestamp: message.consensus_timestamp,
+                sequenceNumber: message.sequence_number,
+                message: Buffer.from(message.message, 'base64').toString('utf8')
+            }))
         });
 
     } catch (error) {